@@ -24,15 +24,30 @@ SOLVENT_VOL=2
 AMINE_NAME="1S_2S_amine"
 AMINE_VOL=2
 
+CHAIN_LIQUIDS=0 # 1: add solvent and amine to each vial in turn without parking it in the rack (changes the addition order)
+
 
 
 
 read_robot_state(){
-    python $LOCAL_PATH/src/read_current_state.py
-    python $LOCAL_PATH/src/read_current_state.py
+    #served from the station session's cached state monitor when a session is running
     python $LOCAL_PATH/src/read_current_state.py
 }
 
+start_station_session(){
+    #the steps authenticate to the session with this key
+    export ROBINHOOD_SESSION_KEY=${ROBINHOOD_SESSION_KEY:-$(python -c "import secrets; print(secrets.token_hex(16))")}
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session serve $DATASET_PATH &
+    SESSION_PID=$!
+    trap stop_station_session EXIT
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session wait
+}
+
+stop_station_session(){
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session stop
+    wait $SESSION_PID || true
+}
+
 if [ ! -d "$DATASET_PATH" ]; then
     echo "[WARNING] Directory $DATASET_PATH does not exist."
     mkdir -p "$DATASET_PATH"
@@ -41,6 +56,21 @@ else
     echo "[INFO] Directory $DATASET_PATH already exists."
 fi
 
+#Run with --resume to skip the steps a failed run already completed
+if [ "$1" == "--resume" ]; then
+    echo "[INFO] Resuming from the step journal"
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.journal resume $DATASET_PATH
+else
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.journal start $DATASET_PATH --name CC3_solid_synth
+    rm -f $DATASET_PATH/trace_spans.jsonl
+fi
+export WORKFLOW_JOURNAL=$DATASET_PATH
+#Every station call is timed in trace_spans.jsonl
+export WORKFLOW_TRACE=$DATASET_PATH
+
+echo "[INFO] Starting station session"
+start_station_session
+
 echo "[INFO] Starting CC3 synth workflow."
 read_robot_state
 
@@ -50,19 +80,31 @@ for SAMPLE in "${SAMPLES[@]}"; do
     read_robot_state
 done
 
-for SAMPLE in "${SAMPLES[@]}"; do
-    echo "[INFO] Processing sample $SAMPLE"
-    python $LOCAL_PATH/src/CC3_synth_solid.py "dispense_solvent" $SAMPLE $DATASET_PATH $SOLVENT_NAME $SOLVENT_VOL
-    read_robot_state
-done
-
-for SAMPLE in "${SAMPLES[@]}"; do
-    echo "[INFO] Processing sample $SAMPLE"
-    python $LOCAL_PATH/src/CC3_synth_solid.py "add_amine_and_cap" $SAMPLE $DATASET_PATH $AMINE_NAME $AMINE_VOL
-    read_robot_state
-done
+if [ "$CHAIN_LIQUIDS" == "1" ]; then
+    #Solvent and amine are added while the vial stays at the pump, then it is capped
+    for SAMPLE in "${SAMPLES[@]}"; do
+        echo "[INFO] Processing sample $SAMPLE"
+        python $LOCAL_PATH/src/CC3_synth_solid.py "add_liquids_and_cap" $SAMPLE $DATASET_PATH $SOLVENT_NAME $SOLVENT_VOL $AMINE_NAME $AMINE_VOL
+        read_robot_state
+    done
+else
+    for SAMPLE in "${SAMPLES[@]}"; do
+        echo "[INFO] Processing sample $SAMPLE"
+        python $LOCAL_PATH/src/CC3_synth_solid.py "dispense_solvent" $SAMPLE $DATASET_PATH $SOLVENT_NAME $SOLVENT_VOL
+        read_robot_state
+    done
+
+    for SAMPLE in "${SAMPLES[@]}"; do
+        echo "[INFO] Processing sample $SAMPLE"
+        python $LOCAL_PATH/src/CC3_synth_solid.py "add_amine_and_cap" $SAMPLE $DATASET_PATH $AMINE_NAME $AMINE_VOL
+        read_robot_state
+    done
+fi
 
 echo "[INFO] All samples processed successfully."
+echo "[INFO] Station timing summary:"
+PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.tracing $DATASET_PATH --chrome $DATASET_PATH/trace.json
+
 echo "[INFO] Results saved in $DATASET_PATH"
 echo "[INFO] Workflow completed successfully."
 # End of CC3 synth workflow
\ No newline at end of file
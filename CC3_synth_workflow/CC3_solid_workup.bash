@@ -14,6 +14,7 @@ DATASET_PATH="$LOCAL_PATH/data"
 
 
 SAMPLES=(1 2 3) #vials to filter
+PRODUCTS=("CC3" "CC3" "CC3") #product in each vial; only neighbouring vials of the same product may share the filter
 
 FILTER_VOLUME=4 # Volume of the filter to be used in the workflow should be the sum of the volumes used in synthesis
 
@@ -27,11 +28,26 @@ WASH_VOLUME=8 # Volume of the wash solvent to be used in the workflow
 WASH_SOLVENT="95Ethanol_5DCM" # Solvent used to wash the solid after filtration
 WASH_CYCLE=2 # Number of times the wash will be performed
 
+MAX_FILTER_GROUP=1 # Samples per filter prep and clean; raise it (0: no limit) to let vials of the same product share the filter
+
 
 read_robot_state(){
+    #served from the station session's cached state monitor when a session is running
     python $LOCAL_PATH/src/read_current_state.py
-    python $LOCAL_PATH/src/read_current_state.py
-    python $LOCAL_PATH/src/read_current_state.py
+}
+
+start_station_session(){
+    #the steps authenticate to the session with this key
+    export ROBINHOOD_SESSION_KEY=${ROBINHOOD_SESSION_KEY:-$(python -c "import secrets; print(secrets.token_hex(16))")}
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session serve $DATASET_PATH &
+    SESSION_PID=$!
+    trap stop_station_session EXIT
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session wait
+}
+
+stop_station_session(){
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session stop
+    wait $SESSION_PID || true
 }
 
 if [ ! -d "$DATASET_PATH" ]; then
@@ -42,24 +58,37 @@ else
     echo "[INFO] Directory $DATASET_PATH already exists."
 fi
 
+#Run with --resume to skip the steps a failed run already completed
+if [ "$1" == "--resume" ]; then
+    echo "[INFO] Resuming from the step journal"
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.journal resume $DATASET_PATH
+else
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.journal start $DATASET_PATH --name CC3_solid_workup
+    rm -f $DATASET_PATH/trace_spans.jsonl
+fi
+export WORKFLOW_JOURNAL=$DATASET_PATH
+#Every station call is timed in trace_spans.jsonl
+export WORKFLOW_TRACE=$DATASET_PATH
+
+echo "[INFO] Starting station session"
+start_station_session
+
 echo "[INFO] Starting CC3 solid synth work-up workflow."
 read_robot_state
 
 
 
-for SAMPLE in "${SAMPLES[@]}"; do
-    echo "[INFO] Filtering $SAMPLE" 
-    python $LOCAL_PATH/src/CC3_synth_solid.py "filter_sample" $SAMPLE $FILTER_VOLUME $CLEANING_VIAL $CLEANING_SOLVENT $ANTI_SOLVENT $ANTI_SOLVENT_VOLUME $DATASET_PATH
-    read_robot_state
-    python $LOCAL_PATH/src/CC3_synth_solid.py "wash_filtered_sample" $SAMPLE $WASH_VOLUME $WASH_CYCLE $WASH_SOLVENT $DATASET_PATH
-    read read_robot_state
-    python $LOCAL_PATH/src/CC3_synth_solid.py "clean_filter_station" $CLEANING_SOLVENT $WASH_VOLUME $DATASET_PATH
-    read_robot_state
-done
+echo "[INFO] Filtering ${SAMPLES[@]}"
+python $LOCAL_PATH/src/CC3_synth_solid.py "filter_samples_batch" $DATASET_PATH $FILTER_VOLUME $CLEANING_VIAL $CLEANING_SOLVENT $ANTI_SOLVENT $ANTI_SOLVENT_VOLUME \
+    $WASH_VOLUME $WASH_CYCLE $WASH_SOLVENT $WASH_VOLUME $MAX_FILTER_GROUP $(IFS=,; echo "${PRODUCTS[*]}") "${SAMPLES[@]}"
+read_robot_state
 
 
 
 echo "[INFO] All samples processed successfully."
+echo "[INFO] Station timing summary:"
+PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.tracing $DATASET_PATH --chrome $DATASET_PATH/trace.json
+
 echo "[INFO] Results saved in $DATASET_PATH"
 echo "[INFO] Workflow completed successfully."
 # End of CC3 synth workflow
\ No newline at end of file
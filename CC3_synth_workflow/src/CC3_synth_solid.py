@@ -1,17 +1,24 @@
 import sys
-from robinhood import RobInHood
-from robinhood.utils.timer import Timer 
 from typing import Union
 
 from datetime import datetime
+import os
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from workflow_core.dosing import QuantosState, ensure_cartridge, order_by_cartridge
+from workflow_core.pump_lines import PumpLineState, order_by_solvent, prime_if_needed, record_line_use
+from workflow_core.session import run_step
+from workflow_core.station import get_station
 
 
-def add_solid_aldehyde(vial_pos: int, results_directory: str,solid_name:str, solid_amount:float, logname: str = datetime.now().strftime("%d_%m_%Y")) -> None:
+
+def add_solid_aldehyde(vial_pos: int, results_directory: str,solid_name:str, solid_amount:float, logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
 
     """ Adds solid aldehyde sample by dispensing the solid into a vial, returns uncapped vial to the rack."""
 
-    station = RobInHood(inst_logger=logname, data_path=results_directory)
+    from workflow_core.results_store import results_store
+
+    station = get_station(station, logname, results_directory, devices=("arm", "quantos"))
 
     
     
@@ -23,11 +30,13 @@ def add_solid_aldehyde(vial_pos: int, results_directory: str,solid_name:str, sol
 
     station._logger.info("Adding solid to the sample")
 
-    station.quantos_cartridge_handling_logic(solid_name=solid_name)
+    ensure_cartridge(station, solid_name)
     station._logger.info(f"Dispensing {solid_amount} mg of {solid_name}")
     mass = station.quantos_dosing(solid_amount)
     station._logger.info(f"Dispensed {mass} mg of {solid_name}")
     station.record_weight(sample_name=solid_name, file_name=vial_pos, weight=mass, file_path=results_directory)
+    results_store().record(results_directory, "mass", mass, unit="mg", step="add_solid_aldehyde", vial=vial_pos,
+                           solid=solid_name, chemical=solid_name)
 
     station._logger.info("Moving vial to the vial rack")
     station.robot.open_gripper_set_width(0.03)
@@ -35,17 +44,32 @@ def add_solid_aldehyde(vial_pos: int, results_directory: str,solid_name:str, sol
     
     station._logger.info(f"Solid aldehyde added to sample number: {vial_pos}")
 
-def dispense_solvent(vial_pos: int, results_directory: str, liquid_name: str, liquid_vol:float, logname: str = datetime.now().strftime("%d_%m_%Y")) -> None:
+def add_solid_aldehyde_batch(samples: list, results_directory: str, logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
+    """ Adds solids to several vials, dosing all vials of one Quantos cartridge back to back, starting with the loaded cartridge.
+
+    samples is a list of [vial_pos, solid_name, solid_amount] entries whose order does not matter."""
+
+    station = get_station(station, logname, results_directory, devices=("arm", "quantos"))
+
+    ordered = order_by_cartridge(samples, lambda sample: sample[1], QuantosState().loaded_solid())
+    station._logger.info(f"Dosing vials {[sample[0] for sample in ordered]} grouped by cartridge")
+
+    for vial_pos, solid_name, solid_amount in ordered:
+        add_solid_aldehyde(vial_pos, results_directory, solid_name, solid_amount, logname=logname, station=station)
+
+def dispense_solvent(vial_pos: int, results_directory: str, liquid_name: str, liquid_vol:float, logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
     """ Dispenses solvent into a vial."""
 
-    station = RobInHood(inst_logger=logname, data_path=results_directory)
+    from workflow_core.results_store import results_store
+
+    station = get_station(station, logname, results_directory, devices=("arm", "pump"))
 
     
     station._logger.info(f"Preparing sample {vial_pos} with the following liquid: {liquid_name}")
 
     station._logger.info(f"Priming the tubing with {liquid_name}")
     station.hold_position()
-    station.pump_prime_dispense_tubing(liquid_name)
+    prime_if_needed(station, liquid_name)
     
     liquid_vol_ul = liquid_vol * 1000  # Convert from mL to uL
     station._logger.info(f"Dispensing {liquid_vol_ul} uL of {liquid_name}")
@@ -53,6 +77,8 @@ def dispense_solvent(vial_pos: int, results_directory: str, liquid_name: str, li
     station.vial_rack_to_pump(vial_pos)
     station.infuse_position()
     station.dispense_volume(vol=liquid_vol_ul, chemical=liquid_name)
+    results_store().record(results_directory, "volume", liquid_vol_ul, unit="uL", step="dispense_solvent", vial=vial_pos,
+                           chemical=liquid_name)
 
     station.hold_position()
     station._logger.info("Moving vial back to the rack")
@@ -60,16 +86,33 @@ def dispense_solvent(vial_pos: int, results_directory: str, liquid_name: str, li
     station.vial_pump_to_rack(vial_pos)
     station._logger.info(f"{liquid_name} added to sample number: {vial_pos}")
 
-def add_amine_and_cap(vial_pos: int, results_directory: str, liquid_name, liquid_vol, logname: str = datetime.now().strftime("%d_%m_%Y")) -> None:
+def dispense_solvent_batch(dispenses: list, results_directory: str, logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
+    """ Dispenses solvents into several vials, grouped by solvent so each solvent is primed at most once.
+
+    dispenses is a list of [vial_pos, liquid_name, liquid_vol] entries whose order does not matter."""
+
+    station = get_station(station, logname, results_directory, devices=("arm", "pump"))
+
+    primed = PumpLineState().primed_solvents()
+    ordered = order_by_solvent(dispenses, lambda dispense: dispense[1], primed)
+    solvents = {liquid_name for _, liquid_name, _ in ordered}
+    station._logger.info(f"Dispensing {len(ordered)} solvent additions, priming at most {len(solvents - set(primed.values()))} solvents")
+
+    for vial_pos, liquid_name, liquid_vol in ordered:
+        dispense_solvent(vial_pos, results_directory, liquid_name, liquid_vol, logname=logname, station=station)
+
+def add_amine_and_cap(vial_pos: int, results_directory: str, liquid_name, liquid_vol, logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
     """ Adds amine to a sample and caps it."""
 
-    station = RobInHood(inst_logger=logname, data_path=results_directory)
+    from workflow_core.results_store import results_store
+
+    station = get_station(station, logname, results_directory, devices=("arm", "pump", "capper"))
 
     station._logger.info(f"Preparing sample {vial_pos} with the following liquid: {liquid_name}")
     
     station._logger.info(f"Priming the tubing with {liquid_name}")
     station.hold_position()
-    station.pump_prime_dispense_tubing(liquid_name)
+    prime_if_needed(station, liquid_name)
     
     liquid_vol_ul = liquid_vol * 1000  # Convert from mL to uL
     station._logger.info(f"Dispensing {liquid_vol_ul} uL of {liquid_name}")
@@ -77,6 +120,8 @@ def add_amine_and_cap(vial_pos: int, results_directory: str, liquid_name, liquid
     station.vial_rack_to_pump(vial_pos)
     station.infuse_position()
     station.dispense_volume(vol=liquid_vol_ul, chemical=liquid_name)
+    results_store().record(results_directory, "volume", liquid_vol_ul, unit="uL", step="add_amine_and_cap", vial=vial_pos,
+                           chemical=liquid_name)
 
     station.hold_position()
     station._logger.info("Moving vial back to the capper")
@@ -88,26 +133,64 @@ def add_amine_and_cap(vial_pos: int, results_directory: str, liquid_name, liquid
     station.vial_capper_to_rack(vial_pos)
     station._logger.info(f"Amine added and sample number: {vial_pos} capped")
 
+def add_liquids_and_cap(vial_pos: int, results_directory: str, liquids: list, logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
+    """ Dispenses several liquids into a vial and caps it, keeping the vial at the pump between the dispenses.
+
+    liquids is a list of [liquid_name, liquid_vol] entries dispensed in order, e.g. the solvent and then the amine. Replaces
+    dispense_solvent followed by add_amine_and_cap, which parked the vial in the rack between the two. Each vial gets all its
+    liquids back to back, so the amine follows the solvent within one vial, rather than after the solvent of every vial, and
+    the pump alternates between the liquids. The drivers only use it with CHAIN_LIQUIDS / chain_liquids set."""
+
+    from workflow_core.results_store import results_store
+    from workflow_core.transfers import Operation, run_chain
+
+    station = get_station(station, logname, results_directory, devices=("arm", "pump", "capper"))
+
+    def dispense(liquid_name, liquid_vol):
+        station._logger.info(f"Priming the tubing with {liquid_name}")
+        station.hold_position()
+        prime_if_needed(station, liquid_name)
+
+        liquid_vol_ul = liquid_vol * 1000  # Convert from mL to uL
+        station._logger.info(f"Dispensing {liquid_vol_ul} uL of {liquid_name}")
+        station.infuse_position()
+        station.dispense_volume(vol=liquid_vol_ul, chemical=liquid_name)
+        results_store().record(results_directory, "volume", liquid_vol_ul, unit="uL", step="add_liquids_and_cap", vial=vial_pos,
+                               chemical=liquid_name)
+        station.hold_position()
+
+    station._logger.info(f"Preparing sample {vial_pos} with the following liquids: {[liquid_name for liquid_name, _ in liquids]}")
+    operations = [Operation("pump", lambda liquid_name=liquid_name, liquid_vol=liquid_vol: dispense(liquid_name, float(liquid_vol)))
+                  for liquid_name, liquid_vol in liquids]
+    run_chain(station, vial_pos, operations + [Operation("capper", station.cap)])
+    station._logger.info(f"Liquids added and sample number: {vial_pos} capped")
+
 def filter_sample(vial_pos: int, liquid_volume: float, cleaning_vial_number:int, cleaning_vial_solvent:str, anti_solvent:str, anti_solvent_vol:float,
-                   results_directory:str, logname: str = datetime.now().strftime("%d_%m_%Y")) -> None:
+                   results_directory:str, logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
     """ Filters samples using the filter station."""
 
-    station = RobInHood(inst_logger=logname, data_path=results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "pump", "capper", "filter"))
 
     station._logger.info(f"Filtering sample {vial_pos}")
 
+    station.filtration_prep(cleaning_vial_number=cleaning_vial_number, cleaning_solvent=cleaning_vial_solvent, cleaning_solvent_volume=liquid_volume * 1000)
+    record_line_use(cleaning_vial_solvent)
+
+    _filter_on_prepared_filter(station, vial_pos, liquid_volume, anti_solvent, anti_solvent_vol)
+
+
+def _filter_on_prepared_filter(station, vial_pos: int, liquid_volume: float, anti_solvent: str, anti_solvent_vol: float) -> None:
+    """ Adds the antisolvent to a sample and filters it through the prepared filter."""
+
     vial_pos = int(vial_pos)
     liquid_volume_ul = float(liquid_volume)*1000
-   
-
-    station.filtration_prep(cleaning_vial_number=cleaning_vial_number, cleaning_solvent=cleaning_vial_solvent, cleaning_solvent_volume=liquid_volume * 1000)
 
     station.vial_decap(vial_pos)
     
     #adding an antisolvent
     station._logger.info(f"Adding {anti_solvent_vol} ml of {anti_solvent} ")
 
-    station.pump_prime_dispense_tubing(chemical= anti_solvent)
+    prime_if_needed(station, anti_solvent)
 
     station.infuse_position()
     
@@ -128,11 +211,48 @@ def filter_sample(vial_pos: int, liquid_volume: float, cleaning_vial_number:int,
     station._logger.info(f"Sample {vial_pos} filtered")
 
 
+def filter_samples_batch(vial_positions: list, liquid_volume: float, cleaning_vial_number: int, cleaning_vial_solvent: str, anti_solvent: str,
+                         anti_solvent_vol: float, wash_volume: float, wash_cycles: int, wash_solvent: str, cleaning_solvent_volume: float,
+                         results_directory: str, products: list = None, max_group_size: Union[int, None] = 1, isolate: list = None,
+                         logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> list:
+    """ Filters and washes several samples, preparing the filter once per group and cleaning it with the cleaning solvent only at group boundaries.
+
+    products gives the product in each vial, in the order of vial_positions; only neighbouring vials of the same product
+    may share the filter, and vials without a product are filtered on their own. By default the filter is still prepped and
+    cleaned for every sample: pass max_group_size (None for no limit) to share it. isolate lists vials that get a freshly
+    prepared filter to themselves. Returns the groups."""
+
+    from workflow_core.filtration import ContaminationPolicy, filtration_groups
+
+    station = get_station(station, logname, results_directory, devices=("arm", "pump", "capper", "filter"))
+
+    vial_positions = [int(vial_pos) for vial_pos in vial_positions]
+    product_of = dict(zip(vial_positions, products or []))
+    groups = filtration_groups(vial_positions, lambda vial_pos: product_of.get(vial_pos, vial_pos),
+                               ContaminationPolicy(max_group_size=max_group_size, isolate=isolate or []))
+    station._logger.info(f"Filtering vials {vial_positions} with {len(groups)} filter preps: {groups}")
+
+    for group in groups:
+        station.filtration_prep(cleaning_vial_number=cleaning_vial_number, cleaning_solvent=cleaning_vial_solvent, cleaning_solvent_volume=liquid_volume * 1000)
+        record_line_use(cleaning_vial_solvent)
+
+        for vial_pos in group:
+            station._logger.info(f"Filtering sample {vial_pos}")
+            _filter_on_prepared_filter(station, vial_pos, liquid_volume, anti_solvent, anti_solvent_vol)
+            wash_filtered_sample(vial_pos, wash_volume, wash_cycles, wash_solvent, results_directory, logname=logname, station=station)
+
+        clean_filter_station(cleaning_vial_solvent, cleaning_solvent_volume, results_directory, logname=logname, station=station)
+
+    return groups
+
+
+def wash_filtered_sample(vial_pos:int, wash_volume: float, wash_cycles:int, wash_solvent:str, results_directory:str, logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
+    """ Washes the filtered sample with a specified solvent.
 
-def wash_filtered_sample(vial_pos:int, wash_volume: float, wash_cycles:int, wash_solvent:str, results_directory:str, logname: str = datetime.now().strftime("%d_%m_%Y")) -> None:
-    """ Washes the filtered sample with a specified solvent."""
+    The cycles are not chained with run_chain: just_filter_sample_disgard_filtrate picks the vial up from the rack,
+    so the vial has to go back there after every dispense, and there is no rack round-trip to save."""
 
-    station = RobInHood(inst_logger=logname, data_path=results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "pump", "filter"))
 
     cycle_number = range(wash_cycles)
 
@@ -141,7 +261,7 @@ def wash_filtered_sample(vial_pos:int, wash_volume: float, wash_cycles:int, wash
         station._logger.info(f"Washing the filter with {wash_solvent}")
         station._logger.info(f"Filling the sample vial {vial_pos} with {wash_volume} ml of {wash_solvent}")
         station.hold_position()
-        station.pump_prime_dispense_tubing(wash_solvent)
+        prime_if_needed(station, wash_solvent)
         wash_volume_ul =wash_volume * 1000  # Convert from mL to uL
         station.vial_rack_to_pump(vial_pos)
         station.infuse_position()
@@ -153,36 +273,45 @@ def wash_filtered_sample(vial_pos:int, wash_volume: float, wash_cycles:int, wash
 
     station._logger.info(f"Sample {vial_pos} washed {wash_cycles} times with {wash_solvent} and returned to the rack")
 
-def clean_filter_station(cleaning_solvent:str, cleaning_solvent_volume:float, results_directory:str, logname: str = datetime.now().strftime("%d_%m_%Y")) -> None:
+def clean_filter_station(cleaning_solvent:str, cleaning_solvent_volume:float, results_directory:str, logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
     """ Cleans the filter station with a specified solvent."""
 
-    station = RobInHood(inst_logger=logname, data_path=results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "pump", "filter"))
     
     cleaning_solvent_volume_ul = cleaning_solvent_volume * 1000  # Convert from mL to uL
 
     station._logger.info(f"Cleaning the filter station with {cleaning_solvent}")
 
     station.filter_cleaning_packdown(cleaning_solvent=cleaning_solvent, cleaning_solvent_volume=cleaning_solvent_volume_ul)
+    record_line_use(cleaning_solvent)
     
 
 
 if __name__ == "__main__":
         # Example usage
         if sys.argv[1] == "add_solid_aldehyde":
-            add_solid_aldehyde(vial_pos=int(sys.argv[2]),results_directory= sys.argv[3],solid_name= sys.argv[4], solid_amount= float(sys.argv[5]))
+            run_step(add_solid_aldehyde, vial_pos=int(sys.argv[2]),results_directory= sys.argv[3],solid_name= sys.argv[4], solid_amount= float(sys.argv[5]))
         elif sys.argv[1] == "dispense_solvent":
-            dispense_solvent(vial_pos=int(sys.argv[2]), results_directory=sys.argv[3], liquid_name= sys.argv[4], liquid_vol=float(sys.argv[5]))
+            run_step(dispense_solvent, vial_pos=int(sys.argv[2]), results_directory=sys.argv[3], liquid_name= sys.argv[4], liquid_vol=float(sys.argv[5]))
         elif sys.argv[1] == "add_amine_and_cap":
-            add_amine_and_cap(vial_pos=int(sys.argv[2]), results_directory=sys.argv[3],liquid_name= sys.argv[4], liquid_vol= float(sys.argv[5]))
+            run_step(add_amine_and_cap, vial_pos=int(sys.argv[2]), results_directory=sys.argv[3],liquid_name= sys.argv[4], liquid_vol= float(sys.argv[5]))
+        elif sys.argv[1] == "add_liquids_and_cap":
+            run_step(add_liquids_and_cap, vial_pos=int(sys.argv[2]), results_directory=sys.argv[3],
+                     liquids=[[liquid_name, float(liquid_vol)] for liquid_name, liquid_vol in zip(sys.argv[4::2], sys.argv[5::2])])
         elif sys.argv[1] == "filter_sample":
-            filter_sample(vial_pos=int(sys.argv[2]), liquid_volume=float(sys.argv[3]), cleaning_vial_number=int(sys.argv[4]),
+            run_step(filter_sample, vial_pos=int(sys.argv[2]), liquid_volume=float(sys.argv[3]), cleaning_vial_number=int(sys.argv[4]),
                            cleaning_vial_solvent=str(sys.argv[5]), anti_solvent=sys.argv[6], anti_solvent_vol= sys.argv[7], results_directory=sys.argv[8])
         elif sys.argv[1] == "wash_filtered_sample":
-            wash_filtered_sample(vial_pos=int(sys.argv[2]), wash_volume=float(sys.argv[3]), wash_cycles=int(sys.argv[4]),
+            run_step(wash_filtered_sample, vial_pos=int(sys.argv[2]), wash_volume=float(sys.argv[3]), wash_cycles=int(sys.argv[4]),
                                  wash_solvent=str(sys.argv[5]), results_directory=sys.argv[6])
+        elif sys.argv[1] == "filter_samples_batch":
+            run_step(filter_samples_batch, results_directory=sys.argv[2], liquid_volume=float(sys.argv[3]), cleaning_vial_number=int(sys.argv[4]),
+                     cleaning_vial_solvent=sys.argv[5], anti_solvent=sys.argv[6], anti_solvent_vol=float(sys.argv[7]), wash_volume=float(sys.argv[8]),
+                     wash_cycles=int(sys.argv[9]), wash_solvent=sys.argv[10], cleaning_solvent_volume=float(sys.argv[11]),
+                     max_group_size=int(sys.argv[12]) or None, products=sys.argv[13].split(","), vial_positions=[int(vial_pos) for vial_pos in sys.argv[14:]])
         elif sys.argv[1] == "clean_filter_station":
-            clean_filter_station(cleaning_solvent=sys.argv[2], 
+            run_step(clean_filter_station, cleaning_solvent=sys.argv[2], 
                                  cleaning_solvent_volume=float(sys.argv[3]), results_directory=sys.argv[4])
     
         else:
-            print("Invalid command. Use 'add_solid_aldehyde', 'dispense_solvent','add_amine_and_cap', 'filter_sample', 'wash_filtered_sample', 'clean_filter_station'.")
\ No newline at end of file
+            print("Invalid command. Use 'add_solid_aldehyde', 'dispense_solvent','add_amine_and_cap', 'add_liquids_and_cap', 'filter_sample', 'filter_samples_batch', 'wash_filtered_sample', 'clean_filter_station'.")
\ No newline at end of file
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Background writer for diagnostic artifacts (ROI overlays and plots).
+
+The numerical results of the colorimetry never wait for an image to be
+encoded: overlays and figures are queued here and written by a background
+thread. Figures are plain matplotlib Figure objects rendered with Agg, so
+nothing needs a display and nothing blocks on plt.show().
+
+Configuration (environment variables, read when the writer is created):
+    COLORIMETRY_ARTIFACTS   "off" to skip all overlays and plots
+    COLORIMETRY_DPI         resolution of saved plots (default 400)
+    COLORIMETRY_THUMBNAIL   longest side in pixels of saved ROI overlays (default 0, full size)
+"""
+
+import atexit
+import os
+import queue
+import threading
+
+import cv2
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class ArtifactWriter:
+    """Encode and save overlays and figures in a background thread."""
+
+    def __init__(self, enabled=True, dpi=400, thumbnail=0):
+        self.enabled = enabled
+        self.dpi = dpi
+        self.thumbnail = thumbnail
+        self.errors = []
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            write = self._queue.get()
+            try:
+                write()
+            except Exception as error:
+                self.errors.append(error)
+            finally:
+                self._queue.task_done()
+
+    def write_image(self, path, image):
+        """Queue an image (e.g. an ROI overlay) to be saved, shrunk to the thumbnail size if one is set."""
+        if not self.enabled:
+            return
+        self._start()
+        self._queue.put(lambda: cv2.imwrite(path, self._shrink(image)))
+
+    def save_figure(self, figure, path):
+        """Queue a matplotlib Figure to be saved at the configured dpi."""
+        if not self.enabled:
+            return
+        self._start()
+        self._queue.put(lambda: figure.savefig(path, dpi=self.dpi))
+
+    def _shrink(self, image):
+        height, width = image.shape[:2]
+        if not self.thumbnail or max(height, width) <= self.thumbnail:
+            return image
+        scale = self.thumbnail / max(height, width)
+        return cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+    def flush(self):
+        """Wait until every queued artifact is written."""
+        if self._thread is not None:
+            self._queue.join()
+
+
+def artifact_writer():
+    """Return the writer of this process, configured from the environment on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ArtifactWriter(enabled=os.environ.get("COLORIMETRY_ARTIFACTS", "on").lower() != "off",
+                                     dpi=int(os.environ.get("COLORIMETRY_DPI", 400)),
+                                     thumbnail=int(os.environ.get("COLORIMETRY_THUMBNAIL", 0)))
+            atexit.register(_writer.flush)
+        return _writer
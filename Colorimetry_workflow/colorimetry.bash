@@ -2,6 +2,16 @@
 set -e
 
 LOCAL_PATH=$(pwd)
+
+#Decoded images are cached here so re-analysis skips JPEG decoding
+export COLORIMETRY_IMAGE_CACHE="$LOCAL_PATH/dataset/.image_cache"
+
+#bash colorimetry.bash --all analyses every material in dataset/ with a single calibration fit
+if [ "$1" == "--all" ]; then
+    echo "[INFO] Colorimetry of every material in $LOCAL_PATH/dataset"
+    python $LOCAL_PATH/colorimetry.py --all
+    exit 0
+fi
 TEMP_PATH="$LOCAL_PATH/dataset"
 DATASET_PATH="$TEMP_PATH/$1/imgs"
 OUTPUT_PATH="$TEMP_PATH/$1/ROI_output"
@@ -7,49 +7,89 @@ Colorimetry-based porosity analysis
 
 import sys
 import os
+import csv
+import functools
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
+from matplotlib.figure import Figure
 from scipy.stats import linregress
 from scipy.optimize import curve_fit
 from scipy import stats
 
+from artifacts import artifact_writer
+from image_cache import DecodedImageCache
+
 # Constants
 SQUARE_SIZE = 50
 X_OFFSET = 10
 Y_OFFSET = 45
 CHANNELS = ["A", "B", "S", "L", "gray", "B"]
-BARNEY_PARAMETERS = [[] for _ in range(6)]
+CALIBRATION_PPM = [1, 2, 4, 6, 8, 10]
+CALIBRATION_CACHE = "calibration_cache.json"
+IMAGE_CACHE_ENV = "COLORIMETRY_IMAGE_CACHE"
+DEFAULT_GUESS = (245, 240, 1.5, 1.1)
+DYE_COLORS = ["lightgoldenrodyellow", "sandybrown", "yellow", "purple", "lightcoral", "gold"]
+
+_image_cache = None
 
 # ---------------------- IMAGE PROCESSING ---------------------- #
-def draw_center_square(image_path, output_path, square_size=SQUARE_SIZE, channel='B'):
-    """Draw a square in the center of an image and return the median pixel value of the selected channel."""
-    image = cv2.imread(image_path)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    B, G, R = cv2.split(image)
-    H, S, V = cv2.split(hsv)
-    L, A, BB = cv2.split(lab)
-
-    channels = {
-        'gray': gray, 'B': B, 'G': G, 'R': R,
-        'H': H, 'S': S, 'V': V, 'L': L, 'A': A, 'BB': BB
-    }
-
-    height, width = gray.shape
+# Channel name -> (colour conversion or None for BGR, index of the channel in the result)
+CHANNEL_SOURCES = {
+    'B': (None, 0), 'G': (None, 1), 'R': (None, 2),
+    'gray': (cv2.COLOR_BGR2GRAY, None),
+    'H': (cv2.COLOR_BGR2HSV, 0), 'S': (cv2.COLOR_BGR2HSV, 1), 'V': (cv2.COLOR_BGR2HSV, 2),
+    'L': (cv2.COLOR_BGR2LAB, 0), 'A': (cv2.COLOR_BGR2LAB, 1), 'BB': (cv2.COLOR_BGR2LAB, 2),
+}
+
+def center_square(shape, square_size=SQUARE_SIZE):
+    """Return the (x1, y1, x2, y2) corners of the measurement square of an image of the given shape."""
+    height, width = shape[:2]
     cx, cy = width // 2 + X_OFFSET, height // 2 + Y_OFFSET
     x1, y1 = cx - square_size // 2, cy - square_size // 2
     x2, y2 = cx + square_size // 2, cy + square_size // 2
+    return x1, y1, x2, y2
+
+def extract_channel(image, channel):
+    """Return a single channel of a BGR image (or crop); only that channel's colour space is computed."""
+    conversion, index = CHANNEL_SOURCES[channel]
+    converted = image if conversion is None else cv2.cvtColor(image, conversion)
+    return converted if index is None else converted[:, :, index]
 
-    square = channels[channel][y1:y2, x1:x2]
-    median_value = np.median(square)
+def roi_median(image, square_size=SQUARE_SIZE, channel='B'):
+    """Return the median of the selected channel over the measurement square of a BGR image."""
+    x1, y1, x2, y2 = center_square(image.shape, square_size)
+    # The colour conversions are per pixel, so cropping first gives the same values as converting the full image
+    return np.median(extract_channel(image[y1:y2, x1:x2], channel))
 
-    # Draw rectangle and save image
-    img_copy = channels[channel].copy() if channel == 'gray' else image.copy()
-    cv2.rectangle(img_copy, (x1, y1), (x2, y2), (255), 2)
-    cv2.imwrite(output_path, img_copy)
+def read_image(image_path):
+    """Decode an image, through the decoded-image cache if COLORIMETRY_IMAGE_CACHE names a directory."""
+    global _image_cache
+    cache_dir = os.environ.get(IMAGE_CACHE_ENV)
+    if not cache_dir:
+        return cv2.imread(image_path)
+    if _image_cache is None or _image_cache.cache_dir != cache_dir:
+        _image_cache = DecodedImageCache(cache_dir)
+    return _image_cache.load(image_path)
+
+def draw_center_square(image_path, output_path=None, square_size=SQUARE_SIZE, channel='B'):
+    """Return the median pixel value of the selected channel in the center square of an image.
+
+    If output_path is given, the image with the square drawn on it is queued to the
+    artifact writer and saved in the background.
+    """
+    image = read_image(image_path)
+    median_value = roi_median(image, square_size, channel)
+
+    if output_path is not None and artifact_writer().enabled:
+        # Draw rectangle and save image
+        x1, y1, x2, y2 = center_square(image.shape, square_size)
+        img_copy = extract_channel(image, 'gray') if channel == 'gray' else image.copy()
+        cv2.rectangle(img_copy, (x1, y1), (x2, y2), (255), 2)
+        artifact_writer().write_image(output_path, img_copy)
 
     return median_value
 
@@ -57,72 +97,179 @@ def draw_center_square(image_path, output_path, square_size=SQUARE_SIZE, channel
 def barney_curve(x, A, B, C, D):
     return A / (B + (C * np.array(x) + D) ** 3)
 
+def barney_jacobian(x, A, B, C, D):
+    """Analytic derivatives of barney_curve with respect to (A, B, C, D), one row per x."""
+    x = np.asarray(x, dtype=float)
+    u = C * x + D
+    denominator = B + u ** 3
+    d_u = -3 * A * u ** 2 / denominator ** 2
+    return np.column_stack([1 / denominator, -A / denominator ** 2, d_u * x, d_u])
+
 def barney_curve_predict_value(pixels, A, B, C, D):
     ppm = (np.cbrt((A / pixels) - B) - D) / C
     ppm = np.clip(ppm, 0.01, 10)  # Keep ppm in [0.01, 10]
     return ppm
 
-def plot_colorimetry_calibration(ppm, pixels, title, dye_index, plots_path):
-    """Fit the calibration curve and store parameters."""
-    guess = (245, 240, 1.5, 1.1)
-    params, cov = curve_fit(barney_curve, ppm, pixels, guess)
-    BARNEY_PARAMETERS[dye_index].append(tuple(params))
+def predict_ppm(pixels, parameters):
+    """Predict the ppm of a whole [materials, dyes] pixel matrix at once.
+
+    parameters holds one (A, B, C, D) row per dye; the result has the shape of pixels.
+    """
+    A, B, C, D = np.asarray(parameters, dtype=float).T
+    return barney_curve_predict_value(np.asarray(pixels, dtype=float), A, B, C, D)
+
+def fit_calibration_curves(ppm, pixels, guesses=None):
+    """Fit barney_curve to the calibration points of any number of dyes.
+
+    Args:
+        ppm: The calibration concentrations, shared by all dyes.
+        pixels: [dyes, concentrations] ROI medians.
+        guesses: Optional starting (A, B, C, D) per dye, e.g. the cached fit of the previous
+            calibration; a dye whose warm start does not converge is refitted from DEFAULT_GUESS.
+
+    Returns:
+        (parameters [dyes, 4], covariances [dyes, 4, 4])
+    """
+    pixels = np.atleast_2d(np.asarray(pixels, dtype=float))
+    guesses = [None] * len(pixels) if guesses is None else guesses
+    parameters, covariances = [], []
+    for dye_pixels, guess in zip(pixels, guesses):
+        starts = [DEFAULT_GUESS] if guess is None else [guess, DEFAULT_GUESS]
+        for start in starts:
+            try:
+                params, cov = curve_fit(barney_curve, ppm, dye_pixels, start, jac=barney_jacobian)
+                break
+            except RuntimeError:
+                if start is starts[-1]:
+                    raise
+        parameters.append(params)
+        covariances.append(cov)
+    return np.array(parameters), np.array(covariances)
+
+def plot_colorimetry_calibration(ppm, pixels, title, dye_index, plots_path, params=None):
+    """Plot the calibration curve (fitting it unless params is given) and return the parameters and covariance.
+
+    The plot is saved in the background by the artifact writer, or skipped when artifacts are off.
+    """
+    cov = None
+    if params is None:
+        fitted, covariances = fit_calibration_curves(ppm, [pixels])
+        params, cov = fitted[0], covariances[0]
+    if not artifact_writer().enabled:
+        return params, cov
     
     # Plot
     x_vals = np.arange(0, 10, 0.1)
     y_vals = barney_curve(x_vals, *params)
-    fig, ax = plt.subplots()
+    fig = Figure()
+    ax = fig.add_subplot()
     ax.set_facecolor('black')
-    colors = ["lightgoldenrodyellow", "sandybrown", "yellow", "purple", "lightcoral", "gold"]
-    ax.plot(ppm, pixels, 'o', color=colors[dye_index])
-    ax.plot(x_vals, y_vals, '--', color=colors[dye_index], alpha=0.6, label=title)
+    color = DYE_COLORS[dye_index % len(DYE_COLORS)]
+    ax.plot(ppm, pixels, 'o', color=color)
+    ax.plot(x_vals, y_vals, '--', color=color, alpha=0.6, label=title)
     ax.set_title(title)
     ax.set_xlabel("PPM")
     ax.set_ylabel("Pixel Value")
-    plt.grid(color='white', linestyle='--', linewidth=0.5)
-    plt.legend()
-    plt.savefig(os.path.join(plots_path, f"{title}.jpg"), dpi=400)
-    plt.close()
+    ax.grid(color='white', linestyle='--', linewidth=0.5)
+    ax.legend()
+    artifact_writer().save_figure(fig, os.path.join(plots_path, f"{title}.jpg"))
+    return params, cov
 
 # ---------------------- COLORIMETRY ---------------------- #
-def colorimetry(calibration_paths, plots_path):
-    dyes = [[] for _ in range(6)]
-    ppm_list = [1, 2, 4, 6, 8, 10]
+def colorimetry(calibration_paths, plots_path, save_overlays=True):
+    dyes = [[] for _ in CHANNELS]
+    ppm_list = CALIBRATION_PPM
 
     for i, ppm in enumerate(ppm_list):
-        for d in range(6):
+        for d in range(len(CHANNELS)):
             input_img = os.path.join(calibration_paths[d], f"dye{d+1}_{ppm}ppm.jpg")
-            output_img = os.path.join(calibration_paths[d], f"ROI_calibration_dye{d+1}_{ppm}_ppm.jpg")
+            output_img = os.path.join(calibration_paths[d], f"ROI_calibration_dye{d+1}_{ppm}_ppm.jpg") if save_overlays else None
             value = draw_center_square(input_img, output_img, channel=CHANNELS[d])
             dyes[d].append(value)
     
-    for d in range(6):
+    for d in range(len(CHANNELS)):
         plot_colorimetry_calibration(ppm_list, dyes[d], f"Dye {d+1} Fitting Curve", d, plots_path)
 
     # Remove last calibration point (if needed)
-    for d in range(6):
+    for d in range(len(CHANNELS)):
         dyes[d].pop()
 
     return dyes
 
-def colorimetry_samples(samples_path, output_path, material_name):
-    dyes = [[] for _ in range(6)]
-    for d in range(6):
+def colorimetry_samples(samples_path, output_path, material_name, save_overlays=True):
+    dyes = [[] for _ in CHANNELS]
+    for d in range(len(CHANNELS)):
         input_img = os.path.join(samples_path, f"{material_name}_DYE{d+1}.jpg")
-        output_img = os.path.join(output_path, f"ROI_SAMPLE_DYE{d+1}.jpg")
+        output_img = os.path.join(output_path, f"ROI_SAMPLE_DYE{d+1}.jpg") if save_overlays else None
         value = draw_center_square(input_img, output_img, channel=CHANNELS[d])
         dyes[d].append(value)
     return dyes
 
+# ---------------------- CALIBRATION CACHE ---------------------- #
+def calibration_key(image_paths, channel, square_size=SQUARE_SIZE):
+    """Hash the calibration images of a dye together with the ROI settings used to read them."""
+    digest = hashlib.sha256(json.dumps([square_size, X_OFFSET, Y_OFFSET, channel, CALIBRATION_PPM]).encode())
+    for image_path in image_paths:
+        with open(image_path, 'rb') as image_file:
+            digest.update(image_file.read())
+    return digest.hexdigest()
+
+def load_calibration(calibration_paths, plots_path, cache_path=None, save_overlays=True):
+    """Return the fitted (A, B, C, D) of every dye, fitting only dyes whose images or ROI settings changed.
+
+    Fitted parameters, covariance and ROI medians are stored per dye in a JSON cache
+    (calibration_vials/calibration_cache.json by default), keyed by calibration_key.
+    Changed dyes are refitted together, warm-started from their previous cached fit.
+    """
+    if cache_path is None:
+        cache_path = os.path.join(os.path.dirname(calibration_paths[0]), CALIBRATION_CACHE)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+
+    keys, stale, stale_pixels, guesses = [], [], [], []
+    for d in range(len(CHANNELS)):
+        images = [os.path.join(calibration_paths[d], f"dye{d+1}_{ppm}ppm.jpg") for ppm in CALIBRATION_PPM]
+        key = calibration_key(images, CHANNELS[d])
+        keys.append(key)
+        if key in cache:
+            continue
+        pixels = []
+        for ppm, input_img in zip(CALIBRATION_PPM, images):
+            output_img = os.path.join(calibration_paths[d], f"ROI_calibration_dye{d+1}_{ppm}_ppm.jpg") if save_overlays else None
+            pixels.append(float(draw_center_square(input_img, output_img, channel=CHANNELS[d])))
+        previous = [entry["parameters"] for entry in cache.values() if entry["dye"] == d + 1 and entry["channel"] == CHANNELS[d]]
+        stale.append(d)
+        stale_pixels.append(pixels)
+        guesses.append(previous[-1] if previous else None)
+
+    if stale:
+        fitted, covariances = fit_calibration_curves(CALIBRATION_PPM, stale_pixels, guesses)
+        for d, pixels, params, cov in zip(stale, stale_pixels, fitted, covariances):
+            plot_colorimetry_calibration(CALIBRATION_PPM, pixels, f"Dye {d+1} Fitting Curve", d, plots_path, params=params)
+            cache[keys[d]] = {"dye": d + 1, "channel": CHANNELS[d], "parameters": [float(p) for p in params],
+                              "covariance": cov.tolist(), "pixels": pixels}
+    parameters = [tuple(cache[key]["parameters"]) for key in keys]
+
+    if stale:
+        temporary = cache_path + ".tmp"
+        with open(temporary, 'w') as cache_file:
+            json.dump(cache, cache_file, indent=4)
+        os.replace(temporary, cache_path)
+    return parameters
+
 # ---------------------- PLOTTING ---------------------- #
-def plot_with_regression_and_images(calibration_images, sample_images, material_name, results_path):
-    """Plot regression lines and sample predictions."""
+def plot_with_regression_and_images(calibration_images, sample_images, material_name, results_path, parameters):
+    """Plot regression lines and sample predictions, and return the sample ROI medians.
+
+    The figure is saved in the background; nothing is shown, so this runs headless.
+    """
     dyes = colorimetry_samples(os.path.dirname(sample_images[0]), os.path.dirname(sample_images[0]), material_name)
     ppm_values = [2, 4, 6, 8, 10]
-    colors = ["lightgoldenrodyellow", "sandybrown", "yellow", "purple", "lightcoral", "gold"]
 
-    fig = plt.figure(figsize=(16, 8), facecolor='black')
-    gs = gridspec.GridSpec(nrows=1, ncols=2, width_ratios=[2, 1.6])
+    fig = Figure(figsize=(16, 8), facecolor='black')
+    gs = gridspec.GridSpec(nrows=1, ncols=2, width_ratios=[2, 1.6], figure=fig)
     ax_reg = fig.add_subplot(gs[0, 0])
     ax_reg.set_facecolor('black')
     ax_reg.set_xlim(0, 10)
@@ -132,16 +279,60 @@ def plot_with_regression_and_images(calibration_images, sample_images, material_
     ax_reg.set_title(f"Predicted PPMs for {material_name}")
 
     # Plot regression curves
-    for i in range(6):
-        A, B, C, D = BARNEY_PARAMETERS[i][0]
+    for i in range(len(CHANNELS)):
+        A, B, C, D = parameters[i]
         x_vals = np.arange(0, 10, 0.1)
         y_vals = barney_curve(x_vals, A, B, C, D)
-        ax_reg.plot(x_vals, y_vals, '--', color=colors[i], label=f"Dye {i+1}", alpha=0.6)
+        ax_reg.plot(x_vals, y_vals, '--', color=DYE_COLORS[i % len(DYE_COLORS)], label=f"Dye {i+1}", alpha=0.6)
     ax_reg.legend(facecolor='black', edgecolor='white', labelcolor='white')
 
-    plt.tight_layout()
-    plt.savefig(os.path.join(results_path, f"{material_name}_RESULTS.jpg"), dpi=400)
-    plt.show()
+    fig.tight_layout()
+    artifact_writer().save_figure(fig, os.path.join(results_path, f"{material_name}_RESULTS.jpg"))
+    return dyes
+
+# ---------------------- BATCH ---------------------- #
+def find_materials(dataset_path):
+    """Return the material folders in dataset_path that hold a full set of sample images."""
+    materials = []
+    for name in sorted(os.listdir(dataset_path)):
+        samples_path = os.path.join(dataset_path, name, 'imgs')
+        if all(os.path.exists(os.path.join(samples_path, f"{name}_DYE{d+1}.jpg")) for d in range(len(CHANNELS))):
+            materials.append(name)
+    return materials
+
+def analyse_material(material_name, dataset_path, save_overlays=False):
+    """Return the ROI median of every dye of one material. Runs in a worker process."""
+    samples_path = os.path.join(dataset_path, material_name, 'imgs')
+    output_path = os.path.join(dataset_path, material_name, 'ROI_output')
+    if save_overlays:
+        os.makedirs(output_path, exist_ok=True)
+    dyes = colorimetry_samples(samples_path, output_path, material_name, save_overlays)
+    # Worker processes do not run atexit handlers, so wait for this material's overlays here
+    artifact_writer().flush()
+    return [float(values[0]) for values in dyes]
+
+def batch_colorimetry(dataset_path, plots_path, results_file, materials=None, processes=None, save_overlays=False):
+    """Fit the calibration once and analyse every material in a process pool.
+
+    Writes one CSV table with a row per material and dye, and returns the rows.
+    """
+    materials = find_materials(dataset_path) if materials is None else materials
+    calibration_paths = [os.path.join(dataset_path, 'calibration_vials', f'dye{d+1}') for d in range(len(CHANNELS))]
+    parameters = load_calibration(calibration_paths, plots_path, save_overlays=save_overlays)
+
+    analyse = functools.partial(analyse_material, dataset_path=dataset_path, save_overlays=save_overlays)
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        pixels = np.array(list(pool.map(analyse, materials)))
+    ppm = predict_ppm(pixels, parameters)
+
+    rows = [(material, d + 1, CHANNELS[d], pixels[m, d], ppm[m, d])
+            for m, material in enumerate(materials) for d in range(len(CHANNELS))]
+
+    with open(results_file, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["material", "dye", "channel", "pixel", "ppm"])
+        writer.writerows(rows)
+    return rows
 
 # ---------------------- MAIN ---------------------- #
 if __name__ == '__main__':
@@ -151,17 +342,27 @@ if __name__ == '__main__':
         MATERIAL_NAME = 'CMP2_a'
 
     GLOBAL_PATH = os.getcwd()
+
+    if MATERIAL_NAME == '--all':
+        # Every material folder in dataset/, one calibration fit, one results table
+        DATASET_PATH = os.path.join(GLOBAL_PATH, 'dataset')
+        RESULTS_FILE = os.path.join(DATASET_PATH, 'colorimetry_results.csv')
+        rows = batch_colorimetry(DATASET_PATH, os.path.join(GLOBAL_PATH, 'plots'), RESULTS_FILE)
+        print(f"[INFO] {len(rows) // len(CHANNELS)} materials analysed, results saved in {RESULTS_FILE}")
+        sys.exit(0)
+
     CALIBRATION_PATH = os.path.join(GLOBAL_PATH, 'dataset', 'calibration_vials')
     PLOTS_PATH = os.path.join(GLOBAL_PATH, 'plots')
     SAMPLES_PATH = os.path.join(GLOBAL_PATH, 'dataset', MATERIAL_NAME, 'imgs')
     OUTPUT_PATH = os.path.join(GLOBAL_PATH, 'dataset', MATERIAL_NAME, 'ROI_output')
     RESULTS_PATH = os.path.join(GLOBAL_PATH, 'dataset', MATERIAL_NAME)
 
-    DYE_PATHS = [os.path.join(CALIBRATION_PATH, f'dye{i+1}') for i in range(6)]
-    sample_images = [os.path.join(SAMPLES_PATH, f"{MATERIAL_NAME}_DYE{i+1}.jpg") for i in range(6)]
-    calibration_images = [[os.path.join(DYE_PATHS[d], f"dye{d+1}_{ppm}ppm.jpg") for ppm in [1,2,4,6,8,10]] for d in range(6)]
+    DYE_PATHS = [os.path.join(CALIBRATION_PATH, f'dye{i+1}') for i in range(len(CHANNELS))]
+    sample_images = [os.path.join(SAMPLES_PATH, f"{MATERIAL_NAME}_DYE{i+1}.jpg") for i in range(len(CHANNELS))]
+    calibration_images = [[os.path.join(DYE_PATHS[d], f"dye{d+1}_{ppm}ppm.jpg") for ppm in CALIBRATION_PPM] for d in range(len(CHANNELS))]
 
     # Run plotting
-    plot_with_regression_and_images(calibration_images, sample_images, MATERIAL_NAME, RESULTS_PATH)
+    parameters = load_calibration(DYE_PATHS, PLOTS_PATH)
+    plot_with_regression_and_images(calibration_images, sample_images, MATERIAL_NAME, RESULTS_PATH, parameters)
 
 
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of decoded images as memory-mapped NumPy arrays.
+
+Every decoded image is stored as an uncompressed .npy file named after the
+source path, modification time and size, so a changed JPEG gets a new entry
+and stale entries simply stop being used. Cached images are opened with
+np.load(..., mmap_mode='r'): reading an ROI only touches the pages of the rows
+it covers instead of decoding the whole JPEG again.
+
+The modification time of an entry is bumped on every hit and the least
+recently used entries are deleted once the cache grows over max_bytes. All
+file updates are atomic renames, so the cache can be shared by the worker
+processes of a batch run.
+"""
+
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+
+class DecodedImageCache:
+    """Decode images once and serve them as read-only memory-mapped arrays."""
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, image_path):
+        """Return the cache file of the current version of image_path."""
+        stat = os.stat(image_path)
+        key = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    def load(self, image_path):
+        """Return the decoded BGR image, decoding and caching it on a miss."""
+        entry = self.entry_path(image_path)
+        try:
+            image = np.load(entry, mmap_mode='r')
+            os.utime(entry)
+            return image
+        except (FileNotFoundError, ValueError):
+            pass
+
+        image = cv2.imread(image_path)
+        if image is None:
+            raise FileNotFoundError(f"Cannot read image {image_path}")
+        temporary = f"{entry}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as entry_file:
+            np.save(entry_file, image)
+        os.replace(temporary, entry)
+        self.evict()
+        return image
+
+    def size(self):
+        """Return the total size of the cached arrays in bytes."""
+        return sum(os.path.getsize(path) for path, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    entries.append((path, os.stat(path)))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_mtime)
+        total = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= stat.st_size
+
+    def clear(self):
+        """Delete every cached array."""
+        for path, _ in self._entries():
+            os.remove(path)
@@ -0,0 +1,83 @@
+"""
+Regression test of the ROI extraction of ``colorimetry.py``.
+
+``draw_center_square`` now crops the measurement square before converting it
+to the requested channel, and writes its overlay through the artifact writer.
+Both are checked against the original implementation, embedded below as
+``baseline_draw_center_square``, on the raw sample and calibration images.
+Run with ``python -m pytest Colorimetry_workflow``.
+"""
+
+import glob
+import os
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+colorimetry = pytest.importorskip("colorimetry")
+from artifacts import ArtifactWriter  # noqa: E402
+
+DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset")
+IMAGES = sorted(glob.glob(os.path.join(DATASET, "*", "imgs", "*.jpg"))
+                + glob.glob(os.path.join(DATASET, "calibration_vials", "dye*", "dye*ppm.jpg")))
+BASELINE_CHANNELS = ["gray", "B", "G", "R", "H", "S", "V", "L", "A", "BB"]
+
+
+def baseline_draw_center_square(image_path, output_path, square_size=50, channel='B', x_offset=10, y_offset=45):
+    """The analysis before the change: split every colour space of the full image, then crop."""
+    image = cv2.imread(image_path)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    B, G, R = cv2.split(image)
+    H, S, V = cv2.split(hsv)
+    L, A, BB = cv2.split(lab)
+
+    channels = {
+        'gray': gray, 'B': B, 'G': G, 'R': R,
+        'H': H, 'S': S, 'V': V, 'L': L, 'A': A, 'BB': BB
+    }
+
+    height, width = gray.shape
+    cx, cy = width // 2 + x_offset, height // 2 + y_offset
+    x1, y1 = cx - square_size // 2, cy - square_size // 2
+    x2, y2 = cx + square_size // 2, cy + square_size // 2
+
+    median_value = np.median(channels[channel][y1:y2, x1:x2])
+
+    img_copy = channels[channel].copy() if channel == 'gray' else image.copy()
+    cv2.rectangle(img_copy, (x1, y1), (x2, y2), (255), 2)
+    cv2.imwrite(output_path, img_copy)
+
+    return median_value
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.delenv(colorimetry.IMAGE_CACHE_ENV, raising=False)
+    writer = ArtifactWriter(enabled=True)
+    monkeypatch.setattr(colorimetry, "artifact_writer", lambda: writer)
+    return writer
+
+
+def test_dataset_has_images():
+    assert IMAGES, f"No sample or calibration images under {DATASET}"
+
+
+def test_roi_settings_match_baseline():
+    assert (colorimetry.SQUARE_SIZE, colorimetry.X_OFFSET, colorimetry.Y_OFFSET) == (50, 10, 45)
+    assert set(colorimetry.CHANNEL_SOURCES) == set(BASELINE_CHANNELS)
+
+
+@pytest.mark.parametrize("image_path", IMAGES, ids=lambda path: os.path.relpath(path, DATASET))
+def test_draw_center_square_matches_baseline(image_path, writer, tmp_path):
+    for channel in BASELINE_CHANNELS:
+        expected = baseline_draw_center_square(image_path, str(tmp_path / f"baseline_{channel}.jpg"), channel=channel)
+        output = str(tmp_path / f"overlay_{channel}.jpg")
+        assert colorimetry.draw_center_square(image_path, output, channel=channel) == expected, channel
+    writer.flush()
+    assert not writer.errors
+    for channel in BASELINE_CHANNELS:
+        with open(tmp_path / f"baseline_{channel}.jpg", "rb") as baseline, open(tmp_path / f"overlay_{channel}.jpg", "rb") as overlay:
+            assert overlay.read() == baseline.read(), channel
@@ -1,10 +1,22 @@
-from frankx import Affine, Robot
+import os
+import sys
 
-robot = Robot("172.16.0.2")
-robot.set_default_behavior()
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from workflow_core.session import request_robot_state, session_available
 
-state = robot.read_once()
-print('\nPose: ', robot.current_pose())
-#print('O_TT_E: ', state.O_T_EE)
-print('Joints: ', state.q)
-#print('Elbow: ', state.elbow)
\ No newline at end of file
+if session_available():
+    #cached state from the station session's background monitor, no new robot connection
+    state = request_robot_state(max_age=1.0)
+    print('\nPose: ', state["pose"])
+    print('Joints: ', state["joints"])
+else:
+    from frankx import Affine, Robot
+
+    robot = Robot("172.16.0.2")
+    robot.set_default_behavior()
+
+    state = robot.read_once()
+    print('\nPose: ', robot.current_pose())
+    #print('O_TT_E: ', state.O_T_EE)
+    print('Joints: ', state.q)
+    #print('Elbow: ', state.elbow)
\ No newline at end of file
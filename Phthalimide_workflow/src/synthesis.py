@@ -1,94 +1,170 @@
 import sys
 from datetime import datetime
 import os
-from robinhood import RobInHood
-import time
+from typing import Union
 
-from robinhood.utils.timer import Timer
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from workflow_core.dosing import QuantosState, ensure_cartridge, order_by_cartridge
+from workflow_core.pump_lines import prime_if_needed, record_line_use
+from workflow_core.session import run_step
+from workflow_core.station import get_station, idle
 
 
-def prepare_single_sample(sample_number:int, results_directory: str, logname = datetime.now().strftime("%d_%m_%Y")) -> None:
+
+def _preparation_stages(station, results_directory: str) -> list:
     """
-    Prepare a single sample for synthesis.
+    Split the preparation of a sample into pipeline stages.
 
     Args:
         station (RobInHood): The RobInHood station object.
-        sample_number (int): The sample number to prepare.
         results_directory (str): The directory to save the results.
-        logname (str): The name of the log file. Defaults to current date and time.
 
     Returns:
-        None
+        list: The Stage objects, in the order a vial goes through them.
     """
 
+    from workflow_core.pipeline import Stage
+    from workflow_core.results_store import results_store
 
-    station = RobInHood(inst_logger = logname, data_path=results_directory)
+    def rack_to_quantos(sample_number):
+        vial_pos = station.sample_dict[sample_number]['vial']
+        liquid = station.sample_dict[sample_number]['liquid']
+        solid = station.sample_dict[sample_number]['solid']
 
-    print(station.sample_dict)
+        station._logger.info(f"Preparing sample {sample_number} with the following liquids: {liquid} and solids: {solid}")
+        
+        station._logger.info("Moving vial to the quantos")
+        station.robot.open_gripper_set_width(0.03)
+        station.vial_rack_to_quantos(vial_pos)
 
+    def load_cartridge(sample_number):
+        solid = station.sample_dict[sample_number]['solid']
 
-    #read solids and liquids to dispense from the sample dictionary
+        station._logger.info("Adding solids to the sample")
+        ensure_cartridge(station, solid)
 
-   
+    def dose_solid(sample_number):
+        solid = station.sample_dict[sample_number]['solid']
+        solid_mass = station.sample_dict[sample_number]['mass (mg)']
 
- 
-    sample_number = int(sample_number)
+        station._logger.info(f"Dispensing {solid} mg of {solid_mass} to the sample")
+        mass = station.quantos_dosing(quantity=solid_mass)
+        station.record_weight(sample_name=solid, file_name= sample_number, weight =mass, file_path = results_directory )
+        results_store().record(results_directory, "mass", mass, unit="mg", step="dose_solid", sample=sample_number,
+                               vial=station.sample_dict[sample_number]['vial'], solid=solid, chemical=solid)
+        return mass
 
-    vial_pos = station.sample_dict[sample_number]['vial']
-    liquid = station.sample_dict[sample_number]['liquid']
-    liquid_volume = station.sample_dict[sample_number]['volume (ml)']
-    solid = station.sample_dict[sample_number]['solid']
-    solid_mass = station.sample_dict[sample_number]['mass (mg)']
+    def quantos_to_pump(sample_number):
+        station._logger.info("Moving vial to the liquid handling station")
+        station.robot.open_gripper_set_width(0.03)
+        station.vial_quantos_to_pump()
 
-    station._logger.info(f"Preparing sample {sample_number} with the following liquids: {liquid} and solids: {solid}")
-    
-    station._logger.info("Moving vial to the quantos")
-    station.robot.open_gripper_set_width(0.03)
-    station.vial_rack_to_quantos(vial_pos)
-    
+    def dispense_liquid(sample_number):
+        liquid = station.sample_dict[sample_number]['liquid']
+        liquid_volume = station.sample_dict[sample_number]['volume (ml)']
 
-    station._logger.info("Adding solids to the sample")
+        vol_ul = int(liquid_volume)*1000
+        station.hold_position()
+        station._logger.info(f"Priming {station.pump.device_name} with {liquid}")
+        prime_if_needed(station, liquid)
 
-       
-    station.quantos_cartridge_handling_logic(solid_name=solid)
+        station._logger.info(f"Dispensing {vol_ul} ul of {liquid} to the sample")
+        station.infuse_position()
+        station.dispense_volume(vol=vol_ul, chemical=liquid)
+        station.hold_position()
+        results_store().record(results_directory, "volume", vol_ul, unit="uL", step="dispense_liquid", sample=sample_number,
+                               vial=station.sample_dict[sample_number]['vial'], solid=station.sample_dict[sample_number]['solid'],
+                               chemical=liquid)
 
+    def pump_to_capper(sample_number):
+        station._logger.info("Moving vial to the capper")
+        station.vial_pump_to_capper()
 
-    station._logger.info(f"Dispensing {solid} mg of {solid_mass} to the sample")
+    def cap(sample_number):
+        station.cap()
 
-    mass = station.quantos_dosing(quantity=solid_mass)
+    def capper_to_rack(sample_number):
+        vial_pos = station.sample_dict[sample_number]['vial']
 
-    station.record_weight(sample_name=solid, file_name= sample_number, weight =mass, file_path = results_directory )
+        station._logger.info("Moving vial to the vial rack")
+        station.vial_capper_to_rack(vial_pos)
 
-   
-    station._logger.info("Moving vial to the liquid handling station")
-    station.robot.open_gripper_set_width(0.03)
-    station.vial_quantos_to_pump()
+        station._logger.info(f"Sample preparation of sample number: {sample_number} complete")
 
-      
-    vol_ul = int(liquid_volume)*1000
-    station.hold_position()
-    station._logger.info(f"Priming {station.pump.device_name} with {liquid}")
-    station.pump_prime_dispense_tubing(chemical=liquid)
+    return [
+        Stage("rack_to_quantos", rack_to_quantos, uses=("arm",), location="quantos"),
+        Stage("load_cartridge", load_cartridge, uses=("arm", "quantos"), location="quantos"),
+        Stage("dose_solid", dose_solid, uses=("quantos",), location="quantos"),
+        Stage("quantos_to_pump", quantos_to_pump, uses=("arm",), location="pump"),
+        Stage("dispense_liquid", dispense_liquid, uses=("pump",), location="pump"),
+        Stage("pump_to_capper", pump_to_capper, uses=("arm",), location="capper"),
+        Stage("cap", cap, uses=("capper",), location="capper"),
+        Stage("capper_to_rack", capper_to_rack, uses=("arm",)),
+    ]
 
-      
-    station._logger.info(f"Dispensing {vol_ul} ul of {liquid} to the sample")
-    station.infuse_position()
-    station.dispense_volume(vol=vol_ul, chemical=liquid)
-    station.hold_position()
 
-    station._logger.info("Moving vial to the capper")
-    
-    station.vial_pump_to_capper()
-    station.cap()
+def prepare_single_sample(sample_number:int, results_directory: str, logname = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
+    """
+    Prepare a single sample for synthesis.
+
+    Args:
+        station (RobInHood): The RobInHood station object.
+        sample_number (int): The sample number to prepare.
+        results_directory (str): The directory to save the results.
+        logname (str): The name of the log file. Defaults to current date and time.
+
+    Returns:
+        None
+    """
+
+
+    station = get_station(station, logname, results_directory, devices=("arm", "quantos", "pump", "capper"))
+
+    print(station.sample_dict)
+
+    sample_number = int(sample_number)
+
+    for stage in _preparation_stages(station, results_directory):
+        stage.action(sample_number)
+
+
+def prepare_samples_pipelined(sample_numbers: list, results_directory: str, max_in_flight: int = 3, group_by_cartridge: bool = True,
+                              logname = datetime.now().strftime("%d_%m_%Y"), station=None) -> dict:
+    """
+    Prepare several samples, overlapping the Quantos, pump and capper stages of consecutive samples.
+
+    While the Quantos doses sample N the arm moves sample N-1 on to the capper
+    and back to the rack, instead of every device waiting for the previous
+    sample to be fully prepared.
 
-    station._logger.info("Moving vial to the vial rack")
-    station.vial_capper_to_rack(vial_pos)
+    Args:
+        station (RobInHood): The RobInHood station object.
+        sample_numbers (list): The sample numbers to prepare, in order.
+        results_directory (str): The directory to save the results.
+        max_in_flight (int): Maximum number of vials off the rack at once.
+        group_by_cartridge (bool): Dose all samples of one solid back to back, starting with the loaded cartridge.
+        logname (str): The name of the log file. Defaults to current date and time.
+
+    Returns:
+        dict: Stage timings per sample.
+    """
+
+    from workflow_core.pipeline import PipelineScheduler, SerializedStation
+
+    station = get_station(station, logname, results_directory, devices=("arm", "quantos", "pump", "capper"))
+
+    scheduler = PipelineScheduler(_preparation_stages(SerializedStation(station), results_directory), max_in_flight=max_in_flight, logger=station._logger)
+    sample_numbers = [int(sample_number) for sample_number in sample_numbers]
+    if group_by_cartridge:
+        sample_numbers = order_by_cartridge(sample_numbers, lambda sample_number: station.sample_dict[sample_number]['solid'], QuantosState().loaded_solid())
+    result = scheduler.run(sample_numbers)
 
-    station._logger.info(f"Sample preparation of sample number: {sample_number} complete")
+    station._logger.info(f"Prepared samples {list(sample_numbers)} in {result.makespan:.0f} s")
+    return result.timings
 
 
-def move_sample_to_hotplate(sample_number: int, results_directory: str, logname = datetime.now().strftime("%d_%m_%Y") ) -> None:
+def move_sample_to_hotplate(sample_number: int, results_directory: str, logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> None:
     """
     Move samples to the hotplate.
 
@@ -101,64 +177,185 @@ def move_sample_to_hotplate(sample_number: int, results_directory: str, logname
         None
     """
 
-    station = RobInHood(inst_logger = logname, data_path=results_directory)
+    from workflow_core.hotplate_slots import HotplateSlots
+
+    station = get_station(station, logname, results_directory, devices=("arm", "ika"))
     vial_pos = station.sample_dict[sample_number]['vial']
 
  
-    station._logger.info(f"Moving sample {sample_number} to the hotplate")
-    station.vial_rack_to_ika(vial_pos, ika_slot_number=vial_pos)
+    slot = HotplateSlots(results_directory, sample_dict=station.sample_dict).allocate(sample_number, vial_pos)
+    station._logger.info(f"Moving sample {sample_number} to hotplate slot {slot}")
+    station.vial_rack_to_ika(vial_pos, ika_slot_number=slot)
+
+
+def start_reaction_timer(results_directory: str, time_secs:int, time_mins:int, time_hours:int, timer_name: str = "reaction", logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> float:
+    """
+    Start a reaction timer without blocking.
+
+    The deadline is stored in the results directory; if a timer with the same name is
+    still running (e.g. after a controller restart) it is kept, so the reaction resumes
+    with the remaining time.
+
+    Args:
+        results_directory (str): The directory to save the results.
+        time_secs (int), time_mins (int), time_hours (int): The reaction time.
+        timer_name (str): Name of the timer, used by wait_reaction_timer.
+
+    Returns:
+        float: The deadline in epoch seconds.
+    """
+    from workflow_core.timers import TimerStore
+
+    station = get_station(station, logname, results_directory, devices=())
+    timer = TimerStore(results_directory).start(timer_name, seconds = time_hours * 3600 + time_mins * 60 + time_secs)
+    station._logger.info(f"Timer {timer_name} running until {datetime.fromtimestamp(timer.deadline)}")
+    return timer.deadline
+
+def wait_reaction_timer(results_directory: str, timer_name: str = "reaction", logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> None:
+    """
+    Wait for a timer started by start_reaction_timer, then stop stirring and heating.
 
+    Args:
+        results_directory (str): The directory to save the results.
+        timer_name (str): Name of the timer.
 
-def reaction_timer(results_directory: str, time_secs:int, time_mins:int, time_hours:int, logname = datetime.now().strftime("%d_%m_%Y") ):
+    Returns:
+        None
+    """
+    from workflow_core.hotplate import hotplate_controller
+    from workflow_core.timers import TimerStore, wait_for_timer
+
+    station = get_station(station, logname, results_directory, devices=("ika",))
+    store = TimerStore(results_directory)
+    timer = store.get(timer_name)
+    if timer is None:
+        raise ValueError(f"No timer named {timer_name} was started in {results_directory}")
+
+    # The hotplate keeps heating and stirring on its own, other steps can use it meanwhile
+    with idle(station, ("ika",)):
+        wait_for_timer(timer, logger = station._logger)
+
+    station._logger.info("Heating and Stirring Done, setting hotplate temperature back to RT and turning off stirring")
+    hotplate_controller(station).switch_off()
+    store.finish(timer_name)
+
+def reaction_timer(results_directory: str, time_secs:int, time_mins:int, time_hours:int, timer_name: str = "reaction", logname = datetime.now().strftime("%d_%m_%Y"), station=None ):
     
     
-    station = RobInHood(inst_logger = logname, data_path=results_directory)
+    station = get_station(station, logname, results_directory, devices=("ika",))
     station._logger.info("Starting Timer")
-    clock = Timer()
-    clock.set_timer(hours = time_hours, min = time_mins, sec = time_secs)
-    clock.start_timer()
-
-    station._logger.info("Heating and Stirring Done, setting hotplate temperature back to RT and turning off stirring")
-    station.ika.stop_stirring()
-    station.ika.stop_temperature_regulation() 
+    start_reaction_timer(results_directory, time_secs, time_mins, time_hours, timer_name = timer_name, logname = logname, station = station)
+    wait_reaction_timer(results_directory, timer_name = timer_name, logname = logname, station = station)
 
     
 
-def heat_stirr(temperature:float, speed:int,  results_directory:str, temperature_delta = 3, logname = datetime.now().strftime("%d_%m_%Y") ) -> None:
+def react_samples_rolling(sample_numbers: list, results_directory: str, time_secs: int, time_mins: int, time_hours: int, durations: dict = None,
+                          hotplate_slots: list = None, timer_name: str = "reaction", logname = datetime.now().strftime("%d_%m_%Y"), station=None) -> dict:
+    """
+    React samples in a rolling batch on the heated hotplate.
+
+    Each sample goes onto the first free hotplate slot and comes back to the rack when its own
+    reaction time is up, while new samples take the freed slots, so the hotplate stays full
+    when there are more samples than slots. Heat and stir first (heat_stirr, wait_for_temperature);
+    heating and stirring are switched off once the last sample is off.
+
+    Args:
+        sample_numbers (list): The sample numbers, in the order they go onto the hotplate.
+        results_directory (str): The directory to save the results.
+        time_secs (int), time_mins (int), time_hours (int): The reaction time of every sample.
+        durations (dict): Reaction time in seconds per sample number, overriding the time above.
+        hotplate_slots (list): The usable hotplate slots. Defaults to ``ika_slots`` in ``conf/running_variables.json``,
+            or the rack positions of the samples if it is not set.
+        timer_name (str): Name of the batch, so an interrupted batch resumes where it stopped.
+
+    Returns:
+        dict: ``{sample: (seconds on the hotplate, slot)}``.
+    """
+    from workflow_core.hotplate import hotplate_controller
+    from workflow_core.hotplate_slots import HotplateSlots, run_rolling
+
+    station = get_station(station, logname, results_directory, devices=("arm", "ika"))
+
+    default = time_hours * 3600 + time_mins * 60 + time_secs
+    durations = {int(sample): float(seconds) for sample, seconds in (durations or {}).items()}
+
+    def vial_of(sample_number):
+        return station.sample_dict[sample_number]['vial']
+
+    station._logger.info(f"Reacting samples {sample_numbers} in a rolling batch")
+    reacted = run_rolling(HotplateSlots(results_directory, hotplate_slots, station.sample_dict), [int(sample) for sample in sample_numbers],
+                          lambda sample_number: durations.get(sample_number, default),
+                          lambda sample_number, slot: station.vial_rack_to_ika(vial_of(sample_number), ika_slot_number=slot),
+                          lambda sample_number, slot: station.vial_ika_to_rack(vial_of(sample_number), ika_slot_number=slot),
+                          vial_of=vial_of, batch=timer_name, logger=station._logger,
+                          # The arm is only needed to move vials, other steps can use it in between
+                          idle=lambda: idle(station, ("arm",)))
+
+    station._logger.info("Heating and Stirring Done, setting hotplate temperature back to RT and turning off stirring")
+    hotplate_controller(station).switch_off()
+    return reacted
+
+def heat_stirr(temperature:float, speed:int,  results_directory:str, temperature_delta = 3, wait: bool = True, use_speed: bool = False, logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> None:
     """
     Heat and stir samples on the hotplate.
 
     Args:
         station (RobInHood): The RobInHood station object.
-        sample_numbers (list): The list of sample numbers to heat and stir.
+        temperature (float): The target temperature, also used with a low target as a cooling wait.
+        speed (int): The stirring speed, only used with ``use_speed``.
         results_directory (str): The directory to save the results.
+        temperature_delta (float): Tolerance around the target temperature.
+        wait (bool): Block until the target is reached. If False the temperature is watched in the
+            background and a later wait_for_temperature step (in the same session or runner) waits for it,
+            so the arm can carry on with other steps while the hotplate heats or cools.
+        use_speed (bool): Stir at ``speed``. By default the hotplate stirs at 500 rpm, whatever speed is passed.
 
     Returns:
         None
     """
-    station = RobInHood(inst_logger = logname, data_path=results_directory)
+    from workflow_core.hotplate import hotplate_controller
+
+    station = get_station(station, logname, results_directory, devices=("ika",))
 
     station._logger.info("Heating and stirring samples on the hotplate")
-    
-    station.ika.set_temperature(temperature=temperature)
-    station.ika.set_speed(speed = 500)
-    station.ika.start_temperature_regulation()
-    station.ika.start_stirring()
 
+    controller = hotplate_controller(station)
+    reached = controller.start(temperature=temperature, speed=speed if use_speed else 500, temperature_delta=temperature_delta)
 
-    while True:
-        measured_temp = station.ika.get_temperature(sensor=0)
-        if abs(measured_temp - temperature) <= temperature_delta:
-            station._logger.info(f"Temperature of {temperature} reached")
-            break
-        else: 
-            station._logger.info(f"Temperature of {temperature} not reached, current temperature is {measured_temp}")
-            time.sleep(5)
+    if wait:
+        reached.result()
+    else:
+        station._logger.info(f"Not waiting for {temperature}, the hotplate is monitored in the background")
 
   
     #station.ika.stop_all_tasks()
 
-def store_samples_from_hotplate(sample_number: int, results_directory:str, logname = datetime.now().strftime("%d_%m_%Y") ) -> None:
+def wait_for_temperature(temperature:float, results_directory:str, temperature_delta = 3, logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> None:
+    """
+    Wait until the hotplate is at the temperature set by an earlier heat_stirr(wait=False) step.
+
+    Args:
+        station (RobInHood): The RobInHood station object.
+        temperature (float): The target temperature.
+        results_directory (str): The directory to save the results.
+        temperature_delta (float): Tolerance around the target temperature.
+
+    Returns:
+        None
+    """
+    from workflow_core.hotplate import hotplate_controller
+
+    station = get_station(station, logname, results_directory, devices=("ika",))
+
+    controller = hotplate_controller(station)
+    reached = controller.wait_for(temperature, temperature_delta)
+
+    remaining = controller.estimate_time_to_target(temperature, temperature_delta)
+    if remaining is not None:
+        station._logger.info(f"Waiting about {remaining / 60:.1f} min for the hotplate to reach {temperature}")
+    reached.result()
+
+def store_samples_from_hotplate(sample_number: int, results_directory:str, logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> None:
     """
     Store samples from the hotplate.
 
@@ -170,15 +367,21 @@ def store_samples_from_hotplate(sample_number: int, results_directory:str, logna
     Returns:
         None
     """
+
+    from workflow_core.hotplate_slots import HotplateSlots
     
-    station = RobInHood(inst_logger = logname, data_path= results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "ika"))
 
     station._logger.info(f"Moving sample {sample_number} to the vial rack")
     
     vial_pos = station.sample_dict[sample_number]['vial']
-    station.vial_ika_to_rack(vial_pos,vial_pos)
+    hotplate = HotplateSlots(results_directory, sample_dict=station.sample_dict)
+    slot = hotplate.slot_of(sample_number)
+    station.vial_ika_to_rack(vial_pos, ika_slot_number=vial_pos if slot is None else slot)
+    # Only free the slot once the vial is off it
+    hotplate.release(sample_number)
 
-def add_solvent(sample_number: int, wash_solvent:str, wash_amount:float, results_directory:str, logname = datetime.now().strftime("%d_%m_%Y") ) -> None:
+def add_solvent(sample_number: int, wash_solvent:str, wash_amount:float, results_directory:str, logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> None:
     """
     Wash samples.
 
@@ -192,37 +395,31 @@ def add_solvent(sample_number: int, wash_solvent:str, wash_amount:float, results
     Returns:
         None
     """
+
+    from workflow_core.transfers import RACK, Operation, run_chain
     
-    station = RobInHood(inst_logger= logname, data_path=results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "pump", "capper"))
 
     station._logger.info(f"Washing sample {sample_number} with {wash_solvent} and {wash_amount} ml")
 
     vial_pos = station.sample_dict[sample_number]['vial']
-  
-
-    station.vial_decap(vial_pos)
-
-    station.pump_prime_dispense_tubing(wash_solvent)
-
-    station.infuse_position()
-
-    station.dispense_volume(vol = float(wash_amount)*1000, chemical= wash_solvent)
-
-    station.hold_position()
 
-    station.vial_pump_to_capper()
-    
-    station.cap()
-
-    station.vial_capper_to_pump()
+    def dispense():
+        prime_if_needed(station, wash_solvent)
+        station.infuse_position()
+        station.dispense_volume(vol = float(wash_amount)*1000, chemical= wash_solvent)
+        station.hold_position()
 
-    station.vial_pump_to_rack(vial_number=vial_pos)
+    # The capped vial goes from the capper straight back to the rack
+    run_chain(station, vial_pos, [Operation(RACK, lambda: station.vial_decap(vial_pos), leaves_at="pump"),
+                                  Operation("pump", dispense),
+                                  Operation("capper", station.cap)])
 
 
-def wash_filtered_sample(sample_number:int, wash_volume: float, wash_cycles:int, wash_solvent:str, results_directory:str, logname: str = datetime.now().strftime("%d_%m_%Y")) -> None:
+def wash_filtered_sample(sample_number:int, wash_volume: float, wash_cycles:int, wash_solvent:str, results_directory:str, logname: str = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
     """ Washes the filtered sample with a specified solvent."""
 
-    station = RobInHood(inst_logger=logname, data_path=results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "quantos", "pump", "filter"))
 
     station.quantos.close_front_door()
     vial_pos = station.sample_dict[sample_number]['vial']
@@ -235,7 +432,7 @@ def wash_filtered_sample(sample_number:int, wash_volume: float, wash_cycles:int,
         station._logger.info(f"Washing the filter with {wash_solvent}")
         station._logger.info(f"Filling the sample vial {vial_pos} with {wash_volume} ml of {wash_solvent}")
         station.hold_position()
-        station.pump_prime_dispense_tubing(wash_solvent)
+        prime_if_needed(station, wash_solvent)
         wash_volume_ul =wash_volume * 1000  # Convert from mL to uL
         station.vial_rack_to_pump(vial_pos)
         station.infuse_position()
@@ -248,7 +445,7 @@ def wash_filtered_sample(sample_number:int, wash_volume: float, wash_cycles:int,
     station._logger.info(f"Sample {vial_pos} washed {wash_cycles} times with {wash_solvent} and returned to the rack")
 
 def filter_samples(sample_number: int, cleaning_vial_number:int, cleaning_vial_solvent:str,
-                    results_directory:str,logname = datetime.now().strftime("%d_%m_%Y") ) -> None:
+                    results_directory:str,logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> None:
     """
     Filter samples.
 
@@ -261,16 +458,25 @@ def filter_samples(sample_number: int, cleaning_vial_number:int, cleaning_vial_s
         None
     """
     
-    station = RobInHood(inst_logger= logname,data_path=results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "pump", "capper", "filter"))
 
     station._logger.info(f"Filtering sample {sample_number}")
 
     sample_number = int(sample_number)
 
-    vial_pos = station.sample_dict[sample_number]['vial']
     liquid_volume = int(station.sample_dict[sample_number]['volume (ml)'])
 
     station.filtration_prep(cleaning_vial_number=cleaning_vial_number, cleaning_solvent=cleaning_vial_solvent, cleaning_solvent_volume=liquid_volume*1000), 
+    record_line_use(cleaning_vial_solvent)
+
+    _filter_on_prepared_filter(station, sample_number)
+
+
+def _filter_on_prepared_filter(station, sample_number: int) -> None:
+    """Decap a sample and filter it through the prepared filter, discarding the filtrate."""
+
+    vial_pos = station.sample_dict[sample_number]['vial']
+    liquid_volume = int(station.sample_dict[sample_number]['volume (ml)'])
 
     station.vial_decap(vial_pos)
 
@@ -279,7 +485,62 @@ def filter_samples(sample_number: int, cleaning_vial_number:int, cleaning_vial_s
     station.just_filter_sample_disgard_filtrate(sample_vial_number=vial_pos, sample_vial_volume= int(liquid_volume)*1000)
 
 
-def clean_filter(filt_cleaning_solvent:str, filt_cleaning_volume:float, results_directory:str, logname = datetime.now().strftime("%d_%m_%Y") ) -> None:
+def filter_samples_batch(sample_numbers: list, cleaning_vial_number: int, cleaning_vial_solvent: str, wash_volume: float, wash_cycles: int,
+                         wash_solvent: str, filt_cleaning_solvent: str, filt_cleaning_volume: float, results_directory: str,
+                         compatible_on: list = None, max_group_size: Union[int, None] = 1, isolate: list = None,
+                         logname = datetime.now().strftime("%d_%m_%Y"), station=None) -> list:
+    """
+    Filter and wash several samples, preparing and cleaning the filter once per group of compatible samples.
+
+    With ``max_group_size`` above 1 (or None), consecutive samples whose sample dictionary entries
+    match on ``compatible_on`` share one ``filtration_prep`` and one ``clean_filter``. By default
+    every sample still gets its own prep and clean.
+
+    Args:
+        station (RobInHood): The RobInHood station object.
+        sample_numbers (list): The sample numbers to filter, in order.
+        cleaning_vial_number (int): The vial used to prepare the filter.
+        cleaning_vial_solvent (str): The solvent in the cleaning vial.
+        wash_volume (float): The wash volume in ml, see ``wash_filtered_sample``.
+        wash_cycles (int): The number of washes per sample.
+        wash_solvent (str): The wash solvent.
+        filt_cleaning_solvent (str): The solvent to clean the filter with after each group.
+        filt_cleaning_volume (float): The volume in ml to clean the filter with.
+        results_directory (str): The directory to save the results.
+        compatible_on (list): Sample dictionary fields that must match to share the filter. Defaults to the liquid and the solid.
+        max_group_size (int): Clean the filter after at most this many samples. Defaults to 1, None for no limit.
+        isolate (list): Sample numbers that get a freshly prepared filter to themselves.
+
+    Returns:
+        list: The sample groups, one per filter prep.
+    """
+
+    from workflow_core.filtration import ContaminationPolicy, filtration_groups
+
+    station = get_station(station, logname, results_directory, devices=("arm", "quantos", "pump", "capper", "filter"))
+
+    compatible_on = compatible_on if compatible_on is not None else ['liquid', 'solid']
+    sample_numbers = [int(sample_number) for sample_number in sample_numbers]
+    groups = filtration_groups(sample_numbers, lambda sample_number: tuple(station.sample_dict[sample_number][key] for key in compatible_on),
+                               ContaminationPolicy(max_group_size=max_group_size, isolate=isolate or []))
+    station._logger.info(f"Filtering samples {sample_numbers} with {len(groups)} filter preps: {groups}")
+
+    for group in groups:
+        liquid_volume = max(int(station.sample_dict[sample_number]['volume (ml)']) for sample_number in group)
+        station.filtration_prep(cleaning_vial_number=cleaning_vial_number, cleaning_solvent=cleaning_vial_solvent, cleaning_solvent_volume=liquid_volume*1000)
+        record_line_use(cleaning_vial_solvent)
+
+        for sample_number in group:
+            station._logger.info(f"Filtering sample {sample_number}")
+            _filter_on_prepared_filter(station, sample_number)
+            wash_filtered_sample(sample_number, wash_volume, wash_cycles, wash_solvent, results_directory, logname=logname, station=station)
+
+        clean_filter(filt_cleaning_solvent, filt_cleaning_volume, results_directory, logname=logname, station=station)
+
+    return groups
+
+
+def clean_filter(filt_cleaning_solvent:str, filt_cleaning_volume:float, results_directory:str, logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> None:
     """
     Clean the filter.
 
@@ -293,41 +554,68 @@ def clean_filter(filt_cleaning_solvent:str, filt_cleaning_volume:float, results_
         None
     """
     
-    station = RobInHood(inst_logger=logname, data_path=results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "pump", "filter"))
 
     filt_cleaning_volume_ul = float(filt_cleaning_volume) * 1000  # Convert from mL to uL
     station._logger.info(f"Cleaning the filter with {filt_cleaning_solvent} and {filt_cleaning_volume_ul} uL")
     station.filter_cleaning_packdown(cleaning_solvent= filt_cleaning_solvent, cleaning_solvent_volume=filt_cleaning_volume_ul)
+    record_line_use(filt_cleaning_solvent)
 
 
 if __name__ == "__main__":
     if sys.argv[1] == "prepare_samples":
-        prepare_single_sample(sample_number = int(sys.argv[2]), results_directory = sys.argv[3])
+        run_step(prepare_single_sample, sample_number = int(sys.argv[2]), results_directory = sys.argv[3])
+
+    elif sys.argv[1] == "prepare_samples_pipelined":
+        run_step(prepare_samples_pipelined, sample_numbers = [int(sample) for sample in sys.argv[3:]], results_directory = sys.argv[2])
 
     elif sys.argv[1] == "samples_to_hotplate":
-        move_sample_to_hotplate(sample_number = int(sys.argv[2]), results_directory = sys.argv[3])
+        run_step(move_sample_to_hotplate, location = "hotplate", sample_number = int(sys.argv[2]), results_directory = sys.argv[3])
 
     elif sys.argv[1] == "heat_stirr":
-        heat_stirr(temperature = float(sys.argv[2]) , speed = int(sys.argv[3]),  results_directory=sys.argv[4])
+        run_step(heat_stirr, temperature = float(sys.argv[2]) , speed = int(sys.argv[3]),  results_directory=sys.argv[4])
+
+    elif sys.argv[1] == "heat_stirr_nowait":
+        run_step(heat_stirr, temperature = float(sys.argv[2]) , speed = int(sys.argv[3]),  results_directory=sys.argv[4], wait = False)
+
+    elif sys.argv[1] == "wait_for_temperature":
+        run_step(wait_for_temperature, temperature = float(sys.argv[2]), results_directory=sys.argv[3])
 
     elif sys.argv[1] == "store_samples":
-        store_samples_from_hotplate(sample_number = int(sys.argv[2]), results_directory = sys.argv[3])
+        run_step(store_samples_from_hotplate, location = "rack", sample_number = int(sys.argv[2]), results_directory = sys.argv[3])
     
     elif sys.argv[1] == "filter_samples":
-        filter_samples(sample_number = int(sys.argv[2]), cleaning_vial_number = int(sys.argv[3]), cleaning_vial_solvent = sys.argv[4], 
+        run_step(filter_samples, sample_number = int(sys.argv[2]), cleaning_vial_number = int(sys.argv[3]), cleaning_vial_solvent = sys.argv[4], 
                          results_directory = sys.argv[5])
 
+    elif sys.argv[1] == "filter_samples_batch":
+        run_step(filter_samples_batch, results_directory = sys.argv[2], cleaning_vial_number = int(sys.argv[3]), cleaning_vial_solvent = sys.argv[4],
+                 wash_volume = float(sys.argv[5]), wash_cycles = int(sys.argv[6]), wash_solvent = sys.argv[7], filt_cleaning_solvent = sys.argv[8],
+                 filt_cleaning_volume = float(sys.argv[9]), max_group_size = int(sys.argv[10]) or None, sample_numbers = [int(sample) for sample in sys.argv[11:]])
+
     elif sys.argv[1] == "reaction_timer":
-        reaction_timer(results_directory=sys.argv[2], time_hours= int(sys.argv[3]), time_mins= int(sys.argv[4]), time_secs= int(sys.argv[5]))
+        run_step(reaction_timer, results_directory=sys.argv[2], time_hours= int(sys.argv[3]), time_mins= int(sys.argv[4]), time_secs= int(sys.argv[5]),
+                 timer_name = sys.argv[6] if len(sys.argv) > 6 else "reaction")
+
+    elif sys.argv[1] == "react_samples_rolling":
+        run_step(react_samples_rolling, results_directory=sys.argv[2], time_hours= int(sys.argv[3]), time_mins= int(sys.argv[4]), time_secs= int(sys.argv[5]),
+                 sample_numbers = [int(sample) for sample in sys.argv[6:]])
+
+    elif sys.argv[1] == "start_reaction_timer":
+        run_step(start_reaction_timer, results_directory=sys.argv[2], time_hours= int(sys.argv[3]), time_mins= int(sys.argv[4]), time_secs= int(sys.argv[5]),
+                 timer_name = sys.argv[6] if len(sys.argv) > 6 else "reaction")
+
+    elif sys.argv[1] == "wait_reaction_timer":
+        run_step(wait_reaction_timer, results_directory=sys.argv[2], timer_name = sys.argv[3] if len(sys.argv) > 3 else "reaction")
 
     elif sys.argv[1] == "add_solvent":
-        add_solvent(sample_number = int(sys.argv[2]), wash_solvent = sys.argv[3], wash_amount = float(sys.argv[4]), results_directory= sys.argv[5])
+        run_step(add_solvent, sample_number = int(sys.argv[2]), wash_solvent = sys.argv[3], wash_amount = float(sys.argv[4]), results_directory= sys.argv[5])
     
     elif sys.argv[1] == "wash_filtered_sample":
-        wash_filtered_sample(sample_number = int(sys.argv[2]), wash_volume = float(sys.argv[3]), wash_cycles = int(sys.argv[4]), wash_solvent = sys.argv[5], results_directory= sys.argv[6])
+        run_step(wash_filtered_sample, sample_number = int(sys.argv[2]), wash_volume = float(sys.argv[3]), wash_cycles = int(sys.argv[4]), wash_solvent = sys.argv[5], results_directory= sys.argv[6])
 
     elif sys.argv[1] == "clean_filter":
-        clean_filter(filt_cleaning_solvent = sys.argv[2], filt_cleaning_volume = float(sys.argv[3]), results_directory = sys.argv[4])
+        run_step(clean_filter, filt_cleaning_solvent = sys.argv[2], filt_cleaning_volume = float(sys.argv[3]), results_directory = sys.argv[4])
     else:
         print("Invalid command. Please use one of the following commands:")
         print("1. prepare_samples")
@@ -337,4 +625,11 @@ if __name__ == "__main__":
         print("5. filter_samples")
         print("6. reaction_timer")
         print("7. add_solvent")
-        print("8. wash_filtered_sample")
\ No newline at end of file
+        print("8. wash_filtered_sample")
+        print("9. prepare_samples_pipelined")
+        print("10. heat_stirr_nowait")
+        print("11. wait_for_temperature")
+        print("12. start_reaction_timer")
+        print("13. wait_reaction_timer")
+        print("14. filter_samples_batch")
+        print("15. react_samples_rolling")
\ No newline at end of file
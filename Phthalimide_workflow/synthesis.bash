@@ -37,14 +37,30 @@ WASH_CYCLES=2
 FILT_CLEANING_SOLVENT="Ethanol"
 FILT_CLEANING_SOLVENT_VOL=10 #ml
 
+#Samples per filter prep and clean; raise it (0: no limit) to let neighbouring samples with the same liquid and solid share the filter
+MAX_FILTER_GROUP=1
+
 
 
 read_robot_state(){
-    python $LOCAL_PATH/src/read_current_state.py
-    python $LOCAL_PATH/src/read_current_state.py
+    #served from the station session's cached state monitor when a session is running
     python $LOCAL_PATH/src/read_current_state.py
 }
 
+start_station_session(){
+    #the steps authenticate to the session with this key
+    export ROBINHOOD_SESSION_KEY=${ROBINHOOD_SESSION_KEY:-$(python -c "import secrets; print(secrets.token_hex(16))")}
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session serve $DATA_PATH &
+    SESSION_PID=$!
+    trap stop_station_session EXIT
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session wait
+}
+
+stop_station_session(){
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session stop
+    wait $SESSION_PID || true
+}
+
 
 if [ ! -d "$DATA_PATH" ]; then
     echo "[WARNING] Directory $DATA_PATH does not exist."
@@ -56,6 +72,21 @@ fi
 
 
 
+#Run with --resume to skip the steps a failed run already completed
+if [ "$1" == "--resume" ]; then
+    echo "[INFO] Resuming from the step journal"
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.journal resume $DATA_PATH
+else
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.journal start $DATA_PATH --name phthalimide_synthesis
+    rm -f $DATA_PATH/trace_spans.jsonl $DATA_PATH/hotplate_slots.json
+fi
+export WORKFLOW_JOURNAL=$DATA_PATH
+#Every station call is timed in trace_spans.jsonl
+export WORKFLOW_TRACE=$DATA_PATH
+
+echo "[INFO] Starting station session"
+start_station_session
+
 echo "[INFO] Script running in $LOCAL_PATH"
 echo "[INFO] Results will be saved in $DATA_PATH"
 
@@ -63,23 +94,24 @@ echo "[INFO] Reading robot state:"
 read_robot_state 
 
 
+echo "[INFO] Setting hotplate to heat while the samples are prepared"
+python $LOCAL_PATH/src/synthesis.py "heat_stirr_nowait" $TEMPERATURE $SPEED $DATA_PATH
+
 echo "[INFO] Step 1: Preparing samples."
 
 
-for sample in "${SAMPLES[@]}"; do
-    echo "[INFO] Preparing sample $sample"
-    read_robot_state
-    python $LOCAL_PATH/src/synthesis.py "prepare_samples" $sample $DATA_PATH
-done
+#Quantos dosing, pump dispensing and capping of consecutive samples overlap
+read_robot_state
+python $LOCAL_PATH/src/synthesis.py "prepare_samples_pipelined" $DATA_PATH "${SAMPLES[@]}"
 
 echo "[INFO] Reading robot state:"
 read_robot_state
 
 echo "[INFO] Step 3: Stirring and heating samples."
 
-echo "[INFO] Setting hotplate to heat" 
+echo "[INFO] Waiting for the hotplate to reach $TEMPERATURE" 
 
-python $LOCAL_PATH/src/synthesis.py "heat_stirr" $TEMPERATURE $SPEED $DATA_PATH 
+python $LOCAL_PATH/src/synthesis.py "wait_for_temperature" $TEMPERATURE $DATA_PATH 
 
 
 echo "[INFO] Moving samples to the hotplate"
@@ -111,6 +143,9 @@ done
 echo "[INFO] Reading robot state:"
 read_robot_state
 
+echo "[INFO] Letting the hotplate cool to near room temperature while water is added"
+python $LOCAL_PATH/src/synthesis.py "heat_stirr_nowait" 30 $SPEED $DATA_PATH
+
 echo "[INFO] Step 5: Adding water to samples"
 
 for sample in "${SAMPLES[@]}"; do
@@ -120,7 +155,7 @@ for sample in "${SAMPLES[@]}"; do
 done
 
 echo "[INFO] waiting for sample to cool to near room temperature"
-python $LOCAL_PATH/src/synthesis.py "heat_stirr" 30 $SPEED $DATA_PATH
+python $LOCAL_PATH/src/synthesis.py "wait_for_temperature" 30 $DATA_PATH
 
 
 for sample in "${SAMPLES[@]}"; do
@@ -132,7 +167,7 @@ done
 echo "[INFO] Stirring samples on hotplate"
 
 python $LOCAL_PATH/src/synthesis.py "heat_stirr" 30 $SPEED $DATA_PATH
-python $LOCAL_PATH/src/synthesis.py "reaction_timer" $DATA_PATH 0 20 0
+python $LOCAL_PATH/src/synthesis.py "reaction_timer" $DATA_PATH 0 20 0 stirring
 
 for i in "${!SAMPLES[@]}"; do
    echo "[INFO] Moving sample ${SAMPLES[-1 - $i]} to the rack"
@@ -142,12 +177,11 @@ done
 
 echo "[INFO] Step 5: Filtering samples"
 
-for sample in "${SAMPLES[@]}"; do
-    echo "[INFO] Filtering sample $sample"
-    read_robot_state
-    python $LOCAL_PATH/src/synthesis.py "filter_samples" "$sample" $CLEANING_VIAL $CLEANING_SOLVENT $DATA_PATH
-    python $LOCAL_PATH/src/synthesis.py "wash_filtered_sample" $sample $WASH_SOLVENT_VOLUME $WASH_CYCLES $SOLVENT $DATA_PATH
-    python $LOCAL_PATH/src/synthesis.py "clean_filter" $FILT_CLEANING_SOLVENT $FILT_CLEANING_SOLVENT_VOL $DATA_PATH
-done
+read_robot_state
+python $LOCAL_PATH/src/synthesis.py "filter_samples_batch" $DATA_PATH $CLEANING_VIAL $CLEANING_SOLVENT $WASH_SOLVENT_VOLUME $WASH_CYCLES $SOLVENT \
+    $FILT_CLEANING_SOLVENT $FILT_CLEANING_SOLVENT_VOL $MAX_FILTER_GROUP "${SAMPLES[@]}"
+
+echo "[INFO] Station timing summary:"
+PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.tracing $DATA_PATH --chrome $DATA_PATH/trace.json
 
 echo "[INFO] Worklfow complete"
\ No newline at end of file
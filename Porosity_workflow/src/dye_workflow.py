@@ -1,115 +1,288 @@
 import sys
-from robinhood import RobInHood
-from robinhood.utils.timer import Timer 
 from typing import Union
 
 from datetime import datetime
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from workflow_core.dosing import QuantosState, ensure_cartridge, order_by_cartridge
+from workflow_core.pump_lines import prime_if_needed, record_line_use
+from workflow_core.session import run_step
+from workflow_core.station import get_station, idle
 
 # datetime object containing current date and time
 
-def prepare_single_sample(sample_number:int, results_directory: str, logname = datetime.now().strftime("%d_%m_%Y")) -> None:
+def _preparation_stages(station, results_directory: str) -> list:
     """
+    Split the preparation of a sample into pipeline stages, in the order a vial goes through them.
     """
 
-    station = RobInHood(inst_logger = logname, data_path=results_directory)
+    from workflow_core.pipeline import Stage
 
-    #unpacking sample information from sample_dictionary
-    sample_number = int(sample_number)
+    def rack_to_quantos(sample_number):
+        vial_pos = station.sample_dict[sample_number]['vial']
+        liquid_name = station.sample_dict[sample_number]['liquid']
+        solid_name = station.sample_dict[sample_number]['solid']
 
-    vial_pos = station.sample_dict[sample_number]['vial']
-    liquid_name = station.sample_dict[sample_number]['liquid']
-    liquid_volume = station.sample_dict[sample_number]['volume (ml)']*1000 #all dispense steps in uL
-    solid_name = station.sample_dict[sample_number]['solid']
-    solid_mass = station.sample_dict[sample_number]['mass (mg)']
+        station._logger.info(f"Preparing sample {sample_number} with the following liquid: {liquid_name} and solid: {solid_name}")
 
-    
-    print(type(solid_name))
-    print(type(liquid_name))
+        station._logger.info("Moving vial to the quantos")
+        station.robot.open_gripper_set_width(0.03)
+        station.vial_rack_to_quantos(vial_pos)
+
+    def load_cartridge(sample_number):
+        solid_name = station.sample_dict[sample_number]['solid']
+
+        station._logger.info("Adding solid to the sample")
+        ensure_cartridge(station, solid_name)
+
+    def dose_solid(sample_number):
+        solid_name = station.sample_dict[sample_number]['solid']
+        solid_mass = station.sample_dict[sample_number]['mass (mg)']
 
-    station._logger.info(f"Preparing sample {sample_number} with the following liquid: {liquid_name} and solid: {solid_name}")
+        station._logger.info(f"Dispensing {solid_mass} mg of {solid_name}")
+        #mass = station.quantos_dosing(solid_mass)
+        mass = 100
+        station._logger.info(f"Dispensed {mass} mg of {solid_name}")
+        station.record_weight(sample_name=solid_name, file_name= sample_number, weight =mass, file_path = results_directory )
+        # Dosing is disabled above, so the mass is a placeholder and stays out of the results store
+        return mass
 
-    station._logger.info("Moving vial to the quantos")
-    station.robot.open_gripper_set_width(0.03)
-    station.vial_rack_to_quantos(vial_pos)
+    def quantos_to_pump(sample_number):
+        station._logger.info("Moving vial to the liquid handling station")
+        station.robot.open_gripper_set_width(0.03)
+        station.vial_quantos_to_pump()
 
-    station._logger.info("Adding solid to the sample")
+    def dispense_liquid(sample_number):
+        liquid_name = station.sample_dict[sample_number]['liquid']
+        liquid_volume = station.sample_dict[sample_number]['volume (ml)']*1000 #all dispense steps in uL
 
-    station.quantos_cartridge_handling_logic(solid_name=solid_name)
-    station._logger.info(f"Dispensing {solid_mass} mg of {solid_name}")
-    #mass = station.quantos_dosing(solid_mass)
-    mass = 100
-    station._logger.info(f"Dispensed {mass} mg of {solid_name}")
-    station.record_weight(sample_name=solid_name, file_name= sample_number, weight =mass, file_path = results_directory )
+        station._logger.info(f"Priming the tubing with {liquid_name}")
+        station.hold_position()
+        prime_if_needed(station, liquid_name)
 
-    station._logger.info("Moving vial to the liquid handling station")
-    station.robot.open_gripper_set_width(0.03)
-    station.vial_quantos_to_pump()
+        station._logger.info(f"Dispensing {liquid_volume} uL of {liquid_name}")
+        station.infuse_position()
+        #station.dispense_volume(vol = liquid_volume, chemical=liquid_name)
+        station.hold_position()
+        # Nothing was dispensed, so no volume goes to the results store
 
-    station._logger.info(f"Priming the tubing with {liquid_name}")
-    station.hold_position()
-    station.pump_prime_dispense_tubing(liquid_name)
+    def pump_to_capper(sample_number):
+        station._logger.info("Moving vial to the capper")
+        station.vial_pump_to_capper()
 
-    station._logger.info(f"Dispensing {liquid_volume} uL of {liquid_name}")
-    station.infuse_position()
-    #station.dispense_volume(vol = liquid_volume, chemical=liquid_name)
-    station.hold_position()
+    def cap(sample_number):
+        station.cap()
 
-    station._logger.info("Moving vial to the capper")
-    station.vial_pump_to_capper()
-    station.cap()
+    def capper_to_rack(sample_number):
+        vial_pos = station.sample_dict[sample_number]['vial']
 
-    station._logger.info("Moving vial to the vial rack")
-    station.vial_capper_to_rack(vial_pos)
-    station._logger.info(f"Sample preparation of sample number: {sample_number} complete")
+        station._logger.info("Moving vial to the vial rack")
+        station.vial_capper_to_rack(vial_pos)
+        station._logger.info(f"Sample preparation of sample number: {sample_number} complete")
+
+    return [
+        Stage("rack_to_quantos", rack_to_quantos, uses=("arm",), location="quantos"),
+        Stage("load_cartridge", load_cartridge, uses=("arm", "quantos"), location="quantos"),
+        Stage("dose_solid", dose_solid, uses=("quantos",), location="quantos"),
+        Stage("quantos_to_pump", quantos_to_pump, uses=("arm",), location="pump"),
+        Stage("dispense_liquid", dispense_liquid, uses=("pump",), location="pump"),
+        Stage("pump_to_capper", pump_to_capper, uses=("arm",), location="capper"),
+        Stage("cap", cap, uses=("capper",), location="capper"),
+        Stage("capper_to_rack", capper_to_rack, uses=("arm",)),
+    ]
+
+
+def prepare_single_sample(sample_number:int, results_directory: str, logname = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
+    """
+    """
+
+    station = get_station(station, logname, results_directory, devices=("arm", "quantos", "pump", "capper"))
+
+    #unpacking sample information from sample_dictionary
+    sample_number = int(sample_number)
+
+    print(type(station.sample_dict[sample_number]['solid']))
+    print(type(station.sample_dict[sample_number]['liquid']))
+
+    for stage in _preparation_stages(station, results_directory):
+        stage.action(sample_number)
     return
 
 
-def move_sample_to_hotplate(sample_number:int, results_directory: str, logname = datetime.now().strftime("%d_%m_%Y") ) -> None:
+def prepare_samples_pipelined(sample_numbers: list, results_directory: str, max_in_flight: int = 3, group_by_cartridge: bool = True,
+                              logname = datetime.now().strftime("%d_%m_%Y"), station=None) -> dict:
+    """
+    Prepares several samples, dosing sample N on the Quantos while the arm caps and stores sample N-1.
+    With group_by_cartridge the samples are reordered so each Quantos cartridge is loaded once, starting with the loaded one.
+    Returns the stage timings per sample.
+    """
+
+    from workflow_core.pipeline import PipelineScheduler, SerializedStation
+
+    station = get_station(station, logname, results_directory, devices=("arm", "quantos", "pump", "capper"))
+
+    scheduler = PipelineScheduler(_preparation_stages(SerializedStation(station), results_directory), max_in_flight=max_in_flight, logger=station._logger)
+    sample_numbers = [int(sample_number) for sample_number in sample_numbers]
+    if group_by_cartridge:
+        sample_numbers = order_by_cartridge(sample_numbers, lambda sample_number: station.sample_dict[sample_number]['solid'], QuantosState().loaded_solid())
+    result = scheduler.run(sample_numbers)
 
+    station._logger.info(f"Prepared samples {list(sample_numbers)} in {result.makespan:.0f} s")
+    return result.timings
+
+
+def move_sample_to_hotplate(sample_number:int, results_directory: str, logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> None:
+
+    from workflow_core.hotplate_slots import HotplateSlots
     
     sample_number = int(sample_number)
 
-    station = RobInHood(inst_logger = logname, data_path=results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "ika"))
     vial_pos = station.sample_dict[sample_number]['vial']
 
     
 
  
-    station._logger.info(f"Moving sample {sample_number} to the hotplate")
-    station.vial_rack_to_ika(vial_pos, ika_slot_number=vial_pos)
+    slot = HotplateSlots(results_directory, sample_dict=station.sample_dict).allocate(sample_number, vial_pos)
+    station._logger.info(f"Moving sample {sample_number} to hotplate slot {slot}")
+    station.vial_rack_to_ika(vial_pos, ika_slot_number=slot)
 
     return
 
-def reaction_timer(results_directory: str, speed:int, time_secs:int, time_mins:int, time_hours:int, logname = datetime.now().strftime("%d_%m_%Y") ):
+def start_reaction_timer(results_directory: str, speed:int, time_secs:int, time_mins:int, time_hours:int, timer_name: str = "stirring", logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> float:
+    """
+    Start stirring and a persisted timer without blocking.
+
+    A timer with the same name that is still running (e.g. after a controller restart)
+    is kept, so the samples are stirred for the remaining time only.
+
+    Args:
+        results_directory (str): The directory to save the results.
+        speed (int): The stirring speed.
+        time_secs (int), time_mins (int), time_hours (int): The stirring time.
+        timer_name (str): Name of the timer, used by wait_reaction_timer.
+
+    Returns:
+        float: The deadline in epoch seconds.
+    """
+    from workflow_core.hotplate import hotplate_controller
+    from workflow_core.timers import TimerStore
+
+    station = get_station(station, logname, results_directory, devices=("ika",))
     
+    station._logger.info("Setting stirring speed")
+    hotplate_controller(station).stir(speed)
+    timer = TimerStore(results_directory).start(timer_name, seconds=time_hours * 3600 + time_mins * 60 + time_secs)
+    station._logger.info(f"Timer {timer_name} running until {datetime.fromtimestamp(timer.deadline)}")
+    return timer.deadline
+
+def wait_reaction_timer(results_directory: str, timer_name: str = "stirring", logname = datetime.now().strftime("%d_%m_%Y"), station=None ) -> None:
+    """
+    Wait for a timer started by start_reaction_timer, then stop stirring.
+
+    Args:
+        results_directory (str): The directory to save the results.
+        timer_name (str): Name of the timer.
+
+    Returns:
+        None
+    """
+    from workflow_core.hotplate import hotplate_controller
+    from workflow_core.timers import TimerStore, wait_for_timer
+
+    station = get_station(station, logname, results_directory, devices=("ika",))
+    store = TimerStore(results_directory)
+    timer = store.get(timer_name)
+    if timer is None:
+        raise ValueError(f"No timer named {timer_name} was started in {results_directory}")
+
+    # The hotplate keeps stirring on its own, other steps can use it meanwhile
+    with idle(station, ("ika",)):
+        wait_for_timer(timer, logger=station._logger)
+
+    station._logger.info("Stirring Done, turning off stirring")
+    hotplate_controller(station).switch_off(heating=False)
+    store.finish(timer_name)
+
+def reaction_timer(results_directory: str, speed:int, time_secs:int, time_mins:int, time_hours:int, timer_name: str = "stirring", logname = datetime.now().strftime("%d_%m_%Y"), station=None ):
     
-    station = RobInHood(inst_logger = logname, data_path=results_directory)
     
-    station._logger.info("Setting stirring speed")
-    station.ika.set_speed(speed)
-    station.ika.start_stirring()
+    station = get_station(station, logname, results_directory, devices=("ika",))
+    
     station._logger.info("Starting Timer")
-    clock = Timer()
-    clock.set_timer(hours = time_hours, min = time_mins, sec = time_secs)
-    clock.start_timer()
+    start_reaction_timer(results_directory, speed, time_secs, time_mins, time_hours, timer_name=timer_name, logname=logname, station=station)
+    wait_reaction_timer(results_directory, timer_name=timer_name, logname=logname, station=station)
 
-    station._logger.info("Stirring Done, turning off stirring")
-    station.ika.stop_stirring()
+def store_sample(sample_number, results_directory: str, logname = datetime.now().strftime("%d_%m_%Y"), station=None) -> None:
 
-def store_sample(sample_number, results_directory: str, logname = datetime.now().strftime("%d_%m_%Y")) -> None:
+    from workflow_core.hotplate_slots import HotplateSlots
 
     
-    station = RobInHood(inst_logger = logname, data_path= results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "ika"))
 
     station._logger.info(f"Moving sample {sample_number} to the vial rack")
     
     vial_pos = station.sample_dict[sample_number]['vial']
-    station.vial_ika_to_rack(vial_pos)
+    hotplate = HotplateSlots(results_directory, sample_dict=station.sample_dict)
+    slot = hotplate.slot_of(sample_number)
+    if slot is None:
+        station.vial_ika_to_rack(vial_pos)
+    else:
+        station.vial_ika_to_rack(vial_pos, ika_slot_number=slot)
+    # Only free the slot once the vial is off it
+    hotplate.release(sample_number)
+
+def stirr_samples_rolling(sample_numbers: list, results_directory: str, speed: int, time_secs: int, time_mins: int, time_hours: int,
+                          durations: dict = None, hotplate_slots: list = None, timer_name: str = "stirring",
+                          logname = datetime.now().strftime("%d_%m_%Y"), station=None) -> dict:
+    """
+    Stir samples in a rolling batch: each sample goes onto the first free hotplate slot and comes back
+    to the rack when its own stirring time is up, while new samples take the freed slots.
+
+    Args:
+        sample_numbers (list): The sample numbers, in the order they go onto the hotplate.
+        results_directory (str): The directory to save the results.
+        speed (int): The stirring speed.
+        time_secs (int), time_mins (int), time_hours (int): The stirring time of every sample.
+        durations (dict): Stirring time in seconds per sample number, overriding the time above.
+        hotplate_slots (list): The usable hotplate slots. Defaults to ``ika_slots`` in ``conf/running_variables.json``,
+            or the rack positions of the samples if it is not set.
+        timer_name (str): Name of the batch, so an interrupted batch resumes where it stopped.
+
+    Returns:
+        dict: ``{sample: (seconds on the hotplate, slot)}``.
+    """
+    from workflow_core.hotplate import hotplate_controller
+    from workflow_core.hotplate_slots import HotplateSlots, run_rolling
+
+    station = get_station(station, logname, results_directory, devices=("arm", "ika"))
+
+    default = time_hours * 3600 + time_mins * 60 + time_secs
+    durations = {int(sample): float(seconds) for sample, seconds in (durations or {}).items()}
+
+    def vial_of(sample_number):
+        return station.sample_dict[sample_number]['vial']
+
+    station._logger.info(f"Stirring samples {sample_numbers} in a rolling batch")
+    controller = hotplate_controller(station)
+    controller.stir(speed)
+    reacted = run_rolling(HotplateSlots(results_directory, hotplate_slots, station.sample_dict), [int(sample) for sample in sample_numbers],
+                          lambda sample_number: durations.get(sample_number, default),
+                          lambda sample_number, slot: station.vial_rack_to_ika(vial_of(sample_number), ika_slot_number=slot),
+                          lambda sample_number, slot: station.vial_ika_to_rack(vial_of(sample_number), ika_slot_number=slot),
+                          vial_of=vial_of, batch=timer_name, logger=station._logger,
+                          # The arm is only needed to move vials, other steps can use it in between
+                          idle=lambda: idle(station, ("arm",)))
+
+    station._logger.info("Stirring Done, turning off stirring")
+    controller.switch_off(heating=False)
+    return reacted
 
 def filter_sample(results_directory:str, sample_number: int, filtrate_vial: int, cleaning_vial:int, cleaning_solvent:str, 
-             filter_time: Union[int, None] = None, logname=datetime.now().strftime("%d_%m_%Y")):
+             filter_time: Union[int, None] = None, logname=datetime.now().strftime("%d_%m_%Y"), station=None):
     
-    station = RobInHood(inst_logger=logname, data_path=results_directory)
+    station = get_station(station, logname, results_directory, devices=("arm", "pump", "capper", "filter"))
     
     station._logger.info(f"Filtering sample {sample_number}")
 
@@ -118,13 +291,16 @@ def filter_sample(results_directory:str, sample_number: int, filtrate_vial: int,
 
     station.filter_sample_collect_filtrate(sample_vial_number= vial_pos, sample_vial_volume=liquid_volume, filtrate_vial_number=filtrate_vial, cleaning_vial_number=cleaning_vial, 
                                            cleaning_solvent=cleaning_solvent, cleaning_solvent_volume=liquid_volume, filter_time=filter_time)
+    record_line_use(cleaning_solvent)
     
 
-def photograph_sample(sample_number:int,filtrate_number:int, results_directory:str, logname=datetime.now().strftime("%d_%m_%Y")):
+def photograph_sample(sample_number:int,filtrate_number:int, results_directory:str, logname=datetime.now().strftime("%d_%m_%Y"), station=None):
         """
     Photographs samples and saves them in the specified path
     """
-        station=RobInHood(inst_logger = logname, data_path=results_directory)
+        from workflow_core.colorimetry_stream import colorimetry_stream, new_images
+
+        station=get_station(station, logname, results_directory, devices=("arm", "pump", "lightbox"))
         
         #Getting the sample information from the sample dictionary from the filtered vial
         sample_number = int(sample_number)
@@ -138,33 +314,68 @@ def photograph_sample(sample_number:int,filtrate_number:int, results_directory:s
         station.vial_pump_to_lightbox()
         station.close_lightbox()
         station.light_on()
+        before = set(os.listdir(results_directory))
         station.save_picture_from_lightbox(solid_name=solid_name,dye_name=liquid_name,path=results_directory)
         station.light_off()
+
+        #Colorimetry of the new frame runs in the background while the vial goes back to the rack
+        stream = colorimetry_stream(results_directory, station._logger)
+        for image_path in new_images(results_directory, before):
+            stream.submit(image_path, sample=sample_number, solid=solid_name, dye=liquid_name)
         station.open_lightbox()
         station.vial_lightbox_to_pump()
         station.vial_pump_to_rack(vial_number=filtrate_number)
         
         station.close_lightbox()
 
+def colorimetry_results(results_directory:str, logname=datetime.now().strftime("%d_%m_%Y"), station=None) -> list:
+    """
+    Wait for the in-line colorimetry of all photographed samples and return its rows.
+
+    Args:
+        results_directory (str): The directory to save the results.
+
+    Returns:
+        list: One dict per analysed frame (sample, solid, dye, channel, pixel, ppm, image).
+    """
+    from workflow_core.colorimetry_stream import colorimetry_stream
+
+    station = get_station(station, logname, results_directory, devices=())
+    rows = colorimetry_stream(results_directory, station._logger).results()
+    for row in rows:
+        station._logger.info(f"Sample {row['sample']} {row['solid']} {row['dye']}: {float(row['ppm']):.2f} ppm")
+    return rows
+
 
 
 
 if __name__ == '__main__':
   
     if sys.argv[1]=='prepare_sample':
-        prepare_single_sample(sample_number=int(sys.argv[2]),results_directory=sys.argv[3])
+        run_step(prepare_single_sample, sample_number=int(sys.argv[2]),results_directory=sys.argv[3])
+    elif sys.argv[1] == 'prepare_samples_pipelined':
+        run_step(prepare_samples_pipelined, sample_numbers=[int(sample) for sample in sys.argv[3:]], results_directory=sys.argv[2])
     elif sys.argv[1] == 'stirr_samples':
-        reaction_timer(results_directory=sys.argv[2], speed=int(sys.argv[3]), time_secs=int(sys.argv[4]), time_mins=int(sys.argv[5]), time_hours=int(sys.argv[6]))
+        run_step(reaction_timer, results_directory=sys.argv[2], speed=int(sys.argv[3]), time_secs=int(sys.argv[4]), time_mins=int(sys.argv[5]), time_hours=int(sys.argv[6]))
+    elif sys.argv[1] == 'start_stirring_timer':
+        run_step(start_reaction_timer, results_directory=sys.argv[2], speed=int(sys.argv[3]), time_secs=int(sys.argv[4]), time_mins=int(sys.argv[5]), time_hours=int(sys.argv[6]))
+    elif sys.argv[1] == 'wait_stirring_timer':
+        run_step(wait_reaction_timer, results_directory=sys.argv[2])
+    elif sys.argv[1] == 'stirr_samples_rolling':
+        run_step(stirr_samples_rolling, results_directory=sys.argv[2], speed=int(sys.argv[3]), time_secs=int(sys.argv[4]), time_mins=int(sys.argv[5]),
+                 time_hours=int(sys.argv[6]), sample_numbers=[int(sample) for sample in sys.argv[7:]])
     elif sys.argv[1] == 'store_sample':
         #has to be in reverse order
-        store_sample(sample_number=int(sys.argv[2]), results_directory=sys.argv[3])
+        run_step(store_sample, location="rack", sample_number=int(sys.argv[2]), results_directory=sys.argv[3])
     elif sys.argv[1] == 'filter_sample':
-        filter_sample(results_directory=sys.argv[2], sample_number=int(sys.argv[3]), filtrate_vial=int(sys.argv[4]), cleaning_vial=int(sys.argv[5]), cleaning_solvent=sys.argv[6])
+        run_step(filter_sample, results_directory=sys.argv[2], sample_number=int(sys.argv[3]), filtrate_vial=int(sys.argv[4]), cleaning_vial=int(sys.argv[5]), cleaning_solvent=sys.argv[6])
     elif sys.argv[1] == 'photograph_sample':
         print(sys.argv[3])
-        photograph_sample(sample_number=int(sys.argv[2]), filtrate_number=int(sys.argv[3]), results_directory=sys.argv[4])
+        run_step(photograph_sample, sample_number=int(sys.argv[2]), filtrate_number=int(sys.argv[3]), results_directory=sys.argv[4])
+    elif sys.argv[1] == "colorimetry_results":
+        run_step(colorimetry_results, results_directory=sys.argv[2])
     elif sys.argv[1] == "sample_rack_to_ika":
-        move_sample_to_hotplate(sample_number= sys.argv[2], results_directory=sys.argv[3])
+        run_step(move_sample_to_hotplate, location="hotplate", sample_number=int(sys.argv[2]), results_directory=sys.argv[3])
     else:
         print("Not a valid argument.")
 
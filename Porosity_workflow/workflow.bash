@@ -32,9 +32,22 @@ done
 
 
 read_robot_state(){
+    #served from the station session's cached state monitor when a session is running
     python $LOCAL_PATH/src/read_current_state.py
-    python $LOCAL_PATH/src/read_current_state.py
-    python $LOCAL_PATH/src/read_current_state.py
+}
+
+start_station_session(){
+    #the steps authenticate to the session with this key
+    export ROBINHOOD_SESSION_KEY=${ROBINHOOD_SESSION_KEY:-$(python -c "import secrets; print(secrets.token_hex(16))")}
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session serve $DATASET_PATH &
+    SESSION_PID=$!
+    trap stop_station_session EXIT
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session wait
+}
+
+stop_station_session(){
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.session stop
+    wait $SESSION_PID || true
 }
 
 if [ ! -d "$DATASET_PATH" ]; then
@@ -54,6 +67,21 @@ else
     echo "[INFO] Directory $OUTPUT_PATH already exists."
 fi
 
+#Run with --resume to skip the steps a failed run already completed
+if [ "$1" == "--resume" ]; then
+    echo "[INFO] Resuming from the step journal"
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.journal resume $DATASET_PATH
+else
+    PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.journal start $DATASET_PATH --name dye_porosity_screen
+    rm -f $DATASET_PATH/trace_spans.jsonl $DATASET_PATH/hotplate_slots.json
+fi
+export WORKFLOW_JOURNAL=$DATASET_PATH
+#Every station call is timed in trace_spans.jsonl
+export WORKFLOW_TRACE=$DATASET_PATH
+
+echo "[INFO] Starting station session"
+start_station_session
+
 echo "[INFO] Script running in $LOCAL_PATH"
 echo "[INFO] Results will be saved in $DATASET_PATH"
 
@@ -63,13 +91,14 @@ read_robot_state
 
 echo "[INFO] Preparing samples in progress."
 
+#Quantos dosing, pump dispensing and capping of consecutive samples overlap
+SAMPLES=()
 for pair in "${SAMPLE_PAIRS[@]}"; do
-    read_robot_state
-    readarray -d ' ' sample <<< "$pair"
-    echo "[INFO] Preparing sample ${sample[0]}"
-    python $LOCAL_PATH/src/dye_workflow.py "prepare_sample" $sample[0] $DATASET_PATH
-    
+    SAMPLES+=("${pair%% *}")
 done
+read_robot_state
+echo "[INFO] Preparing samples ${SAMPLES[*]}"
+python $LOCAL_PATH/src/dye_workflow.py "prepare_samples_pipelined" $DATASET_PATH "${SAMPLES[@]}"
 
 echo "[INFO] Reading robot state:"
 read_robot_state
@@ -119,11 +148,15 @@ for pair in "${SAMPLE_PAIRS[@]}"; do
 done
 
 echo "[INFO] Colorimetry"
-#colorimetry tbd
+#Frames are analysed as they are captured, this only waits for the last one
+python $LOCAL_PATH/src/dye_workflow.py "colorimetry_results" $DATASET_PATH
 
 echo "[INFO] Reading robot state:"
 read_robot_state
 
 
 
+echo "[INFO] Station timing summary:"
+PYTHONPATH="$LOCAL_PATH/.." python -m workflow_core.tracing $DATASET_PATH --chrome $DATASET_PATH/trace.json
+
 echo "[INFO] Process complete."
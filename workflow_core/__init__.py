@@ -0,0 +1,6 @@
+"""
+Shared infrastructure for the RobInHood workflows.
+
+The workflow scripts under ``*_workflow/src`` import from this package by
+adding the repository root to ``sys.path``.
+"""
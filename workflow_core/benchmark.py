@@ -0,0 +1,248 @@
+"""
+Throughput benchmarks of the workflows on the simulated station.
+
+Each benchmark runs a workflow definition end to end with the runner against a
+``SimulatedStation`` and reports the simulated makespan and the utilisation of
+every device (arm, Quantos, pump, capper, filter, lightbox, IKA). The
+workflow's ``conf/`` is copied to a scratch directory first, so the device
+state in the repository (``running_variables.json``) is left alone, and the
+results store and the colorimetry calibration cache and plots point at the
+scratch directory too.
+
+These are benchmarks, not tests: compare the numbers before and after a
+scheduling change. Computation outside the simulation (e.g. the in-line
+colorimetry of each frame) is scaled by the speed-up like everything else, so
+keep the speed-up moderate when comparing workflows with heavy analysis. Run from the repository root::
+
+    python -m workflow_core.benchmark
+    python -m workflow_core.benchmark porosity --speedup 500 --seed 1 --fail quantos_dosing=0.1
+"""
+
+import argparse
+import copy
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+
+from workflow_core.simulation import COLORIMETRY_DATASET, SimulatedClock, SimulatedStation, install_simulated_robinhood, simulated_time
+from workflow_core.tracing import Tracer, chrome_trace, format_summary, instrument, summarise
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _samples(count: int, solid, liquid, mass: float, volume: float) -> dict:
+    return {sample: {"vial": sample, "solid": solid(sample), "liquid": liquid(sample), "mass (mg)": mass, "volume (ml)": volume}
+            for sample in range(count)}
+
+
+# name -> (workflow directory, definitions run in order, sample dictionary, uses in-line colorimetry)
+BENCHMARKS = {
+    "phthalimide": ("Phthalimide_workflow", ["conf/synthesis_workflow.json"],
+                    _samples(16, lambda sample: "phthalic_anhydride", lambda sample: "urea_solution", 100, 2), False),
+    "porosity": ("Porosity_workflow", ["conf/dye_workflow.json"],
+                 _samples(16, lambda sample: "Ni_BTC", lambda sample: f"dye{sample % 6 + 1}", 10, 2), True),
+    "cc3": ("CC3_synth_workflow", ["conf/CC3_solid_synth.json", "conf/CC3_solid_workup.json"], {}, False),
+}
+
+
+@dataclass
+class BenchmarkResult:
+    """Outcome of one benchmark run. Times are simulated seconds."""
+
+    name: str
+    makespan: float
+    steps: int
+    utilisation: dict
+    busy: dict
+    wall_time: float
+    error: str = None
+    operations: list = field(default_factory=list, repr=False)
+    spans: list = field(default_factory=list, repr=False)
+    step_times: list = field(default_factory=list, repr=False)
+
+
+def run_benchmark(name: str, speedup: float = 1000.0, seed: int = 0, latencies: dict = None, failures: dict = None,
+                  variables: dict = None, trace: bool = False) -> BenchmarkResult:
+    """
+    Run one benchmark on a fresh simulated station.
+
+    Args:
+        name (str): A key of ``BENCHMARKS``.
+        speedup (float): Simulated seconds per wall-clock second.
+        seed (int): Seed of the latency and failure draws.
+        latencies (dict): ``Latency`` overrides per operation.
+        failures (dict): Failure injection, see ``SimulatedStation``.
+        variables (dict): Overrides of the definitions' variables (e.g. ``{"hours": 1}``).
+        trace (bool): Record a timing span for every station call in ``spans``.
+
+    Returns:
+        BenchmarkResult: The makespan and device utilisation. A step that failed is reported
+        in ``error`` with the makespan up to the failure.
+    """
+    directory, definitions, sample_dict, inline_colorimetry = BENCHMARKS[name]
+    return simulate_workflow(os.path.join(REPOSITORY, directory), definitions, sample_dict, name=name, speedup=speedup,
+                             seed=seed, latencies=latencies, failures=failures, variables=variables, trace=trace,
+                             inline_colorimetry=inline_colorimetry)
+
+
+def simulate_workflow(workflow_directory: str, definitions: list, sample_dict: dict, name: str = "workflow",
+                      speedup: float = 1000.0, seed: int = 0, latencies: dict = None, failures: dict = None,
+                      variables: dict = None, trace: bool = False, inline_colorimetry: bool = False,
+                      image_directory: str = COLORIMETRY_DATASET) -> BenchmarkResult:
+    """
+    Run workflow definitions end to end on a fresh simulated station.
+
+    Args:
+        workflow_directory (str): The workflow directory whose ``conf/`` is copied to the scratch directory.
+        definitions (list): Definition files run in order, relative to ``workflow_directory`` or absolute.
+        sample_dict (dict): The samples of the simulated station.
+        name (str): Name of the run in the result.
+        speedup (float): Simulated seconds per wall-clock second.
+        seed (int): Seed of the latency and failure draws.
+        latencies (dict): ``Latency`` overrides per operation.
+        failures (dict): Failure injection, see ``SimulatedStation``.
+        variables (dict): Overrides of the definitions' variables.
+        trace (bool): Record a timing span for every station call in ``spans``.
+        inline_colorimetry (bool): Warm the colorimetry stream up before the clock starts.
+        image_directory (str): Where the simulated lightbox takes its pictures from, or None to take none.
+
+    Returns:
+        BenchmarkResult: The makespan, device utilisation and, in ``step_times``, the planned step
+        and simulated start and end of every step.
+    """
+    install_simulated_robinhood()
+    from workflow_core.colorimetry_stream import CALIBRATION_OUTPUT_ENV, colorimetry_stream
+    from workflow_core.hotplate import hotplate_controller
+    from workflow_core.journal import JOURNAL_ENV
+    from workflow_core.results_store import RESULTS_DB_ENV, results_store
+    from workflow_core.runner import load_definition, plan_workflow, run_workflow
+
+    clock = SimulatedClock(speedup)
+    simulated = SimulatedStation(sample_dict=copy.copy(sample_dict), clock=clock, latencies=latencies, failures=failures, seed=seed,
+                                 image_directory=image_directory)
+    tracer = Tracer(clock=clock)
+    station = instrument(simulated, tracer) if trace else simulated
+    # The controller polls every 5 simulated seconds
+    hotplate_controller(station, poll_interval=5.0 / speedup)
+
+    cwd = os.getcwd()
+    environment = {key: os.environ.get(key) for key in (JOURNAL_ENV, RESULTS_DB_ENV, CALIBRATION_OUTPUT_ENV)}
+    steps = 0
+    step_times = []
+    error = None
+    with tempfile.TemporaryDirectory(prefix=f"benchmark_{name}_") as scratch:
+        shutil.copytree(os.path.join(workflow_directory, "conf"), os.path.join(scratch, "conf"))
+        os.chdir(scratch)
+        os.environ.pop(JOURNAL_ENV, None)
+        os.environ[RESULTS_DB_ENV] = os.path.join(scratch, "results.sqlite")
+        os.environ[CALIBRATION_OUTPUT_ENV] = scratch
+        wall_started = time.monotonic()
+        started = clock.time()
+        try:
+            # Plan (and import the step modules) before the clock starts, so only the run is timed
+            plans = []
+            for definition_file in definitions:
+                definition = load_definition(os.path.join(workflow_directory, definition_file))
+                definition["module"] = os.path.join(workflow_directory, definition["module"])
+                definition["variables"] = {**definition.get("variables", {}), **(variables or {})}
+                results_directory = os.path.abspath(definition.get("results_directory", "data"))
+                os.makedirs(results_directory, exist_ok=True)
+                plans.append((plan_workflow(definition), results_directory))
+                if inline_colorimetry:
+                    colorimetry_stream(results_directory).warm_up()
+
+            with simulated_time(clock):
+                started = clock.time()
+                for planned, results_directory in plans:
+                    for step in planned:
+                        step_started = clock.time()
+                        run_workflow([step], station=station, results_directory=results_directory)
+                        step_times.append((step, step_started - started, clock.time() - started))
+                        steps += 1
+        except Exception as failure:
+            error = f"step {steps}: {failure!r}"
+        finally:
+            makespan = clock.time() - started
+            hotplate_controller(station).stop()
+            results_store().flush()
+            os.chdir(cwd)
+            for key, value in environment.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+    return BenchmarkResult(name=name, makespan=makespan, steps=steps, utilisation=simulated.utilisation(makespan),
+                           busy=dict(simulated.busy), wall_time=time.monotonic() - wall_started, error=error,
+                           operations=list(simulated.operations), spans=list(tracer.spans), step_times=step_times)
+
+
+def format_report(results: list) -> str:
+    """Return a table of makespan and device utilisation per benchmark."""
+    devices = sorted({device for result in results for device in result.utilisation})
+    header = f"{'benchmark':<12} {'makespan':>10} {'steps':>6}  " + " ".join(f"{device:>8}" for device in devices)
+    lines = [header, "-" * len(header)]
+    for result in results:
+        hours, remainder = divmod(int(result.makespan), 3600)
+        makespan = f"{hours}:{remainder // 60:02d}:{remainder % 60:02d}"
+        utilisation = " ".join(f"{100 * result.utilisation.get(device, 0.0):7.1f}%" for device in devices)
+        lines.append(f"{result.name:<12} {makespan:>10} {result.steps:>6}  {utilisation}")
+        if result.error:
+            lines.append(f"{'':<12} failed at {result.error}")
+    return "\n".join(lines)
+
+
+def _parse_failure(text: str) -> tuple:
+    operation, _, value = text.partition("=")
+    if "," in value or value.isdigit():
+        return operation, [int(call) for call in value.split(",")]
+    return operation, float(value)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the workflows on the simulated RobInHood station")
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run, from {sorted(BENCHMARKS)} (default: all)")
+    parser.add_argument("--speedup", type=float, default=1000.0, help="Simulated seconds per wall-clock second")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--set", action="append", default=[], metavar="VARIABLE=JSON",
+                        help="Override a workflow variable, e.g. --set hours=1")
+    parser.add_argument("--fail", action="append", default=[], metavar="OPERATION=P|N[,N...]",
+                        help="Fail an operation with probability P or on call numbers N")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--trace", metavar="DIRECTORY",
+                        help="Record every station call, print its summary and write <benchmark>_trace.json here")
+    args = parser.parse_args(argv)
+
+    variables = {}
+    for assignment in args.set:
+        key, _, value = assignment.partition("=")
+        variables[key] = json.loads(value)
+    failures = dict(_parse_failure(text) for text in args.fail)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks {sorted(unknown)}")
+
+    results = []
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print(f"[INFO] Running benchmark {name}")
+        result = run_benchmark(name, speedup=args.speedup, seed=args.seed, failures=failures, variables=variables,
+                               trace=args.trace is not None)
+        results.append(result)
+        if args.trace is not None:
+            os.makedirs(args.trace, exist_ok=True)
+            with open(os.path.join(args.trace, f"{name}_trace.json"), "w") as trace_file:
+                json.dump(chrome_trace(result.spans), trace_file)
+            print(format_summary(summarise(result.spans)))
+    print(format_report(results))
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump([{key: value for key, value in asdict(result).items() if key not in ("operations", "spans", "step_times")} for result in results],
+                      results_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
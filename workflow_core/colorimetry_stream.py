@@ -0,0 +1,180 @@
+"""
+In-line colorimetry of lightbox photographs.
+
+``photograph_sample`` hands every frame it captures to a ``ColorimetryStream``
+of the run. A background thread reads the frame, takes the ROI median of the
+dye's channel and converts it to ppm with the cached calibration of
+``Colorimetry_workflow`` (``load_calibration`` / ``predict_ppm``), then appends
+a row to ``colorimetry_results.csv`` in the results directory and the ROI
+median and ppm to the campaign results store. The analysis
+overlaps with the arm moving the next vial, so the results are complete as
+soon as the last vial leaves the lightbox.
+
+The calibration cache and fitting plots go to ``Colorimetry_workflow``, or to
+the directory in ``COLORIMETRY_CALIBRATION_OUTPUT`` (e.g. a simulated run's
+scratch directory).
+"""
+
+import atexit
+import csv
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+
+from workflow_core.results_store import results_store
+
+COLORIMETRY_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Colorimetry_workflow")
+CALIBRATION_OUTPUT_ENV = "COLORIMETRY_CALIBRATION_OUTPUT"
+RESULTS_FILE = "colorimetry_results.csv"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+FIELDS = ["time", "sample", "solid", "dye", "channel", "pixel", "ppm", "image"]
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def _colorimetry_module():
+    if COLORIMETRY_DIRECTORY not in sys.path:
+        sys.path.append(COLORIMETRY_DIRECTORY)
+    import colorimetry
+
+    return colorimetry
+
+
+def dye_index(dye_name: str) -> int:
+    """
+    Return the 0-based calibration index of a dye named like ``dye3`` / ``DYE3``.
+
+    Raises:
+        ValueError: If the name does not end with the dye number.
+    """
+    match = re.search(r"(\d+)$", dye_name)
+    if match is None:
+        raise ValueError(f"Cannot tell the calibration dye of {dye_name!r}")
+    return int(match.group(1)) - 1
+
+
+class ColorimetryStream:
+    """
+    Analyse captured frames in a background thread as they arrive.
+
+    Args:
+        results_directory (str): The run's results directory; rows go to ``colorimetry_results.csv`` in it.
+        logger (logging.Logger): Logger for progress messages.
+        dye_indices (dict): Optional dye name -> calibration index, for dyes not named ``dyeN``.
+    """
+
+    def __init__(self, results_directory: str, logger=None, dye_indices: dict = None):
+        self.results_directory = results_directory
+        self.results_file = os.path.join(results_directory, RESULTS_FILE)
+        self.logger = logger
+        self.dye_indices = dye_indices or {}
+        self._queue = queue.Queue()
+        self._parameters = None
+        self._thread = threading.Thread(target=self._run, name="colorimetry-stream", daemon=True)
+        self._thread.start()
+
+    def _log(self, message: str, warning: bool = False) -> None:
+        if self.logger is None:
+            return
+        (self.logger.warning if warning else self.logger.info)(message)
+
+    def _calibration(self, colorimetry):
+        if self._parameters is None:
+            calibration_directory = os.path.join(COLORIMETRY_DIRECTORY, "dataset", "calibration_vials")
+            calibration_paths = [os.path.join(calibration_directory, f"dye{d+1}") for d in range(len(colorimetry.CHANNELS))]
+            cache_path, plots_path = None, os.path.join(COLORIMETRY_DIRECTORY, "plots")
+            output = os.environ.get(CALIBRATION_OUTPUT_ENV)
+            if output:
+                # Start from the cached fits, but write nothing next to the calibration images
+                plots_path = os.path.join(output, "plots")
+                cache_path = os.path.join(output, colorimetry.CALIBRATION_CACHE)
+                os.makedirs(plots_path, exist_ok=True)
+                cached = os.path.join(calibration_directory, colorimetry.CALIBRATION_CACHE)
+                if os.path.exists(cached) and not os.path.exists(cache_path):
+                    shutil.copyfile(cached, cache_path)
+            self._parameters = colorimetry.load_calibration(calibration_paths, plots_path, cache_path=cache_path,
+                                                            save_overlays=False)
+        return self._parameters
+
+    def warm_up(self) -> list:
+        """Import the colorimetry module and load the calibration now instead of on the first frame."""
+        return self._calibration(_colorimetry_module())
+
+    def submit(self, image_path: str, sample, solid: str, dye: str) -> None:
+        """Queue a captured frame for analysis."""
+        self._queue.put((image_path, sample, solid, dye))
+
+    def analyse(self, image_path: str, sample, solid: str, dye: str) -> dict:
+        """Analyse one frame and append its row to the results file."""
+        colorimetry = _colorimetry_module()
+        index = self.dye_indices[dye] if dye in self.dye_indices else dye_index(dye)
+        image = colorimetry.read_image(image_path)
+        pixel = float(colorimetry.roi_median(image, channel=colorimetry.CHANNELS[index]))
+        ppm = float(colorimetry.predict_ppm([pixel], [self._calibration(colorimetry)[index]])[0])
+
+        row = {"time": time.time(), "sample": sample, "solid": solid, "dye": dye,
+               "channel": colorimetry.CHANNELS[index], "pixel": pixel, "ppm": ppm, "image": image_path}
+        new_file = not os.path.exists(self.results_file)
+        with open(self.results_file, "a", newline="") as results_file:
+            writer = csv.DictWriter(results_file, fieldnames=FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+        store = results_store()
+        for quantity, value, unit in (("pixel", pixel, colorimetry.CHANNELS[index]), ("ppm", ppm, "ppm")):
+            store.record(self.results_directory, quantity, value, unit=unit, step="colorimetry", sample=sample,
+                         solid=solid, dye=dye, chemical=dye, source=image_path)
+        store.flush()
+        self._log(f"[colorimetry] Sample {sample} ({solid}, {dye}): pixel {pixel}, {ppm:.2f} ppm")
+        return row
+
+    def _run(self) -> None:
+        while True:
+            frame = self._queue.get()
+            try:
+                self.analyse(*frame)
+            except Exception as error:
+                # A bad frame must not stop the robot workflow; it is reported and can be re-analysed offline.
+                self._log(f"[colorimetry] Could not analyse {frame[0]}: {error!r}", warning=True)
+            finally:
+                self._queue.task_done()
+
+    def join(self) -> None:
+        """Wait until every submitted frame has been analysed."""
+        self._queue.join()
+
+    def results(self) -> list:
+        """Wait for pending frames and return the rows of the results file."""
+        self.join()
+        if not os.path.exists(self.results_file):
+            return []
+        with open(self.results_file, newline="") as results_file:
+            return list(csv.DictReader(results_file))
+
+
+def colorimetry_stream(results_directory: str, logger=None) -> ColorimetryStream:
+    """
+    Return the stream of a results directory, starting it on first use.
+
+    Pending frames are analysed before the process exits, so a step run
+    outside a station session still writes its results.
+    """
+    results_directory = os.path.abspath(results_directory)
+    with _streams_lock:
+        stream = _streams.get(results_directory)
+        if stream is None:
+            stream = ColorimetryStream(results_directory, logger)
+            _streams[results_directory] = stream
+            atexit.register(stream.join)
+        return stream
+
+
+def new_images(directory: str, before: set) -> list:
+    """Return the image files in ``directory`` that are not in the ``before`` listing."""
+    return sorted(os.path.join(directory, name) for name in set(os.listdir(directory)) - before
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
@@ -0,0 +1,375 @@
+"""
+Job queue running several workflow definitions on one station at once.
+
+Each workflow used to assume it owns the whole station for the full run, so a
+second batch could not use the idle Quantos, pump and filter station while the
+first batch stirs on the IKA for hours. The dispatcher accepts several runs (jobs) and
+treats the devices of the station (``STATION_RESOURCES``) as lockable
+resources: a step takes the devices it names in its ``"uses"`` list for as
+long as it runs, so steps of different jobs interleave whenever their devices
+do not conflict. Steps without ``"uses"`` take the whole station, so
+definitions that are not annotated run exactly as before, one step at a time.
+
+A ``"holds"`` list keeps devices for the job from that step on, until none of
+its remaining steps uses them: the IKA is held from the first heating step
+until the last vial comes off, so no other job changes the temperature or puts
+its vials on the plate in between (each job keeps its own
+``hotplate_slots.json``). A job takes all the devices it ever holds in one go,
+and a queue whose jobs could wait on each other's held devices is rejected on
+submission, so the dispatcher cannot deadlock.
+
+Waiting steps are granted by priority (higher first), then to the job that
+has used the least device time so far, then in submission order, so jobs of
+equal priority share the devices fairly. A job can wait for other jobs with
+``"after"`` (e.g. the CC3 work-up after the synthesis).
+
+Every job has its own results directory and journal, as if it was started by
+the runner. All jobs share one RobInHood, built in the working directory, so
+they share its vial map (``sample_dict``), its configuration and
+``conf/running_variables.json``. Every job of a queue therefore has to come
+from the same workflow directory, and the dispatcher is started from it (like
+the session); queues mixing workflow directories are rejected on submission.
+Give the jobs different vials and results directories. The queue is a JSON
+file:
+
+    [
+        {"name": "cc3_synth", "definition": "conf/CC3_solid_synth.json", "priority": 1},
+        {"definition": "conf/CC3_solid_workup.json", "after": ["cc3_synth"]},
+        {"name": "cc3_synth_2", "definition": "conf/CC3_solid_synth.json", "variables": {"samples": [5, 6, 7]},
+         "results_directory": "data_2"}
+    ]
+
+    PYTHONPATH=.. python -m workflow_core.dispatcher queue.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from workflow_core.hotplate_slots import HotplateSlots
+from workflow_core.journal import StepJournal
+from workflow_core.journal import main as journal_main
+from workflow_core.pipeline import ResourcePool, _Aborted
+from workflow_core.runner import WorkflowDefinitionError, load_definition, plan_workflow, run_workflow
+from workflow_core.station import STATION_DEVICES, get_station
+
+STATION_RESOURCES = STATION_DEVICES
+
+
+class DispatchError(ValueError):
+    """Raised when a job cannot be queued."""
+
+
+@dataclass
+class Job:
+    """
+    A workflow run in the queue.
+
+    Args:
+        definition (str): Path to the workflow definition.
+        name (str): Unique name of the job. Defaults to the definition's name.
+        priority (int): Jobs with a higher priority get contested devices first.
+        variables (dict): Overrides of the definition's variables.
+        results_directory (str): Overrides the definition's results directory.
+        after (list): Names of the jobs that have to finish first.
+        resume (bool): Skip the steps completed by the last run in the results directory.
+    """
+
+    definition: str
+    name: str = None
+    priority: int = 0
+    variables: dict = field(default_factory=dict)
+    results_directory: str = None
+    after: list = field(default_factory=list)
+    resume: bool = False
+    steps: list = field(default_factory=list, repr=False)
+    workflow_directory: str = field(default=None, repr=False)
+    status: str = "queued"
+    completed: int = 0
+    service: float = 0.0
+    started: float = None
+    finished: float = None
+    error: str = None
+
+    @property
+    def uses(self) -> frozenset:
+        """Every device a step of the job drives."""
+        return frozenset().union(*(step_resources(step) for step in self.steps))
+
+    @property
+    def holds(self) -> frozenset:
+        """The devices the job keeps between steps."""
+        return frozenset().union(*(step.holds for step in self.steps))
+
+
+def step_resources(step) -> frozenset:
+    """Return the devices a planned step needs: its ``uses`` and ``holds``, or the whole station."""
+    uses = STATION_RESOURCES if step.uses is None else step.uses
+    return frozenset(uses) | frozenset(step.holds)
+
+
+def plan_job(job: Job) -> list:
+    """
+    Plan the steps of a job against its own workflow directory.
+
+    Returns:
+        list: The PlannedStep objects, also stored in ``job.steps``.
+
+    Raises:
+        WorkflowDefinitionError: If the definition is invalid or names unknown devices.
+    """
+    definition_path = os.path.abspath(job.definition)
+    definition = load_definition(definition_path)
+    # Definitions live in <workflow>/conf and name paths relative to <workflow>
+    workflow_directory = os.path.dirname(os.path.dirname(definition_path))
+    job.workflow_directory = workflow_directory
+    definition["module"] = os.path.join(workflow_directory, definition["module"])
+    definition["variables"] = {**definition.get("variables", {}), **job.variables}
+    if job.results_directory is None:
+        job.results_directory = os.path.join(workflow_directory, definition.get("results_directory", "data"))
+    job.results_directory = os.path.abspath(job.results_directory)
+    definition["results_directory"] = job.results_directory
+    if job.name is None:
+        job.name = definition.get("name") or os.path.splitext(os.path.basename(definition_path))[0]
+
+    job.steps = plan_workflow(definition)
+    unknown = sorted({device for step in job.steps for device in step_resources(step)} - set(STATION_RESOURCES))
+    if unknown:
+        raise WorkflowDefinitionError(f"{job.definition}: unknown devices {unknown}, expected {list(STATION_RESOURCES)}")
+    return job.steps
+
+
+def deadlock_cycle(jobs: list) -> list:
+    """
+    Return jobs that could wait on each other's held devices forever, or an empty list.
+
+    A job holding devices waits only for devices it uses but does not hold, so
+    job A can block on job B if such a device is one B holds. A cycle of these
+    waits is a possible deadlock.
+    """
+    waits_on = {job.name: [other.name for other in jobs if other is not job and job.holds
+                           and (job.uses - job.holds) & other.holds] for job in jobs}
+    visiting, done = [], set()
+
+    def visit(name):
+        if name in visiting:
+            return visiting[visiting.index(name):]
+        if name in done:
+            return []
+        visiting.append(name)
+        for other in waits_on[name]:
+            cycle = visit(other)
+            if cycle:
+                return cycle
+        visiting.pop()
+        done.add(name)
+        return []
+
+    for job in jobs:
+        cycle = visit(job.name)
+        if cycle:
+            return cycle
+    return []
+
+
+class JobDispatcher:
+    """
+    Run queued jobs concurrently, interleaving steps that need different devices.
+
+    Args:
+        station (RobInHood): The station shared by all jobs. Built on ``run`` if None.
+        logname (str): The name of the log file. Defaults to current date.
+        keep_going (bool): Let the other jobs continue when a job fails. By default a failure
+            stops every job after its current step, since the station may need attention.
+    """
+
+    def __init__(self, station=None, logname: str = datetime.now().strftime("%d_%m_%Y"), keep_going: bool = False):
+        self.station = station
+        self.logname = logname
+        self.keep_going = keep_going
+        self.jobs = []
+        self._finished = threading.Condition()
+        self._stop = threading.Event()
+
+    def submit(self, job: Job) -> Job:
+        """
+        Plan a job and add it to the queue.
+
+        Raises:
+            WorkflowDefinitionError: If the job's definition is invalid.
+            DispatchError: If the job clashes with the queued jobs or comes from another workflow directory.
+        """
+        plan_job(job)
+        if self.jobs and job.workflow_directory != self.jobs[0].workflow_directory:
+            raise DispatchError(f"{job.name} comes from {job.workflow_directory}, the queued jobs from "
+                                f"{self.jobs[0].workflow_directory}; the jobs share one station and its vial map, "
+                                f"so queue jobs of one workflow directory only")
+        names = {queued.name for queued in self.jobs}
+        if job.name in names:
+            raise DispatchError(f"A job named {job.name!r} is already queued")
+        missing = [name for name in job.after if name not in names]
+        if missing:
+            raise DispatchError(f"{job.name}: unknown jobs in 'after': {missing}")
+        for queued in self.jobs:
+            if queued.results_directory == job.results_directory and queued.name not in job.after:
+                raise DispatchError(f"{job.name} and {queued.name} would share the results directory "
+                                    f"{job.results_directory}; give one of them its own")
+        cycle = deadlock_cycle(self.jobs + [job])
+        if cycle:
+            raise DispatchError(f"Jobs {cycle} could wait on each other's held devices; "
+                                f"let one of them run 'after' the other")
+        self.jobs.append(job)
+        return job
+
+    def _rank(self, job: Job) -> tuple:
+        return -job.priority, job.service, [queued.name for queued in self.jobs].index(job.name)
+
+    def _log(self, message: str, warning: bool = False) -> None:
+        if warning:
+            self.station._logger.warning(message)
+        else:
+            self.station._logger.info(message)
+
+    def _wait_for_prerequisites(self, job: Job) -> bool:
+        prerequisites = [queued for queued in self.jobs if queued.name in job.after]
+        with self._finished:
+            while not all(prerequisite.status in ("done", "failed", "stopped") for prerequisite in prerequisites):
+                self._finished.wait()
+        failed = [prerequisite.name for prerequisite in prerequisites if prerequisite.status != "done"]
+        if failed:
+            job.status, job.error = "stopped", f"jobs {failed} did not finish"
+            return False
+        return True
+
+    def _run_job(self, job: Job, pool: ResourcePool) -> None:
+        held = set()
+        try:
+            if not self._wait_for_prerequisites(job):
+                return
+            journal_main(["resume" if job.resume else "start", job.results_directory, "--name", job.name])
+            if not job.resume:
+                HotplateSlots(job.results_directory).reset()
+            journal = StepJournal(job.results_directory)
+            job.status, job.started = "running", time.time()
+            self._log(f"[dispatcher] {job.name}: started, {len(job.steps)} steps")
+
+            for position, step in enumerate(job.steps):
+                if self._stop.is_set():
+                    job.status = "stopped"
+                    return
+                needed = set(step_resources(step))
+                if step.holds and not held:
+                    needed |= job.holds
+                pool.acquire(needed, job.name, self._rank(job))
+                started = time.time()
+                try:
+                    held |= needed & job.holds
+                    run_workflow([step], station=self.station, results_directory=job.results_directory, journal=journal)
+                finally:
+                    job.service += (time.time() - started) * len(needed)
+                    # Held devices are given back once no remaining step needs them
+                    remaining = job.steps[position + 1:]
+                    held = {device for device in held if any(device in step_resources(later) for later in remaining)}
+                    pool.release(needed - held, job.name)
+                job.completed += 1
+
+            job.status = "done"
+            self._log(f"[dispatcher] {job.name}: done")
+        except _Aborted:
+            job.status = "stopped"
+        except Exception as error:
+            job.status, job.error = "failed", repr(error)
+            self._log(f"[dispatcher] {job.name}: failed at step {job.completed}: {error!r}", warning=True)
+            if not self.keep_going:
+                self._stop.set()
+                pool.abort()
+        finally:
+            pool.release(held, job.name)
+            job.finished = time.time()
+            with self._finished:
+                self._finished.notify_all()
+
+    def run(self) -> list:
+        """
+        Run every queued job to the end.
+
+        The jobs share one station, built in the working directory with the first job's results
+        directory as its data path, so they share its vial map and configuration. ``submit``
+        only accepts jobs of one workflow directory for this reason.
+
+        Returns:
+            list: The jobs, with their status (``done``, ``failed`` or ``stopped``), error and timings.
+        """
+        if not self.jobs:
+            return []
+        self.station = get_station(self.station, self.logname, self.jobs[0].results_directory)
+        pool = ResourcePool(STATION_RESOURCES)
+        threads = [threading.Thread(target=self._run_job, args=(job, pool), name=f"job-{job.name}", daemon=True)
+                   for job in self.jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.jobs
+
+
+def load_queue(path: str) -> list:
+    """Read the jobs of a queue file: a JSON list of ``Job`` arguments."""
+    with open(path) as queue_file:
+        entries = json.load(queue_file)
+    try:
+        return [Job(**entry) for entry in entries]
+    except TypeError as error:
+        raise DispatchError(f"{path}: {error}") from error
+
+
+def _duration(seconds: float) -> str:
+    hours, remainder = divmod(int(seconds), 3600)
+    return f"{hours}:{remainder // 60:02d}:{remainder % 60:02d}"
+
+
+def format_report(jobs: list) -> str:
+    """Return a table of the status, steps and run time of every job."""
+    lines = [f"{'job':<30} {'priority':>8} {'status':>8} {'steps':>9} {'time':>9}  device time"]
+    for job in jobs:
+        elapsed = _duration(job.finished - job.started) if job.started and job.finished else "-"
+        lines.append(f"{job.name[:30]:<30} {job.priority:>8} {job.status:>8} {f'{job.completed}/{len(job.steps)}':>9} "
+                     f"{elapsed:>9}  {_duration(job.service)}")
+        if job.error:
+            lines.append(f"{'':<30} {job.error}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run several workflow definitions on the station at once")
+    parser.add_argument("queue", help="JSON file listing the jobs")
+    parser.add_argument("--keep-going", action="store_true", help="Let the other jobs continue when a job fails")
+    parser.add_argument("--validate-only", action="store_true", help="Plan the jobs and check the queue, do not run")
+    args = parser.parse_args(argv)
+
+    dispatcher = JobDispatcher(keep_going=args.keep_going)
+    try:
+        for job in load_queue(args.queue):
+            dispatcher.submit(job)
+    except (WorkflowDefinitionError, DispatchError) as error:
+        sys.exit(f"[ERROR] {error}")
+
+    for job in dispatcher.jobs:
+        held = f", holds {sorted(job.holds)}" if job.holds else ""
+        print(f"[INFO] {job.name}: {len(job.steps)} steps on {sorted(job.uses)}{held}")
+    if args.validate_only:
+        return
+
+    jobs = dispatcher.run()
+    print(format_report(jobs))
+    if any(job.status != "done" for job in jobs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Cartridge-aware solid dosing on the Quantos.
+
+Cartridge swaps are among the slowest arm operations, so batched dosing groups
+vials by solid, starts with the cartridge that is already loaded and doses all
+vials of one cartridge back to back. ``running_variables.json`` records the
+loaded cartridge (``cartridge_in_quantos``); the solid it holds is recorded
+next to it in ``solid_in_quantos`` (with the cartridge number it belongs to,
+``solid_in_quantos_cartridge``) so the next batch knows where to start.
+"""
+
+from workflow_core.running_variables import RUNNING_VARIABLES, RunningVariables
+
+
+class QuantosState(RunningVariables):
+    """
+    Loaded cartridge of the Quantos, from ``running_variables.json``.
+
+    Args:
+        path (str): Path to ``running_variables.json``.
+    """
+
+    def __init__(self, path: str = RUNNING_VARIABLES):
+        super().__init__(path)
+
+    def loaded_solid(self) -> str:
+        """
+        Return the solid in the loaded cartridge, or None if unknown.
+
+        The recorded solid is only trusted while ``cartridge_in_quantos`` still
+        matches the cartridge it was recorded for.
+        """
+        variables = self.load()
+        if variables.get("solid_in_quantos_cartridge") != variables.get("cartridge_in_quantos"):
+            return None
+        return variables.get("solid_in_quantos")
+
+    def mark_loaded(self, solid_name: str) -> None:
+        """Record that the cartridge currently in the Quantos holds ``solid_name``."""
+        cartridge = self.get("cartridge_in_quantos")
+        self.update(solid_in_quantos=solid_name, solid_in_quantos_cartridge=cartridge)
+
+
+def ensure_cartridge(station, solid_name: str, state: QuantosState = None) -> bool:
+    """
+    Make sure the cartridge with ``solid_name`` is in the Quantos.
+
+    ``quantos_cartridge_handling_logic`` is skipped when the recorded cartridge
+    already holds the solid.
+
+    Args:
+        station (RobInHood): The RobInHood station object.
+        solid_name (str): The solid to dose next.
+        state (QuantosState): The Quantos state. Defaults to ``conf/running_variables.json``.
+
+    Returns:
+        bool: True if the cartridge handling logic ran.
+    """
+    state = state if state is not None else QuantosState()
+    if state.loaded_solid() == solid_name:
+        station._logger.info(f"Cartridge with {solid_name} already in the quantos")
+        return False
+
+    station.quantos_cartridge_handling_logic(solid_name=solid_name)
+    state.mark_loaded(solid_name)
+    return True
+
+
+def order_by_cartridge(samples: list, solid_of, loaded_solid: str = None) -> list:
+    """
+    Group samples by solid so each cartridge is loaded at most once.
+
+    The group of the currently loaded solid goes first, the others follow in
+    order of first appearance; the order inside a group is kept.
+
+    Args:
+        samples (list): The samples, in any form.
+        solid_of (callable): Returns the solid of a sample.
+        loaded_solid (str): The solid in the loaded cartridge, if known.
+
+    Returns:
+        list: The reordered samples.
+    """
+    groups = {}
+    for sample in samples:
+        groups.setdefault(solid_of(sample), []).append(sample)
+
+    order = sorted(groups, key=lambda solid: solid != loaded_solid)
+    return [sample for solid in order for sample in groups[solid]]
@@ -0,0 +1,261 @@
+"""
+Dry-run makespan estimate of a workflow definition.
+
+The definition is planned and run end to end on a ``SimulatedStation``, so no
+hardware is touched and the device state in ``conf/`` is left alone (see
+``workflow_core.benchmark.simulate_workflow``). Every operation takes its mean
+duration, so the estimate is deterministic. The means are fitted from past
+runs: the spans in ``trace_spans.jsonl`` of the given results directories (the
+definition's own results directory by default, see ``workflow_core.tracing``).
+Operations without history fall back to the defaults of
+``workflow_core.simulation.OPERATIONS``.
+
+The report gives the expected total time, the time per phase (the
+``description`` of the steps) and the earliest point the operator is needed:
+the first step with an ``"intervention"``, or the end of the run. With
+``--window`` and ``--batch`` it also finds the largest leading part of a sample
+list that finishes within the window. Run from inside a workflow directory:
+
+    PYTHONPATH=.. python -m workflow_core.estimate conf/dye_workflow.json
+    PYTHONPATH=.. python -m workflow_core.estimate conf/synthesis_workflow.json --history ../old_runs/data \\
+        --set samples=[0,1,2,3,4,5,6,7] --window 24 --batch samples
+"""
+
+import argparse
+import json
+import os
+import statistics
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from workflow_core.benchmark import BENCHMARKS, simulate_workflow
+from workflow_core.simulation import OPERATIONS, Latency
+from workflow_core.tracing import TRACE_FILE, load_spans
+
+# Sample of a workflow the benchmarks do not cover, like an entry of ``RobInHood.sample_dict``.
+GENERIC_SAMPLE = {"solid": "solid", "liquid": "solvent", "mass (mg)": 10, "volume (ml)": 2}
+
+
+class SampleTable(dict):
+    """A sample dictionary answering for any sample number, repeating its entries (or ``GENERIC_SAMPLE``)."""
+
+    def __missing__(self, sample):
+        entries = list(self.values())
+        entry = dict(entries[sample % len(entries)] if entries and isinstance(sample, int) else GENERIC_SAMPLE)
+        entry["vial"] = sample
+        return entry
+
+
+@dataclass
+class Estimate:
+    """Expected timing of a workflow definition. Times are seconds from the start of the run."""
+
+    name: str
+    total: float
+    phases: list
+    intervention: tuple
+    steps: int
+    history: dict = field(default_factory=dict)
+    error: str = None
+
+
+def operation_of(span_name: str) -> str:
+    """Return the ``OPERATIONS`` key of a traced call (e.g. ``ika.set_speed`` -> ``ika_command``), or None."""
+    device, _, name = span_name.rpartition(".")
+    if device == "ika" and name != "get_temperature":
+        return "ika_command"
+    return name if name in OPERATIONS else None
+
+
+def historical_latencies(paths: list) -> dict:
+    """
+    Fit the mean duration of every operation from past traces.
+
+    Args:
+        paths (list): Results directories holding ``trace_spans.jsonl``, or trace files. Missing ones are skipped.
+
+    Returns:
+        dict: Operation -> list of past durations in seconds.
+    """
+    durations = defaultdict(list)
+    for path in paths:
+        trace_path = path if os.path.isfile(path) else os.path.join(path, TRACE_FILE)
+        if not os.path.exists(trace_path):
+            continue
+        for span in load_spans(trace_path):
+            operation = operation_of(span.name)
+            if operation is not None:
+                durations[operation].append(span.duration)
+    return dict(durations)
+
+
+def expected_latencies(history: dict) -> dict:
+    """Return a fixed ``Latency`` per operation: the historical mean, else the simulation default."""
+    latencies = {}
+    for operation, (_, default) in OPERATIONS.items():
+        if history.get(operation):
+            # Past durations already include the amounts dosed and dispensed then
+            latencies[operation] = Latency(statistics.fmean(history[operation]))
+        else:
+            latencies[operation] = Latency(default.mean, per_unit=default.per_unit, minimum=default.minimum)
+    return latencies
+
+
+def default_samples() -> SampleTable:
+    """Return the benchmark samples of the workflow in the working directory, or generic ones."""
+    for directory, _, sample_dict, _ in BENCHMARKS.values():
+        if directory == os.path.basename(os.getcwd()):
+            return SampleTable(sample_dict)
+    return SampleTable()
+
+
+def estimate(definition_path: str, history: list = None, variables: dict = None, sample_dict: dict = None,
+             speedup: float = 5000.0) -> Estimate:
+    """
+    Estimate the makespan of a workflow definition without touching hardware.
+
+    Args:
+        definition_path (str): Path to the definition, relative to the working (workflow) directory.
+        history (list): Results directories or trace files of past runs. Defaults to the definition's results directory.
+        variables (dict): Overrides of the definition's variables.
+        sample_dict (dict): The samples, like ``RobInHood.sample_dict``. Defaults to ``default_samples()``.
+        speedup (float): Simulated seconds per wall-clock second.
+
+    Returns:
+        Estimate: The expected total, the time per phase and the first operator intervention as
+        ``(seconds, what)``. A step that failed in the simulation is reported in ``error``.
+    """
+    from workflow_core.runner import load_definition
+
+    definition_path = os.path.abspath(definition_path)
+    definition = load_definition(definition_path)
+    if history is None:
+        history = [os.path.abspath(definition.get("results_directory", "data"))]
+    past = historical_latencies(history)
+    result = simulate_workflow(os.getcwd(), [definition_path], default_samples() if sample_dict is None else sample_dict,
+                               name=definition.get("name", "workflow"), speedup=speedup,
+                               latencies=expected_latencies(past), variables=variables, image_directory=None)
+
+    phases = {}
+    phase = None
+    intervention = None
+    for step, started, finished in result.step_times:
+        phase = step.description or phase or step.name
+        phases[phase] = phases.get(phase, 0.0) + finished - started
+        if step.intervention and intervention is None:
+            intervention = (started, step.intervention)
+    if intervention is None:
+        intervention = (result.makespan, "Unload the station at the end of the run")
+
+    return Estimate(name=result.name, total=result.makespan, phases=list(phases.items()), intervention=intervention,
+                    steps=result.steps, history={operation: len(durations) for operation, durations in past.items()},
+                    error=result.error)
+
+
+def largest_batch(definition_path: str, variable: str, window: float, variables: dict = None, **kwargs) -> tuple:
+    """
+    Find the largest leading part of a list variable whose run finishes within ``window`` seconds.
+
+    Args:
+        definition_path (str): Path to the definition.
+        variable (str): The list variable holding the samples, e.g. ``samples`` or ``sample_pairs``.
+        window (float): Available time in seconds.
+        variables (dict): Overrides of the definition's variables, including the full list to choose from.
+        **kwargs: Passed on to ``estimate``.
+
+    Returns:
+        tuple: The batch (list) and its Estimate, or an empty list and None if not even one sample fits.
+    """
+    from workflow_core.runner import load_definition
+
+    variables = dict(variables or {})
+    candidates = variables.get(variable, load_definition(definition_path).get("variables", {}).get(variable))
+    if not isinstance(candidates, list):
+        raise ValueError(f"{variable!r} is not a list variable of {definition_path}")
+
+    best, best_estimate = [], None
+    low, high = 1, len(candidates)
+    while low <= high:
+        middle = (low + high) // 2
+        trial = estimate(definition_path, variables={**variables, variable: candidates[:middle]}, **kwargs)
+        if trial.error is None and trial.total <= window:
+            best, best_estimate = candidates[:middle], trial
+            low = middle + 1
+        else:
+            high = middle - 1
+    return best, best_estimate
+
+
+def _duration(seconds: float) -> str:
+    hours, remainder = divmod(int(seconds), 3600)
+    return f"{hours}:{remainder // 60:02d}:{remainder % 60:02d}"
+
+
+def format_estimate(result: Estimate, started: datetime = None) -> str:
+    """Return a readable report of an Estimate for a run starting at ``started`` (now by default)."""
+    started = started or datetime.now()
+    finished = started + timedelta(seconds=result.total)
+    lines = [f"{result.name}: {result.steps} steps, expected makespan {_duration(result.total)}"
+             f" (finishes around {finished:%a %H:%M})"]
+    if result.error:
+        lines.append(f"[WARNING] The simulation stopped at {result.error}; the estimate covers the steps before it")
+    fitted = sum(1 for operation in OPERATIONS if result.history.get(operation))
+    lines.append(f"Timings of {fitted}/{len(OPERATIONS)} operations from past runs, the rest are defaults")
+
+    lines += ["", f"{'phase':<60} {'time':>9} {'share':>7}"]
+    for phase, seconds in result.phases:
+        share = seconds / result.total if result.total else 0.0
+        lines.append(f"{phase[:60]:<60} {_duration(seconds):>9} {100 * share:>6.1f}%")
+
+    seconds, what = result.intervention
+    lines += ["", f"Operator first needed after {_duration(seconds)} (around {started + timedelta(seconds=seconds):%a %H:%M}): {what}"]
+    return "\n".join(lines)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Estimate the makespan of a workflow definition without touching hardware")
+    parser.add_argument("definition", help="Path to a JSON/YAML workflow definition")
+    parser.add_argument("--history", action="append", metavar="DIRECTORY",
+                        help=f"Results directory (or {TRACE_FILE}) of a past run; repeatable. "
+                             "Defaults to the definition's results directory")
+    parser.add_argument("--samples", help="JSON file of the samples, like RobInHood.sample_dict")
+    parser.add_argument("--set", action="append", default=[], metavar="VARIABLE=JSON",
+                        help="Override a workflow variable, e.g. --set samples=[0,1,2,3]")
+    parser.add_argument("--speedup", type=float, default=5000.0, help="Simulated seconds per wall-clock second")
+    parser.add_argument("--window", type=float, metavar="HOURS", help="Time available for the run")
+    parser.add_argument("--batch", metavar="VARIABLE", help="With --window: the sample list variable to size")
+    args = parser.parse_args(argv)
+
+    variables = {}
+    for assignment in args.set:
+        key, _, value = assignment.partition("=")
+        variables[key] = json.loads(value)
+    sample_dict = None
+    if args.samples:
+        with open(args.samples) as samples_file:
+            sample_dict = SampleTable({int(key) if key.isdigit() else key: value for key, value in json.load(samples_file).items()})
+    options = {"history": args.history, "sample_dict": sample_dict, "speedup": args.speedup}
+
+    result = estimate(args.definition, variables=variables, **options)
+    print(format_estimate(result))
+    if args.window is None:
+        return
+
+    window = args.window * 3600
+    if result.error is None and result.total <= window:
+        print(f"\n[INFO] Fits the {args.window:g} h window with {_duration(window - result.total)} to spare")
+    elif args.batch:
+        batch, batch_estimate = largest_batch(args.definition, args.batch, window, variables=variables, **options)
+        if batch_estimate is None:
+            print(f"\n[WARNING] Not even one element of {args.batch} finishes within {args.window:g} h")
+        else:
+            print(f"\n[INFO] Largest batch within {args.window:g} h: {args.batch}={json.dumps(batch)}"
+                  f" ({len(batch)} samples, {_duration(batch_estimate.total)})")
+    else:
+        print(f"\n[WARNING] Overruns the {args.window:g} h window by {_duration(result.total - window)}; "
+              f"use --batch to find the batch that fits")
+
+
+if __name__ == "__main__":
+    main()
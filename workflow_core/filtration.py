@@ -0,0 +1,68 @@
+"""
+Batched filtration on the filter station.
+
+Preparing the funnel (``filtration_prep``) and cleaning and packing it down
+afterwards (``filter_cleaning_packdown``) take longer than filtering a sample,
+yet the per-sample work-up steps do both for every vial. Consecutive samples
+that are compatible (same solvent system, same product) can share one prep and
+one clean: ``filtration_groups`` splits an ordered list of samples into such
+groups, and the batched filter steps of the workflow scripts prep once per
+group and clean only at group boundaries. The scripts keep one sample per
+group unless the run raises ``max_group_size``, since sharing the filter
+changes the chemistry of the work-up.
+
+``ContaminationPolicy`` says when samples must not share the filter even though
+they are compatible: after a maximum number of samples, and for samples (or
+compatibility keys) that always get a freshly cleaned filter to themselves.
+"""
+
+from dataclasses import dataclass, field
+
+
+@dataclass
+class ContaminationPolicy:
+    """
+    When the filter has to be cleaned inside a run of compatible samples.
+
+    Args:
+        max_group_size (int): Clean the filter after at most this many samples. None for no limit.
+        isolate (list): Samples or compatibility keys that are filtered on their own.
+    """
+
+    max_group_size: int = None
+    isolate: list = field(default_factory=list)
+
+    def alone(self, sample, key) -> bool:
+        """Return True if ``sample`` must not share the filter."""
+        return sample in self.isolate or key in self.isolate
+
+
+def filtration_groups(samples: list, key_of, policy: ContaminationPolicy = None) -> list:
+    """
+    Split an ordered list of samples into groups that share one filter prep and clean.
+
+    The order of the samples is kept; a new group starts whenever the
+    compatibility key changes or the contamination policy requires a clean.
+
+    Args:
+        samples (list): The samples, in filtration order.
+        key_of (callable): Returns the compatibility key of a sample, e.g. its solvent system.
+            Samples with equal keys may share the filter.
+        policy (ContaminationPolicy): Additional cleaning rules.
+
+    Returns:
+        list: Lists of samples, one per filter prep.
+    """
+    policy = policy if policy is not None else ContaminationPolicy()
+    groups = []
+    previous_key = previous_alone = None
+    for sample in samples:
+        key = key_of(sample)
+        alone = policy.alone(sample, key)
+        full = policy.max_group_size is not None and groups and len(groups[-1]) >= policy.max_group_size
+        if not groups or key != previous_key or alone or previous_alone or full:
+            groups.append([sample])
+        else:
+            groups[-1].append(sample)
+        previous_key, previous_alone = key, alone
+    return groups
@@ -0,0 +1,203 @@
+"""
+Non-blocking IKA hotplate control.
+
+``HotplateController`` sets the hotplate and polls its temperature in a
+background thread, returning a ``concurrent.futures.Future`` that resolves
+once the target is reached. The recorded readings give the current ramp rate
+and an estimate of the time left, so the arm can prepare or decap vials while
+the hotplate heats up or cools down instead of the whole station idling in a
+polling loop.
+
+Every IKA command of a workflow goes through the controller, so the background
+temperature readings never interleave with a command sent by a step.
+"""
+
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future
+
+from workflow_core.station import station_of
+
+# A controller lives as long as its station, so a short-lived station handle does not leave one behind
+_controllers = weakref.WeakKeyDictionary()
+_controllers_lock = threading.Lock()
+
+
+class HotplateController:
+    """
+    Drive an IKA hotplate and wait for temperatures in the background.
+
+    Args:
+        ika: The station's IKA device (``station.ika``).
+        logger (logging.Logger): Logger for progress messages.
+        poll_interval (float): Seconds between temperature readings.
+        history_size (int): Number of readings kept for the ramp estimate.
+    """
+
+    def __init__(self, ika, logger=None, poll_interval: float = 5.0, history_size: int = 720):
+        self.ika = ika
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self._readings = deque(maxlen=history_size)
+        self._device_lock = threading.Lock()
+        self._future = None
+        self._target = None
+        self._stop = None
+
+    def _log(self, message: str) -> None:
+        if self.logger is not None:
+            self.logger.info(message)
+
+    def read_temperature(self) -> float:
+        """Read the plate temperature and record it for the ramp estimate."""
+        with self._device_lock:
+            temperature = self.ika.get_temperature(sensor=0)
+        self._readings.append((time.time(), temperature))
+        return temperature
+
+    def readings(self) -> list:
+        """Return the recorded ``(epoch seconds, temperature)`` readings, oldest first."""
+        return list(self._readings)
+
+    def ramp_rate(self, window: float = 120.0) -> float:
+        """
+        Return the temperature change in degrees per second over the last ``window`` seconds.
+
+        Least-squares slope of the recorded readings, or None with fewer than two readings.
+        """
+        if not self._readings:
+            return None
+        cutoff = self._readings[-1][0] - window
+        points = [(timestamp, temperature) for timestamp, temperature in self._readings if timestamp >= cutoff]
+        if len(points) < 2:
+            return None
+        mean_t = sum(timestamp for timestamp, _ in points) / len(points)
+        mean_y = sum(temperature for _, temperature in points) / len(points)
+        spread = sum((timestamp - mean_t) ** 2 for timestamp, _ in points)
+        if spread == 0:
+            return None
+        return sum((timestamp - mean_t) * (temperature - mean_y) for timestamp, temperature in points) / spread
+
+    def estimate_time_to_target(self, temperature: float = None, temperature_delta: float = 0.0) -> float:
+        """
+        Estimate the seconds left until ``temperature`` is reached at the current ramp rate.
+
+        Args:
+            temperature (float): The target. Defaults to the target being waited for.
+            temperature_delta (float): Tolerance around the target.
+
+        Returns:
+            float: Seconds to go, 0 if already there, or None if the plate is not moving towards the target.
+        """
+        temperature = self._target if temperature is None else temperature
+        if temperature is None or not self._readings:
+            return None
+        current = self._readings[-1][1]
+        gap = temperature - current
+        if abs(gap) <= temperature_delta:
+            return 0.0
+        rate = self.ramp_rate()
+        if not rate or (gap > 0) != (rate > 0):
+            return None
+        return (abs(gap) - temperature_delta) / abs(rate)
+
+    def start(self, temperature: float, speed: int, temperature_delta: float = 3) -> Future:
+        """
+        Set the hotplate temperature and stirring speed, start both and return a "temperature reached" future.
+
+        Args:
+            temperature (float): Target temperature.
+            speed (int): Stirring speed.
+            temperature_delta (float): Tolerance around the target.
+
+        Returns:
+            Future: Resolves to the measured temperature once within ``temperature_delta`` of the target.
+        """
+        with self._device_lock:
+            self.ika.set_temperature(temperature=temperature)
+            self.ika.set_speed(speed=speed)
+            self.ika.start_temperature_regulation()
+            self.ika.start_stirring()
+        return self.wait_for(temperature, temperature_delta)
+
+    def stir(self, speed: int) -> None:
+        """Set the stirring speed and start stirring, leaving the temperature regulation as it is."""
+        with self._device_lock:
+            self.ika.set_speed(speed=speed)
+            self.ika.start_stirring()
+
+    def switch_off(self, heating: bool = True) -> None:
+        """
+        Stop stirring and, with ``heating``, the temperature regulation.
+
+        A temperature still being waited for keeps being watched; call ``stop`` to end that.
+        """
+        with self._device_lock:
+            self.ika.stop_stirring()
+            if heating:
+                self.ika.stop_temperature_regulation()
+
+    def wait_for(self, temperature: float, temperature_delta: float = 3) -> Future:
+        """
+        Return a future resolving when the plate is within ``temperature_delta`` of ``temperature``
+        (or has crossed it between two readings).
+
+        A pending future for the same target is reused; a different target replaces it.
+        """
+        if self._future is not None and not self._future.done():
+            if self._target == temperature:
+                return self._future
+            self._stop.set()
+            self._future.cancel()
+
+        self._target = temperature
+        self._future = Future()
+        self._stop = threading.Event()
+        threading.Thread(target=self._poll, args=(temperature, temperature_delta, self._future, self._stop),
+                         name="hotplate-monitor", daemon=True).start()
+        return self._future
+
+    def _poll(self, temperature: float, temperature_delta: float, future: Future, stop: threading.Event) -> None:
+        try:
+            start_side = None
+            while not stop.is_set():
+                measured_temp = self.read_temperature()
+                side = measured_temp > temperature
+                start_side = side if start_side is None else start_side
+                # A reading that jumped across the band between two polls also counts as reached.
+                if abs(measured_temp - temperature) <= temperature_delta or side != start_side:
+                    self._log(f"Temperature of {temperature} reached")
+                    future.set_result(measured_temp)
+                    return
+                remaining = self.estimate_time_to_target(temperature, temperature_delta)
+                eta = "" if remaining is None else f", about {remaining / 60:.1f} min to go"
+                self._log(f"Temperature of {temperature} not reached, current temperature is {measured_temp}{eta}")
+                stop.wait(self.poll_interval)
+        except Exception as error:
+            if not future.done():
+                future.set_exception(error)
+
+    def stop(self) -> None:
+        """Stop waiting; the hotplate keeps its settings."""
+        if self._stop is not None:
+            self._stop.set()
+
+
+def hotplate_controller(station, poll_interval: float = 5.0) -> HotplateController:
+    """
+    Return the controller for a station's IKA, creating it on first use.
+
+    Keeping one controller per station lets a later step (in the same session or
+    runner) wait on a temperature an earlier step started, also when the session
+    hands every step its own ``StationGuard``. ``poll_interval`` only applies to
+    a new controller.
+    """
+    ika = station.ika
+    with _controllers_lock:
+        controller = _controllers.get(station_of(station))
+        if controller is None:
+            controller = HotplateController(ika, logger=station._logger, poll_interval=poll_interval)
+            _controllers[station_of(station)] = controller
+        return controller
@@ -0,0 +1,259 @@
+"""
+IKA hotplate slot allocation and rolling reactions.
+
+Vials used to go onto the hotplate slot with the number of their rack
+position, and a reaction ran as one synchronous batch: all samples on, one
+timer, all samples off. ``HotplateSlots`` hands out free slots instead (the
+slot numbered like the vial's rack position if it is free) and
+records, per slot, the sample on it, when it was put down and when its own
+reaction time is up, in ``hotplate_slots.json`` in the results directory (so
+the bash step processes and a restarted controller see the same plate).
+
+``run_rolling`` keeps the plate full: whenever a slot is free the next sample
+goes on, and every sample comes off as soon as its own timer expires, while
+the others keep reacting.
+
+Without ``ika_slots`` in ``conf/running_variables.json`` the usable slots
+are the rack positions of the samples, the slots the workflows have always
+put these vials on. Set ``ika_slots`` to use other slots of the IKA block.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+
+from workflow_core.running_variables import RUNNING_VARIABLES, RunningVariables
+from workflow_core.timers import ReactionTimer, wait_for_timer
+
+SLOTS_FILE = "hotplate_slots.json"
+IKA_SLOTS = "ika_slots"
+
+_lock = threading.RLock()
+
+
+class HotplateFull(RuntimeError):
+    """Raised when a vial has to go onto the hotplate and no slot is free."""
+
+
+def sample_slots(sample_dict: dict) -> list:
+    """Return one slot per sample, numbered like the rack position of its vial."""
+    return sorted({int(sample["vial"]) for sample in sample_dict.values()})
+
+
+def ika_slots(path: str = RUNNING_VARIABLES, sample_dict: dict = None) -> list:
+    """
+    Return the slot numbers of the IKA block.
+
+    Args:
+        path (str): The running variables, whose ``ika_slots`` are used if set.
+        sample_dict (dict): The samples, like ``RobInHood.sample_dict``, giving the slots
+            (``sample_slots``) when ``ika_slots`` is not set.
+
+    Raises:
+        ValueError: If ``ika_slots`` is not set and there are no samples.
+    """
+    slots = RunningVariables(path).get(IKA_SLOTS) or (sample_slots(sample_dict) if sample_dict else None)
+    if not slots:
+        raise ValueError(f"Set {IKA_SLOTS!r} in {path} to the slot numbers of the IKA block")
+    return list(slots)
+
+
+@dataclass
+class Occupant:
+    """A sample on a hotplate slot. ``deadline`` is None until its reaction timer starts."""
+
+    sample: int
+    vial: int
+    placed: float
+    deadline: float = None
+
+    def remaining(self) -> float:
+        """Return the seconds left of the reaction, 0 once it is up, or None without a timer."""
+        return None if self.deadline is None else max(0.0, self.deadline - time.time())
+
+
+class HotplateSlots:
+    """
+    Read and update the slot occupancy of a results directory.
+
+    Args:
+        results_directory (str): The directory holding ``hotplate_slots.json``.
+        slots (list): The slot numbers of the hotplate. Defaults to ``ika_slots()``, read when a
+            slot is first handed out.
+        sample_dict (dict): The samples, for ``ika_slots`` when ``slots`` is not given.
+    """
+
+    def __init__(self, results_directory: str, slots: list = None, sample_dict: dict = None):
+        self.path = os.path.join(results_directory, SLOTS_FILE)
+        self._slots = list(slots) if slots is not None else None
+        self._sample_dict = sample_dict
+
+    @property
+    def slots(self) -> list:
+        if self._slots is None:
+            self._slots = ika_slots(sample_dict=self._sample_dict)
+        return self._slots
+
+    def _load(self) -> dict:
+        with _lock:
+            if not os.path.exists(self.path):
+                return {"slots": {}, "completed": {}}
+            with open(self.path) as slots_file:
+                return json.load(slots_file)
+
+    def _save(self, state: dict) -> None:
+        with _lock:
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as slots_file:
+                json.dump(state, slots_file, indent=4)
+            os.replace(temporary, self.path)
+
+    def reset(self) -> None:
+        """Forget every occupant and completed batch, for a new run with an empty hotplate."""
+        with _lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def occupants(self) -> dict:
+        """Return ``{slot: Occupant}`` of the occupied slots."""
+        return {int(slot): Occupant(**occupant) for slot, occupant in self._load()["slots"].items()}
+
+    def free_slots(self) -> list:
+        """Return the free slots in order."""
+        occupied = self.occupants()
+        return [slot for slot in self.slots if slot not in occupied]
+
+    def slot_of(self, sample: int) -> int:
+        """Return the slot ``sample`` is on, or None."""
+        for slot, occupant in self.occupants().items():
+            if occupant.sample == sample:
+                return slot
+        return None
+
+    def allocate(self, sample: int, vial: int) -> int:
+        """
+        Reserve a free slot for ``sample``: the one numbered like ``vial`` if it is free, else the first.
+
+        A sample that already holds a slot keeps it, so re-running a move step after a
+        restart sends the vial to the same place.
+
+        Raises:
+            HotplateFull: If every slot is taken.
+        """
+        with _lock:
+            current = self.slot_of(sample)
+            if current is not None:
+                return current
+            free = self.free_slots()
+            if not free:
+                raise HotplateFull(f"No free hotplate slot for sample {sample}: {self.occupants()}")
+            slot = vial if vial in free else free[0]
+            state = self._load()
+            state["slots"][str(slot)] = asdict(Occupant(sample=sample, vial=vial, placed=time.time()))
+            self._save(state)
+            return slot
+
+    def start_timer(self, sample: int, seconds: float) -> Occupant:
+        """Start the reaction time of ``sample`` unless it is already running, and return its occupant."""
+        with _lock:
+            state = self._load()
+            slot = self.slot_of(sample)
+            if slot is None:
+                raise ValueError(f"Sample {sample} is not on the hotplate")
+            occupant = state["slots"][str(slot)]
+            if occupant["deadline"] is None:
+                occupant["deadline"] = time.time() + seconds
+                self._save(state)
+            return Occupant(**occupant)
+
+    def release(self, sample: int, batch: str = None) -> int:
+        """
+        Free the slot of ``sample`` and return it (None if it was not on the hotplate).
+
+        Args:
+            sample (int): The sample taken off.
+            batch (str): Name of the rolling batch to record the sample as completed in.
+        """
+        with _lock:
+            state = self._load()
+            slot = self.slot_of(sample)
+            if slot is not None:
+                del state["slots"][str(slot)]
+            if batch is not None:
+                state["completed"].setdefault(batch, []).append(sample)
+            self._save(state)
+            return slot
+
+    def completed(self, batch: str) -> list:
+        """Return the samples of a rolling batch that already came off the hotplate."""
+        return self._load()["completed"].get(batch, [])
+
+    def finish_batch(self, batch: str) -> None:
+        """Forget the completed samples of a finished rolling batch."""
+        with _lock:
+            state = self._load()
+            state["completed"].pop(batch, None)
+            self._save(state)
+
+
+def run_rolling(hotplate: HotplateSlots, samples: list, duration_of, load, unload, vial_of=None, batch: str = "reaction",
+                logger=None, idle=None) -> dict:
+    """
+    React samples in a rolling batch: fill free slots, take each sample off when its own time is up.
+
+    Samples already on the hotplate (e.g. after a restart) keep their slot and remaining time,
+    and samples that already came off in an interrupted run of the same batch are skipped.
+
+    Args:
+        hotplate (HotplateSlots): The slot state.
+        samples (list): The samples, in the order they go on.
+        duration_of (callable): Returns the reaction time of a sample in seconds.
+        load (callable): ``load(sample, slot)`` moves the sample's vial onto the slot.
+        unload (callable): ``unload(sample, slot)`` moves the vial back to the rack.
+        vial_of (callable): Returns the rack position of a sample, for the slot record.
+        batch (str): Name of the batch, for resuming.
+        logger (logging.Logger): Logger for progress messages.
+        idle (callable): Returns a context manager entered while waiting for the next sample's
+            time, e.g. ``lambda: idle(station, ("arm",))`` (``workflow_core.station.idle``) to
+            free the arm between moves.
+
+    Returns:
+        dict: ``{sample: (seconds on the hotplate, slot)}`` of the samples taken off by this call.
+    """
+    done = set(hotplate.completed(batch))
+    on_hotplate = {occupant.sample for occupant in hotplate.occupants().values()}
+    pending = [sample for sample in samples if sample not in done and sample not in on_hotplate]
+    for sample in samples:
+        if sample in on_hotplate:
+            hotplate.start_timer(sample, duration_of(sample))
+    reacted = {}
+
+    while True:
+        while pending and hotplate.free_slots():
+            sample = pending.pop(0)
+            slot = hotplate.allocate(sample, vial_of(sample) if vial_of is not None else sample)
+            load(sample, slot)
+            occupant = hotplate.start_timer(sample, duration_of(sample))
+            if logger is not None:
+                logger.info(f"Sample {sample} on hotplate slot {slot} until {time.ctime(occupant.deadline)}")
+
+        running = {slot: occupant for slot, occupant in hotplate.occupants().items() if occupant.sample in samples}
+        if not running:
+            if pending:
+                raise HotplateFull(f"No hotplate slot frees up for samples {pending}")
+            break
+
+        first = min(running.values(), key=lambda occupant: occupant.deadline)
+        with idle() if idle is not None else nullcontext():
+            wait_for_timer(ReactionTimer(name=f"{batch} sample {first.sample}", started=first.placed, deadline=first.deadline), logger=logger)
+        for slot, occupant in sorted(running.items()):
+            if occupant.remaining() == 0:
+                unload(occupant.sample, slot)
+                hotplate.release(occupant.sample, batch=batch)
+                reacted[occupant.sample] = (time.time() - occupant.placed, slot)
+
+    hotplate.finish_batch(batch)
+    return reacted
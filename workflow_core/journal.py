@@ -0,0 +1,264 @@
+"""
+Append-only step journal for resuming a workflow after a failure.
+
+Every completed step is appended as one JSON line to ``journal.jsonl`` in the
+results directory: the step, its arguments, its return value, the sample it
+worked on, where that sample's vial is afterwards and a snapshot of
+``running_variables.json`` (primed pump lines, loaded Quantos cartridge).
+
+A fresh run appends a ``run_started`` marker. A resumed run appends a
+``run_resumed`` marker and replays the workflow from the top: each step call
+is matched to the journal by its name, its arguments and how many identical
+calls came before it in the pass, so completed steps are skipped (returning
+their journaled result) and the workflow continues at the first step that did
+not finish. Because the journal file carries all the state, this works for
+the runner as well as for bash drivers calling one step per process.
+
+The duration of every completed step is also added to the campaign results
+store (``workflow_core.results_store``).
+
+Bash drivers enable it by exporting ``WORKFLOW_JOURNAL`` (the results
+directory) after ``python -m workflow_core.journal start|resume <dir>``.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+
+from workflow_core.running_variables import RunningVariables
+from workflow_core.timers import TimerStore
+
+JOURNAL_FILE = "journal.jsonl"
+JOURNAL_ENV = "WORKFLOW_JOURNAL"
+
+_lock = threading.RLock()
+
+
+def _log(logger, message: str, warning: bool = False) -> None:
+    if logger is None:
+        print(f"[{'WARNING' if warning else 'INFO'}] {message}")
+    elif warning:
+        logger.warning(message)
+    else:
+        logger.info(message)
+
+
+def step_signature(name: str, kwargs: dict) -> str:
+    """Return the identity of a step call, independent of argument order."""
+    return f"{name}:{json.dumps(kwargs, sort_keys=True, default=str)}"
+
+
+@dataclass
+class JournalEntry:
+    """A completed step."""
+
+    key: str
+    step: str
+    kwargs: dict
+    result: object = None
+    sample: object = None
+    location: str = None
+    started: float = 0.0
+    finished: float = 0.0
+    device_state: dict = field(default_factory=dict)
+
+
+class StepJournal:
+    """
+    Read and append to the journal of a results directory.
+
+    Args:
+        results_directory (str): The directory holding ``journal.jsonl``.
+        running_variables (RunningVariables): Source of the device state snapshots.
+    """
+
+    def __init__(self, results_directory: str, running_variables: RunningVariables = None):
+        self.path = os.path.join(results_directory, JOURNAL_FILE)
+        self.running_variables = running_variables if running_variables is not None else RunningVariables()
+
+    def _append(self, record: dict) -> None:
+        line = json.dumps(record, default=str)
+        with _lock:
+            with open(self.path, "a") as journal_file:
+                journal_file.write(line + "\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def _records(self) -> list:
+        """Return the records of the latest run. A truncated last line (crash mid-write) is ignored."""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("event") == "run_started":
+                    records = []
+                records.append(record)
+        return records
+
+    def current_run(self) -> dict:
+        """Return the ``run_started`` record of the latest run, or an empty dict."""
+        records = self._records()
+        return records[0] if records and records[0].get("event") == "run_started" else {}
+
+    def start_run(self, name: str) -> str:
+        """Begin a new run; earlier entries are kept but no longer count as completed. Returns the run id."""
+        run_id = uuid.uuid4().hex
+        self._append({"event": "run_started", "run": run_id, "workflow": name, "time": time.time()})
+        return run_id
+
+    def resume_run(self) -> None:
+        """Begin a new pass over the current run; its completed steps will be skipped."""
+        self._append({"event": "run_resumed", "time": time.time()})
+
+    def claim(self, name: str, kwargs: dict) -> str:
+        """
+        Register the next call of a step in the current pass and return its journal key.
+
+        The key is the call signature numbered by the identical calls made earlier in
+        the pass, so a step repeated with the same arguments (e.g. two cool-down waits)
+        is journaled separately.
+        """
+        signature = step_signature(name, kwargs)
+        with _lock:
+            occurrence = 0
+            for record in self._records():
+                if record.get("event") in ("run_started", "run_resumed"):
+                    occurrence = 0
+                elif record.get("event") == "step_called" and record["signature"] == signature:
+                    occurrence += 1
+            self._append({"event": "step_called", "signature": signature})
+        return f"{signature}#{occurrence}"
+
+    def record(self, key: str, step: str, kwargs: dict, result=None, sample=None, location: str = None,
+               started: float = 0.0, finished: float = 0.0) -> JournalEntry:
+        """Append a completed step, with a snapshot of the current device state, and store its duration."""
+        entry = JournalEntry(key=key, step=step, kwargs=kwargs, result=result, sample=sample, location=location,
+                             started=started, finished=finished, device_state=self.running_variables.load())
+        self._append({"event": "step_completed", **asdict(entry)})
+
+        # Imported here so that a journaled step client does not load sqlite3 until a step completes
+        from workflow_core.results_store import results_store
+
+        store = results_store()
+        store.record(os.path.dirname(self.path), "duration", finished - started, unit="s", step=step,
+                     sample=sample if isinstance(sample, int) else None, vial=kwargs.get("vial_pos"),
+                     started=started, finished=finished)
+        store.flush()
+        return entry
+
+    def completed(self) -> dict:
+        """Return ``{key: JournalEntry}`` for the steps completed in the latest run."""
+        entries = {}
+        for record in self._records():
+            if record.get("event") == "step_completed":
+                record = {name: value for name, value in record.items() if name != "event"}
+                entries[record["key"]] = JournalEntry(**record)
+        return entries
+
+    def vial_locations(self) -> dict:
+        """Return ``{sample: location}`` as of the last completed step that moved each vial."""
+        locations = {}
+        for entry in self.completed().values():
+            if entry.sample is not None and entry.location is not None:
+                sample = tuple(entry.sample) if isinstance(entry.sample, list) else entry.sample
+                locations[sample] = entry.location
+        return locations
+
+    def last_device_state(self) -> dict:
+        """Return the device state recorded after the last completed step, or an empty dict."""
+        entries = list(self.completed().values())
+        return entries[-1].device_state if entries else {}
+
+    def restore_device_state(self, logger=None) -> dict:
+        """
+        Bring ``running_variables.json`` back in line with the journal.
+
+        Keys missing from the current file (e.g. after it was reset) or holding a
+        different value (e.g. after it was checked out again) are set to the last
+        journaled snapshot. Every overwritten value is reported, so the operator
+        can check the device if the step that failed changed it.
+
+        Returns:
+            dict: The restored keys and values.
+        """
+        snapshot = self.last_device_state()
+        current = self.running_variables.load()
+        restored = {key: value for key, value in snapshot.items() if current.get(key, object()) != value}
+        for key, value in restored.items():
+            if key in current:
+                _log(logger, f"[journal] {key} is {current[key]!r}, journal recorded {value!r}; restoring the journaled value", warning=True)
+        if restored:
+            self.running_variables.update(**restored)
+            _log(logger, f"[journal] Restored device state {restored}")
+        return restored
+
+    def run_once(self, step, kwargs: dict, sample=None, location: str = None, logger=None):
+        """
+        Call ``step(**kwargs)`` unless the current pass already completed this call.
+
+        Args:
+            step (callable): The step function.
+            kwargs (dict): The journaled arguments (without the station).
+            sample: The sample the step works on, if any.
+            location (str): Where the step leaves the sample's vial, if known.
+            logger (logging.Logger): Logger for the skip message.
+
+        Returns:
+            The step result, or the journaled result of a completed step.
+        """
+        key = self.claim(step.__name__, kwargs)
+        entry = self.completed().get(key)
+        if entry is not None:
+            _log(logger, f"[journal] Skipping completed step {step.__name__}({kwargs})")
+            return entry.result
+
+        started = time.time()
+        result = step(**kwargs)
+        self.record(key, step.__name__, kwargs, result=result, sample=sample, location=location,
+                    started=started, finished=time.time())
+        return result
+
+
+def active_journal() -> StepJournal:
+    """Return the journal named by ``WORKFLOW_JOURNAL``, or None."""
+    results_directory = os.environ.get(JOURNAL_ENV)
+    return StepJournal(results_directory) if results_directory else None
+
+
+def main(argv=None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Start or resume the step journal of a results directory")
+    parser.add_argument("command", choices=("start", "resume"))
+    parser.add_argument("results_directory")
+    parser.add_argument("--name", default="", help="Workflow name recorded with a new run")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.results_directory, exist_ok=True)
+    journal = StepJournal(args.results_directory)
+    completed = journal.completed()
+    if args.command == "start" or not completed:
+        if args.command == "resume":
+            print("[WARNING] Nothing to resume, starting a new run")
+        journal.start_run(args.name)
+        # A timer left running by an aborted run would otherwise be waited on instead of restarted
+        TimerStore(args.results_directory).reset()
+        return
+
+    journal.resume_run()
+    print(f"[INFO] Resuming: {len(completed)} steps already completed")
+    journal.restore_device_state()
+    for sample, location in journal.vial_locations().items():
+        print(f"[INFO] Sample {sample} is at {location}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Stage-based pipeline scheduler for multi-device sample handling.
+
+A sample passes through an ordered list of stages (e.g. rack -> Quantos ->
+dosing -> pump -> dispense -> capper -> rack). Every stage names the station
+resources it needs while it runs (``uses``, e.g. the arm or the Quantos) and
+the station the vial sits at afterwards (``location``). Locations are held by
+a sample until its vial moves on, so two vials never share the Quantos, the
+pump or the capper, while stages of different samples that need disjoint
+resources run concurrently: the arm can cap sample N-1 while the Quantos doses
+sample N.
+
+Waiting stages are granted in sample order whenever their resources are free,
+so a sample never overtakes an earlier one on a shared resource. Because every
+sample visits the locations in the same order, holding a location while
+waiting for the next one cannot deadlock.
+
+The station object is shared between the worker threads; each stage must only
+drive the devices it declares in ``uses``/``location``. A call that moves
+several devices (e.g. ``quantos_cartridge_handling_logic``, which swaps the
+cartridge with the arm) needs a stage of its own that declares all of them.
+RobInHood does not promise to be thread-safe, so hand the stages a
+``SerializedStation``: it never lets two threads drive the same device at once,
+even when a stage declares too little.
+"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+
+from workflow_core.tracing import SUB_DEVICES, context, current_context, devices_of
+
+
+class SerializedStation:
+    """
+    Station proxy holding a per-device lock around every method call.
+
+    Calls are attributed to devices like the timing spans (``devices_of``); a
+    call driving several devices takes their locks in a fixed order, and calls
+    that cannot be attributed share the ``station`` lock. Attributes and
+    private members are passed through unlocked.
+
+    Args:
+        station (RobInHood): The station shared by the worker threads.
+    """
+
+    def __init__(self, station, locks: dict = None, device: str = None):
+        object.__setattr__(self, "_target", station)
+        object.__setattr__(self, "_locks", locks if locks is not None else {})
+        object.__setattr__(self, "_device", device)
+
+    def _lock_of(self, device: str) -> threading.Lock:
+        # dict.setdefault is atomic, so concurrent first calls still share one lock
+        return self._locks.setdefault(device, threading.Lock())
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name.startswith("_"):
+            return value
+        if self._device is None and name in SUB_DEVICES:
+            return SerializedStation(value, self._locks, SUB_DEVICES[name])
+        if not callable(value):
+            return value
+        locks = [self._lock_of(device) for device in sorted((self._device,) if self._device else devices_of(name))]
+
+        def serialized(*args, **kwargs):
+            for lock in locks:
+                lock.acquire()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+
+        return serialized
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+@dataclass
+class Stage:
+    """
+    A step of the per-sample pipeline.
+
+    Args:
+        name (str): Stage name, used in timings and logs.
+        action (callable): Called with the sample identifier.
+        uses (tuple): Resources held while the stage runs.
+        location (str): Where the vial is once the stage is done. ``None`` means the rack,
+            which is never a bottleneck and releases the previous location.
+    """
+
+    name: str
+    action: callable
+    uses: tuple = ()
+    location: str = None
+
+
+@dataclass
+class PipelineResult:
+    """Per-sample stage timings and stage return values of a pipeline run."""
+
+    timings: dict = field(default_factory=dict)
+    results: dict = field(default_factory=dict)
+    started: float = 0.0
+    finished: float = 0.0
+
+    @property
+    def makespan(self) -> float:
+        return self.finished - self.started
+
+
+class _Aborted(Exception):
+    pass
+
+
+class ResourcePool:
+    """
+    A set of named exclusive resources granted atomically and in priority order.
+
+    Args:
+        names (iterable): Resources known up front. Unknown names are added on first use.
+    """
+
+    def __init__(self, names=()):
+        self._owner = {name: None for name in names}
+        self._waiting = {}
+        self._condition = threading.Condition()
+        self._aborted = False
+
+    def _free(self, names, owner) -> bool:
+        return all(self._owner.get(name) in (None, owner) for name in names)
+
+    def acquire(self, names, owner, priority) -> None:
+        """
+        Block until every resource in ``names`` is free, then take them all.
+
+        A request is only granted if no lower ``priority`` request that could also
+        be granted right now competes for one of the same resources.
+        """
+        names = frozenset(names)
+        if not names:
+            return
+        with self._condition:
+            self._waiting[owner] = (priority, names)
+            try:
+                while True:
+                    if self._aborted:
+                        raise _Aborted()
+                    if self._free(names, owner) and not any(
+                        other_priority < priority and other_names & names and self._free(other_names, other)
+                        for other, (other_priority, other_names) in self._waiting.items() if other != owner
+                    ):
+                        break
+                    self._condition.wait()
+                for name in names:
+                    self._owner[name] = owner
+            finally:
+                del self._waiting[owner]
+
+    def try_acquire(self, names, owner) -> bool:
+        """Take every resource in ``names`` if they are all free and nobody waits for them, without blocking."""
+        names = frozenset(names)
+        with self._condition:
+            if self._aborted or not self._free(names, owner) or any(
+                other_names & names for other, (_, other_names) in self._waiting.items() if other != owner
+            ):
+                return False
+            for name in names:
+                self._owner[name] = owner
+            return True
+
+    def release(self, names, owner) -> None:
+        """Release the resources in ``names`` held by ``owner``."""
+        with self._condition:
+            for name in names:
+                if self._owner.get(name) == owner:
+                    self._owner[name] = None
+            self._condition.notify_all()
+
+    def abort(self) -> None:
+        """Wake every waiter with an abort, used when a stage fails."""
+        with self._condition:
+            self._aborted = True
+            self._condition.notify_all()
+
+
+class PipelineScheduler:
+    """
+    Run samples through a list of stages, overlapping stages on different resources.
+
+    Args:
+        stages (list): The Stage objects every sample passes through, in order.
+        max_in_flight (int): Maximum number of samples in the pipeline at once.
+        logger (logging.Logger): Optional logger for stage start/finish messages.
+    """
+
+    def __init__(self, stages: list, max_in_flight: int = 3, logger=None):
+        self.stages = stages
+        self.max_in_flight = max_in_flight
+        self.logger = logger
+
+    def _log(self, message: str) -> None:
+        if self.logger is not None:
+            self.logger.info(message)
+
+    def _run_sample(self, priority: int, sample, pool: ResourcePool, result: PipelineResult, errors: list,
+                    attributes: dict = None) -> None:
+        location = None
+        timings = result.timings.setdefault(sample, {})
+        owner = (priority, sample)
+        try:
+            for stage in self.stages:
+                # The destination location is taken together with the stage resources.
+                needed = set(stage.uses)
+                if stage.location is not None:
+                    needed.add(stage.location)
+                pool.acquire(needed, owner, priority)
+                try:
+                    self._log(f"[pipeline] Sample {sample}: {stage.name}")
+                    start = time.time()
+                    with context(**{**(attributes or {}), "sample": sample}):
+                        value = stage.action(sample)
+                    timings[stage.name] = (start, time.time())
+                    if value is not None:
+                        result.results.setdefault(sample, {})[stage.name] = value
+                finally:
+                    pool.release(set(stage.uses) - {stage.location, location}, owner)
+                if location is not None and location != stage.location:
+                    pool.release([location], owner)
+                location = stage.location
+        except _Aborted:
+            pass
+        except Exception as error:
+            errors.append((sample, error))
+            pool.abort()
+        finally:
+            if location is not None:
+                pool.release([location], owner)
+
+    def run(self, samples: list) -> PipelineResult:
+        """
+        Push every sample through the pipeline.
+
+        Args:
+            samples (list): Sample identifiers, in priority order.
+
+        Returns:
+            PipelineResult: Stage timings (epoch seconds) per sample and non-None stage return values.
+
+        Raises:
+            Exception: The first stage error, after all in-flight stages have stopped.
+        """
+        resources = {name for stage in self.stages for name in stage.uses}
+        resources |= {stage.location for stage in self.stages if stage.location is not None}
+        pool = ResourcePool(resources)
+        result = PipelineResult(started=time.time())
+        errors = []
+        slots = threading.Semaphore(self.max_in_flight)
+        threads = []
+        # The workers record their station calls under the calling step
+        attributes = current_context()
+
+        def worker(priority, sample):
+            try:
+                self._run_sample(priority, sample, pool, result, errors, attributes)
+            finally:
+                slots.release()
+
+        for priority, sample in enumerate(samples):
+            slots.acquire()
+            if errors:
+                slots.release()
+                break
+            thread = threading.Thread(target=worker, args=(priority, sample), name=f"pipeline-{sample}", daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+        result.finished = time.time()
+
+        if errors:
+            sample, error = errors[0]
+            self._log(f"[pipeline] Sample {sample} failed: {error!r}")
+            raise error
+        return result
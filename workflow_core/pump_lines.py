@@ -0,0 +1,130 @@
+"""
+Pump line state built on ``conf/running_variables.json``.
+
+The workflow directories record which solvent each pump line holds in
+``pump_1_primed_solvent`` / ``pump_2_primed_solvent``. ``prime_if_needed``
+consults that file before calling ``station.pump_prime_dispense_tubing`` and
+skips the prime when the requested solvent is already in a line, which saves
+minutes and solvent on every repeated dispense and wash cycle.
+
+RobInHood chooses the physical line. When it does not record which line it
+primed, either line may have changed, so both are set to None: the next
+dispense of any solvent primes again rather than trusting a guess. A prime is
+only skipped for a line whose contents are known. ``order_by_solvent`` groups
+batched dispenses by solvent so each one is primed at most once.
+"""
+
+from workflow_core.running_variables import RUNNING_VARIABLES, RunningVariables
+
+PUMP_LINES = ("pump_1_primed_solvent", "pump_2_primed_solvent")
+
+
+class PumpLineState(RunningVariables):
+    """
+    Live view of the primed solvent of each pump line.
+
+    Args:
+        path (str): Path to ``running_variables.json``. Relative to the working directory,
+            like the rest of the workflow configuration.
+    """
+
+    def __init__(self, path: str = RUNNING_VARIABLES):
+        super().__init__(path)
+
+    def primed_solvents(self) -> dict:
+        """Return ``{pump line key: solvent or None}``."""
+        variables = self.load()
+        return {line: variables.get(line) for line in PUMP_LINES}
+
+    def line_for(self, chemical: str) -> str:
+        """Return the pump line key holding ``chemical``, or None."""
+        for line, solvent in self.primed_solvents().items():
+            if solvent == chemical:
+                return line
+        return None
+
+    def mark_primed(self, chemical: str, line: str = None) -> str:
+        """
+        Record that ``chemical`` is now in a pump line.
+
+        Args:
+            chemical (str): The solvent that was primed.
+            line (str): The pump line key. If None, the line is unknown and every line is
+                set to None, since any of them may now hold ``chemical``.
+
+        Returns:
+            str: The pump line key that was updated, or None if the line is unknown.
+        """
+        if line is None:
+            self.forget()
+        else:
+            self.update(**{line: chemical})
+        return line
+
+    def forget(self) -> None:
+        """Record that the contents of every pump line are unknown."""
+        self.update(**{line: None for line in PUMP_LINES})
+
+
+def prime_if_needed(station, chemical: str, state: PumpLineState = None) -> bool:
+    """
+    Prime the dispense tubing with ``chemical`` unless a line is known to hold it.
+
+    Args:
+        station (RobInHood): The RobInHood station object.
+        chemical (str): The solvent about to be dispensed.
+        state (PumpLineState): The line state. Defaults to ``conf/running_variables.json``.
+
+    Returns:
+        bool: True if the tubing was primed.
+    """
+    state = state if state is not None else PumpLineState()
+    line = state.line_for(chemical)
+    if line is not None:
+        station._logger.info(f"{chemical} already primed in {line}, skipping prime")
+        return False
+
+    station.pump_prime_dispense_tubing(chemical)
+    # Keep the line RobInHood recorded, if it updated running_variables.json itself
+    state.mark_primed(chemical, state.line_for(chemical))
+    return True
+
+
+def record_line_use(chemical: str, state: PumpLineState = None) -> None:
+    """
+    Record that a station routine (filter prep, cleaning, ...) ran ``chemical`` through a pump line.
+
+    A line already holding ``chemical`` keeps it; otherwise the routine may have primed either
+    line, and both are set to None.
+
+    Args:
+        chemical (str): The solvent the routine used.
+        state (PumpLineState): The line state. Defaults to ``conf/running_variables.json``.
+    """
+    state = state if state is not None else PumpLineState()
+    if state.line_for(chemical) is None:
+        state.mark_primed(chemical)
+
+
+def order_by_solvent(dispenses: list, solvent_of, primed: dict = None) -> list:
+    """
+    Reorder independent dispenses so each solvent is primed at most once.
+
+    Dispenses are grouped by solvent, keeping their relative order inside a
+    group; solvents already in a line go first.
+
+    Args:
+        dispenses (list): The dispenses, in any form.
+        solvent_of (callable): Returns the solvent of a dispense.
+        primed (dict): ``{pump line key: solvent}`` at the start.
+
+    Returns:
+        list: The reordered dispenses.
+    """
+    already_primed = set((primed or {}).values())
+    groups = {}
+    for dispense in dispenses:
+        groups.setdefault(solvent_of(dispense), []).append(dispense)
+
+    order = sorted(groups, key=lambda solvent: solvent not in already_primed)
+    return [dispense for solvent in order for dispense in groups[solvent]]
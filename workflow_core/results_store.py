@@ -0,0 +1,273 @@
+"""
+Campaign results store.
+
+Dosed masses, dispensed volumes, step timings and colorimetry predictions of
+every workflow are appended to one SQLite database instead of per-sample text
+files, indexed by campaign, sample, vial, solid and dye. Each row is one
+measured quantity::
+
+    campaign | workflow | sample | vial | solid | dye | chemical | quantity | value | unit | step | started | finished | source
+
+so a cross-campaign question such as "every solid screened with dye4" is a
+single indexed query::
+
+    PYTHONPATH=.. python -m workflow_core.results_store query --dye dye4 --quantity ppm
+
+Rows are buffered and written in batches (one transaction per batch, at the end
+of every journaled step and at exit). The database is ``results.sqlite`` at the
+repository root, shared by all workflows, unless ``WORKFLOW_RESULTS_DB`` names
+another file. The campaign of a results directory is ``WORKFLOW_CAMPAIGN`` if
+set, otherwise the workflow name and start time of its journal run, so a resumed
+run keeps writing to the same campaign.
+"""
+
+import argparse
+import atexit
+import csv
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+from dataclasses import asdict, astuple, dataclass, fields
+from datetime import datetime
+
+RESULTS_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "results.sqlite")
+RESULTS_DB_ENV = "WORKFLOW_RESULTS_DB"
+CAMPAIGN_ENV = "WORKFLOW_CAMPAIGN"
+INDEXED = ("campaign", "sample", "vial", "solid", "dye")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    campaign TEXT NOT NULL,
+    workflow TEXT,
+    sample INTEGER,
+    vial INTEGER,
+    solid TEXT,
+    dye TEXT,
+    chemical TEXT,
+    quantity TEXT NOT NULL,
+    value REAL,
+    unit TEXT,
+    step TEXT,
+    started REAL,
+    finished REAL,
+    source TEXT,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_campaign ON results (campaign, sample);
+CREATE INDEX IF NOT EXISTS results_vial ON results (vial);
+CREATE INDEX IF NOT EXISTS results_solid ON results (solid, quantity);
+CREATE INDEX IF NOT EXISTS results_dye ON results (dye, quantity);
+"""
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+@dataclass
+class Result:
+    """One measured quantity."""
+
+    campaign: str
+    quantity: str
+    value: float = None
+    unit: str = None
+    workflow: str = None
+    sample: int = None
+    vial: int = None
+    solid: str = None
+    dye: str = None
+    chemical: str = None
+    step: str = None
+    started: float = None
+    finished: float = None
+    source: str = None
+    recorded: float = None
+
+
+COLUMNS = [column.name for column in fields(Result)]
+
+
+def campaign_of(results_directory: str) -> tuple:
+    """
+    Return ``(campaign, workflow)`` for a results directory.
+
+    Args:
+        results_directory (str): The run's results directory.
+
+    Returns:
+        tuple: The campaign name and the workflow name (None if unknown).
+    """
+    # The journal records step timings here, so it is imported on use
+    from workflow_core.journal import StepJournal
+
+    run = StepJournal(results_directory).current_run()
+    workflow = (run.get("workflow") or None) if run else None
+    if os.environ.get(CAMPAIGN_ENV):
+        return os.environ[CAMPAIGN_ENV], workflow
+    if run:
+        started = datetime.fromtimestamp(run["time"]).strftime("%Y%m%d_%H%M%S")
+        return f"{workflow or os.path.basename(os.path.abspath(results_directory))}_{started}", workflow
+    return os.path.basename(os.path.abspath(results_directory)), workflow
+
+
+class ResultsStore:
+    """
+    Append results to the SQLite database in batches and query them.
+
+    Args:
+        path (str): The database file.
+        batch_size (int): Buffered rows that trigger a write.
+    """
+
+    def __init__(self, path: str = RESULTS_DB, batch_size: int = 100):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.RLock()
+        with closing(self._connect()) as connection:
+            connection.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # WAL lets the session, the bash step processes and the colorimetry thread append concurrently
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def add(self, result: Result) -> None:
+        """Buffer a result; the buffer is written once it holds ``batch_size`` rows."""
+        if result.recorded is None:
+            result.recorded = time.time()
+        with self._lock:
+            self._pending.append(result)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def record(self, results_directory: str, quantity: str, value=None, unit: str = None, **keys) -> Result:
+        """
+        Buffer a result of the campaign of ``results_directory``.
+
+        Args:
+            results_directory (str): The run's results directory.
+            quantity (str): What was measured, e.g. ``mass``, ``volume``, ``ppm``.
+            value: The measured value.
+            unit (str): Its unit.
+            **keys: The other Result fields (sample, vial, solid, dye, chemical, step, ...).
+
+        Returns:
+            Result: The buffered result.
+        """
+        campaign, workflow = campaign_of(results_directory)
+        result = Result(campaign=campaign, workflow=workflow, quantity=quantity,
+                        value=None if value is None else float(value), unit=unit, **keys)
+        self.add(result)
+        return result
+
+    def flush(self) -> None:
+        """Write the buffered rows in one transaction."""
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [astuple(result) for result in self._pending]
+            with closing(self._connect()) as connection, connection:
+                connection.executemany(f"INSERT INTO results ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+            self._pending = []
+
+    def query(self, **filters) -> list:
+        """
+        Return the stored results matching every given column value, oldest first.
+
+        Pending rows are written first. A filter value of None matches NULL.
+
+        Example:
+            ``store.query(dye="dye4", quantity="ppm")``
+
+        Raises:
+            ValueError: If a filter is not a column of the store.
+        """
+        unknown = set(filters) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown result columns {sorted(unknown)}")
+        self.flush()
+        clauses = [f"{column} IS ?" if value is None else f"{column} = ?" for column, value in filters.items()]
+        sql = f"SELECT {', '.join(COLUMNS)} FROM results"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(sql + " ORDER BY id", list(filters.values())).fetchall()
+        return [Result(*row) for row in rows]
+
+    def import_weights(self, path: str, campaign: str, workflow: str = None) -> int:
+        """
+        Import a legacy ``station.record_weight`` text file (``results.txt<name>``).
+
+        Each line holds ``<sample><solid>``, the mass in g and the timestamp, tab separated.
+
+        Returns:
+            int: The number of imported rows.
+        """
+        count = 0
+        with open(path) as weights_file:
+            next(weights_file, None)
+            for line in weights_file:
+                columns = [column.strip() for column in line.split("\t")]
+                if len(columns) < 3 or not columns[0]:
+                    continue
+                digits = len(columns[0]) - len(columns[0].lstrip("0123456789"))
+                self.add(Result(campaign=campaign, workflow=workflow, quantity="mass", value=float(columns[1]) * 1000, unit="mg",
+                                sample=int(columns[0][:digits]) if digits else None, solid=columns[0][digits:] or None,
+                                chemical=columns[0][digits:] or None, source=os.path.abspath(path),
+                                recorded=datetime.fromisoformat(columns[2]).timestamp()))
+                count += 1
+        self.flush()
+        return count
+
+
+def results_store(path: str = None) -> ResultsStore:
+    """Return the store of this process for ``path`` (``WORKFLOW_RESULTS_DB`` or the repository default)."""
+    path = os.path.abspath(path or os.environ.get(RESULTS_DB_ENV, RESULTS_DB))
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = ResultsStore(path)
+            _stores[path] = store
+            atexit.register(store.flush)
+        return store
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Query or import into the campaign results store")
+    parser.add_argument("--db", default=None, help=f"Database file (default ${RESULTS_DB_ENV} or {RESULTS_DB})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    query = sub.add_parser("query", help="Print matching results as CSV")
+    for column in INDEXED + ("chemical", "quantity", "step", "workflow"):
+        query.add_argument(f"--{column}", type=int if column in ("sample", "vial") else str)
+
+    legacy = sub.add_parser("import", help="Import legacy record_weight text files")
+    legacy.add_argument("files", nargs="+")
+    legacy.add_argument("--campaign", help="Campaign name (default: the name of each file's directory)")
+    legacy.add_argument("--workflow")
+
+    args = parser.parse_args(argv)
+    store = results_store(args.db)
+
+    if args.command == "query":
+        filters = {column: getattr(args, column) for column in INDEXED + ("chemical", "quantity", "step", "workflow")
+                   if getattr(args, column) is not None}
+        writer = csv.DictWriter(sys.stdout, fieldnames=COLUMNS)
+        writer.writeheader()
+        for result in store.query(**filters):
+            writer.writerow(asdict(result))
+
+    elif args.command == "import":
+        for path in args.files:
+            campaign = args.campaign or os.path.basename(os.path.dirname(os.path.abspath(path)))
+            print(f"[INFO] {path}: {store.import_weights(path, campaign, args.workflow)} rows imported into {campaign}")
+
+
+if __name__ == "__main__":
+    main()
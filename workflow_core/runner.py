@@ -0,0 +1,406 @@
+"""
+In-process declarative workflow runner.
+
+A workflow definition (JSON, or YAML when PyYAML is installed) names the step
+script, the variables of the run and the ordered list of steps. Every step is
+expanded and type-checked against the signature of the step function before
+anything moves, then all steps run in one process against one station.
+
+Example definition::
+
+    {
+        "name": "phthalimide_synthesis",
+        "module": "src/synthesis.py",
+        "results_directory": "data",
+        "variables": {"samples": [0, 1, 2], "temperature": 110, "speed": 400},
+        "steps": [
+            {"step": "prepare_single_sample", "for_each": "samples", "args": {"sample_number": "$item"}},
+            {"step": "heat_stirr", "args": {"temperature": "$temperature", "speed": "$speed"}},
+            {"step": "store_samples_from_hotplate", "for_each": "samples", "reverse": true,
+             "args": {"sample_number": "$item"}}
+        ]
+    }
+
+Values of the form ``$name`` are replaced by the variable ``name``; inside a
+``for_each`` step ``$item`` is the current element and ``$item[i]`` indexes it
+(e.g. the ``[sample, filtrate]`` pairs of the porosity screen). An entry with
+its own ``steps`` list is a block: its nested steps run in order once per
+element of the block's ``for_each``. Relative paths are resolved against the
+working directory, as in the bash drivers. An optional ``"location"`` names
+where the step leaves the vial of its ``for_each`` sample (e.g. ``"hotplate"``)
+and an optional ``"intervention"`` what the operator has to do before the step
+can run (e.g. ``"Load the filter cartridges"``); it is logged when the step is
+reached and reported by the dry-run estimate. The optional ``"uses"`` and
+``"holds"`` lists name the station devices a step drives and the devices the
+run keeps from that step on (e.g. the IKA while vials react on it); they let
+``workflow_core.dispatcher`` interleave the steps of several runs. A step or
+block with ``"when": "$flag"`` is only planned if the variable is true, one
+with ``"unless": "$flag"`` only if it is false, so a definition can keep an
+alternative protocol behind a variable.
+
+Completed steps are journaled in ``journal.jsonl`` in the results directory;
+``--resume`` skips the steps the last run completed. ``--dry-run`` estimates
+the makespan on the simulated station instead of running, see
+``workflow_core.estimate``.
+
+Run from inside a workflow directory:
+
+    PYTHONPATH=.. python -m workflow_core.runner conf/synthesis_workflow.json
+"""
+
+import argparse
+import functools
+import inspect
+import json
+import os
+import re
+import sys
+import typing
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from workflow_core.hotplate_slots import HotplateSlots
+from workflow_core.journal import StepJournal
+from workflow_core.journal import main as journal_main
+from workflow_core.state_monitor import RobotStateMonitor, station_robot
+from workflow_core.station import get_station, load_step_module
+from workflow_core.tracing import context, sample_of
+
+_REFERENCE = re.compile(r"^\$(\w+)(?:\[(-?\d+)\])?$")
+
+
+class WorkflowDefinitionError(ValueError):
+    """Raised when a workflow definition is malformed or fails validation."""
+
+
+@dataclass
+class PlannedStep:
+    """A single fully-resolved call of a step function."""
+
+    index: int
+    name: str
+    function: typing.Callable
+    kwargs: dict
+    item: typing.Any = None
+    description: str = field(default="")
+    location: str = None
+    intervention: str = None
+    uses: tuple = None
+    holds: tuple = ()
+
+    def __str__(self) -> str:
+        args = ", ".join(f"{key}={value!r}" for key, value in self.kwargs.items())
+        return f"[{self.index}] {self.name}({args})"
+
+
+def load_definition(path: str) -> dict:
+    """
+    Read a workflow definition from a JSON or YAML file.
+
+    Args:
+        path (str): Path to the definition file.
+
+    Returns:
+        dict: The parsed definition.
+    """
+    with open(path) as definition_file:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError as error:
+                raise WorkflowDefinitionError("PyYAML is required to read YAML workflow definitions") from error
+            definition = yaml.safe_load(definition_file)
+        else:
+            definition = json.load(definition_file)
+
+    for key in ("module", "steps"):
+        if key not in definition:
+            raise WorkflowDefinitionError(f"{path}: missing required key {key!r}")
+    return definition
+
+
+def resolve_value(value, variables: dict, item=None):
+    """
+    Substitute ``$variable`` / ``$item`` references in a step argument.
+
+    Args:
+        value: The raw value from the definition.
+        variables (dict): The workflow variables.
+        item: The current ``for_each`` element, if any.
+
+    Returns:
+        The resolved value.
+    """
+    if isinstance(value, list):
+        return [resolve_value(element, variables, item) for element in value]
+    if isinstance(value, dict):
+        return {key: resolve_value(element, variables, item) for key, element in value.items()}
+    if not isinstance(value, str):
+        return value
+
+    match = _REFERENCE.match(value)
+    if match is None:
+        return value
+
+    name, index = match.groups()
+    if name == "item":
+        if item is None:
+            raise WorkflowDefinitionError(f"{value!r} used outside of a for_each step")
+        resolved = item
+    elif name in variables:
+        resolved = variables[name]
+    else:
+        raise WorkflowDefinitionError(f"Unknown variable {value!r}")
+
+    if index is not None:
+        try:
+            resolved = resolved[int(index)]
+        except (IndexError, KeyError, TypeError) as error:
+            raise WorkflowDefinitionError(f"Cannot index {resolved!r} with {value!r}") from error
+    return resolved
+
+
+def _check_type(value, annotation):
+    """Return ``value`` converted to ``annotation`` or raise TypeError."""
+    if annotation is inspect.Parameter.empty or annotation is typing.Any:
+        return value
+
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        for option in typing.get_args(annotation):
+            try:
+                return _check_type(value, option)
+            except TypeError:
+                continue
+        raise TypeError(f"expected {annotation}, got {type(value).__name__} {value!r}")
+
+    if annotation is type(None):
+        if value is None:
+            return value
+    elif annotation is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    elif annotation is int:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+    elif isinstance(annotation, type):
+        if isinstance(value, annotation):
+            return value
+    else:
+        return value
+
+    raise TypeError(f"expected {getattr(annotation, '__name__', annotation)}, got {type(value).__name__} {value!r}")
+
+
+def validate_call(function, kwargs: dict) -> dict:
+    """
+    Check a step call against the step signature and convert numeric arguments.
+
+    Args:
+        function (callable): The step function.
+        kwargs (dict): The resolved keyword arguments.
+
+    Returns:
+        dict: The validated keyword arguments.
+
+    Raises:
+        WorkflowDefinitionError: If arguments are missing, unknown or of the wrong type.
+    """
+    signature = inspect.signature(function)
+    try:
+        signature.bind(**kwargs)
+    except TypeError as error:
+        raise WorkflowDefinitionError(f"{function.__name__}: {error}") from error
+
+    validated = {}
+    for name, value in kwargs.items():
+        try:
+            validated[name] = _check_type(value, signature.parameters[name].annotation)
+        except TypeError as error:
+            raise WorkflowDefinitionError(f"{function.__name__}: argument {name!r} {error}") from error
+    return validated
+
+
+def _items(entry: dict, variables: dict, item) -> list:
+    """Return the elements a ``for_each`` entry iterates over."""
+    if "for_each" not in entry:
+        return [item]
+    items = entry["for_each"]
+    if isinstance(items, str):
+        items = resolve_value(f"${items}", variables, item)
+    return list(reversed(items)) if entry.get("reverse", False) else list(items)
+
+
+def _enabled(entry: dict, variables: dict, item) -> bool:
+    """Return False if the entry's ``when`` variable is false or its ``unless`` variable is true."""
+    if "when" in entry and not resolve_value(entry["when"], variables, item):
+        return False
+    return not ("unless" in entry and resolve_value(entry["unless"], variables, item))
+
+
+def _expand(entries: list, module, variables: dict, results_directory: str, planned: list, errors: list,
+            item=None, location: str = "steps") -> None:
+    """Append the PlannedStep objects for ``entries`` to ``planned``, collecting errors."""
+    for position, entry in enumerate(entries):
+        where = f"{location}[{position}]"
+
+        try:
+            if not _enabled(entry, variables, item):
+                continue
+        except WorkflowDefinitionError as error:
+            errors.append(f"{where}: {error}")
+            continue
+
+        if "steps" in entry:
+            # A block: run its nested steps once per element, in order.
+            for element in _items(entry, variables, item):
+                _expand(entry["steps"], module, variables, results_directory, planned, errors,
+                        item=element, location=f"{where}.steps")
+            continue
+
+        name = entry.get("step")
+        function = getattr(module, name, None) if name else None
+        if function is None or not callable(function):
+            errors.append(f"{where}: {module.__file__} has no step {name!r}")
+            continue
+
+        parameters = inspect.signature(function).parameters
+        for element in _items(entry, variables, item):
+            try:
+                kwargs = resolve_value(entry.get("args", {}), variables, element)
+                if "results_directory" in parameters and "results_directory" not in kwargs:
+                    kwargs["results_directory"] = results_directory
+                kwargs = validate_call(function, kwargs)
+            except WorkflowDefinitionError as error:
+                errors.append(f"{where}: {error}" if element is None else f"{where} (item {element!r}): {error}")
+                continue
+            planned.append(PlannedStep(index=len(planned), name=name, function=function, kwargs=kwargs,
+                                       item=element, description=entry.get("description", ""),
+                                       location=entry.get("location"), intervention=entry.get("intervention"),
+                                       uses=None if entry.get("uses") is None else tuple(entry["uses"]),
+                                       holds=tuple(entry.get("holds", ()))))
+
+
+def plan_workflow(definition: dict) -> list:
+    """
+    Expand and validate every step of a workflow definition.
+
+    All errors are collected so that a broken definition is reported in one go,
+    before any hardware is touched.
+
+    Args:
+        definition (dict): A parsed workflow definition.
+
+    Returns:
+        list: The ordered list of PlannedStep objects.
+    """
+    module = load_step_module(definition["module"])
+    variables = dict(definition.get("variables", {}))
+    results_directory = os.path.abspath(definition.get("results_directory", "data"))
+
+    planned = []
+    errors = []
+    _expand(definition["steps"], module, variables, results_directory, planned, errors)
+
+    if errors:
+        raise WorkflowDefinitionError("Invalid workflow definition:\n  " + "\n  ".join(errors))
+    return planned
+
+
+def run_workflow(steps: list, station=None, results_directory: str = None,
+                 logname: str = datetime.now().strftime("%d_%m_%Y"), state_monitor=None,
+                 journal: StepJournal = None) -> list:
+    """
+    Run planned steps in order against a single station.
+
+    Args:
+        steps (list): PlannedStep objects from ``plan_workflow``.
+        station (RobInHood): The station to use. Built once if None.
+        results_directory (str): The directory to save the results.
+        logname (str): The name of the log file. Defaults to current date.
+        state_monitor (RobotStateMonitor): If given, the robot state is read and logged before
+            every step, between motions, replacing the ``read_robot_state`` calls of the bash drivers.
+            The station's robot connection is used when it can be read.
+        journal (StepJournal): If given, every completed step is appended to it and steps
+            already completed in the journal's current run are skipped.
+
+    Returns:
+        list: The return value of every step.
+    """
+    station = get_station(station, logname, results_directory)
+    if state_monitor is not None and state_monitor.robot is None:
+        state_monitor.robot = station_robot(station)
+
+    results = []
+    for step in steps:
+        if step.description:
+            station._logger.info(f"[runner] {step.description}")
+        if step.intervention:
+            station._logger.warning(f"[runner] Operator needed: {step.intervention}")
+        station._logger.info(f"[runner] Step {step}")
+        if state_monitor is not None:
+            try:
+                sample = state_monitor.read()
+            except Exception as error:
+                station._logger.warning(f"[runner] Could not read the robot state ({error!r})")
+                if state_monitor.robot is None:
+                    # No connection could be opened, do not retry before every step
+                    state_monitor = None
+            else:
+                station._logger.info(f"[runner] Robot pose: {sample.pose} joints: {sample.joints}")
+        call = step.function
+        if "station" in inspect.signature(step.function).parameters:
+            call = functools.partial(step.function, station=station)
+            functools.update_wrapper(call, step.function)
+        with context(step=step.name, sample=sample_of(step.kwargs, step.item)):
+            if journal is None:
+                results.append(call(**step.kwargs))
+            else:
+                results.append(journal.run_once(call, step.kwargs, sample=step.item, location=step.location,
+                                                logger=station._logger))
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run a RobInHood workflow definition in one process")
+    parser.add_argument("definition", help="Path to a JSON/YAML workflow definition")
+    parser.add_argument("--validate-only", action="store_true", help="Expand and check the steps without running them")
+    parser.add_argument("--no-state-monitor", action="store_true", help="Do not read the robot state before every step")
+    parser.add_argument("--resume", action="store_true", help="Skip the steps completed by the last run of this definition")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Estimate the makespan from past timings on the simulated station, without touching hardware")
+    args = parser.parse_args(argv)
+
+    definition = load_definition(args.definition)
+    if args.dry_run:
+        from workflow_core.estimate import main as estimate_main
+        estimate_main([args.definition])
+        return
+    try:
+        steps = plan_workflow(definition)
+    except WorkflowDefinitionError as error:
+        sys.exit(f"[ERROR] {error}")
+
+    print(f"[INFO] {definition.get('name', args.definition)}: {len(steps)} steps validated")
+    if args.validate_only:
+        for step in steps:
+            print(f"[INFO] {step}")
+        return
+
+    results_directory = os.path.abspath(definition.get("results_directory", "data"))
+    os.makedirs(results_directory, exist_ok=True)
+    journal_main(["resume" if args.resume else "start", results_directory, "--name", definition.get("name", "")])
+    if not args.resume:
+        # A new run starts with an empty hotplate
+        HotplateSlots(results_directory).reset()
+    journal = StepJournal(results_directory)
+
+    state_monitor = None if args.no_state_monitor else RobotStateMonitor()
+    run_workflow(steps, results_directory=results_directory, state_monitor=state_monitor, journal=journal)
+    print("[INFO] Workflow complete")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Access to a workflow's ``conf/running_variables.json``.
+
+The file holds the live device state that RobInHood and the workflows share
+(primed pump solvents, loaded Quantos cartridge, ...). It is re-read on every
+access so updates made by RobInHood itself are seen, and written atomically.
+"""
+
+import json
+import os
+import threading
+
+RUNNING_VARIABLES = os.path.join("conf", "running_variables.json")
+
+_lock = threading.RLock()
+
+
+class RunningVariables:
+    """
+    Read and update ``running_variables.json``.
+
+    Args:
+        path (str): Path to the file. Relative to the working directory, like the rest
+            of the workflow configuration.
+    """
+
+    def __init__(self, path: str = RUNNING_VARIABLES):
+        self.path = path
+
+    def load(self) -> dict:
+        """Return the current contents, or an empty dict if the file does not exist."""
+        with _lock:
+            if not os.path.exists(self.path):
+                return {}
+            with open(self.path) as variables_file:
+                return json.load(variables_file)
+
+    def save(self, variables: dict) -> None:
+        """Replace the contents of the file."""
+        with _lock:
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as variables_file:
+                json.dump(variables, variables_file, indent=4)
+            os.replace(temporary, self.path)
+
+    def get(self, key: str, default=None):
+        return self.load().get(key, default)
+
+    def update(self, **values) -> dict:
+        """Set ``values`` and return the new contents."""
+        with _lock:
+            variables = self.load()
+            variables.update(values)
+            self.save(variables)
+            return variables
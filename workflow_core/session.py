@@ -0,0 +1,344 @@
+"""
+Long-lived station session.
+
+A session process owns a single RobInHood instance and executes workflow
+steps sent to it over a local socket, so the bash drivers no longer pay for
+interpreter start-up, config loading and device reconnection on every step.
+
+Start a session from inside a workflow directory (so RobInHood finds the same
+configuration files the step scripts would):
+
+    export ROBINHOOD_SESSION_KEY=<secret>
+    PYTHONPATH=.. python -m workflow_core.session serve data
+
+Every connection is served in its own thread, so a long step (e.g. waiting
+for an 18 h reaction timer) does not block other clients. Each step waits for
+the devices it declares to ``get_station`` (see ``SharedStation``), so steps
+on different devices run side by side and steps on the same device one after
+the other. Clients authenticate with the key in ``ROBINHOOD_SESSION_KEY``.
+
+The step scripts forward their command to the session when one is running and
+fall back to running in-process otherwise, see ``run_step``. The client side
+only needs this module: the session modules and the multiprocessing machinery
+are imported when they are used.
+"""
+
+import functools
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from datetime import datetime
+
+DEFAULT_ADDRESS = os.environ.get("ROBINHOOD_SESSION", os.path.join(tempfile.gettempdir(), "robinhood_session.sock"))
+AUTHKEY_ENV = "ROBINHOOD_SESSION_KEY"
+
+
+def _authkey() -> bytes:
+    """Return the session key from ``ROBINHOOD_SESSION_KEY``, or None if it is not set."""
+    key = os.environ.get(AUTHKEY_ENV)
+    return key.encode() if key else None
+
+
+class StepFailed(RuntimeError):
+    """Raised on the client side when a step failed inside the session."""
+
+
+class StationSession:
+    """
+    Serve workflow steps against one persistent station.
+
+    Args:
+        results_directory (str): The directory to save the results.
+        logname (str): The name of the log file. Defaults to current date.
+        address (str): The socket path to listen on.
+        station (RobInHood): An already constructed station, mainly for testing. Built on start-up if None.
+        state_monitor (RobotStateMonitor): Monitor answering ``robot_state`` requests. If None and
+            ``monitor_state`` is True, one reading through the station's robot while no step holds
+            the arm is started on start-up.
+        monitor_state (bool): Whether to sample the robot state in the background.
+    """
+
+    def __init__(self, results_directory: str, logname: str = datetime.now().strftime("%d_%m_%Y"),
+                 address: str = DEFAULT_ADDRESS, station=None, state_monitor=None, monitor_state: bool = True):
+        self.results_directory = results_directory
+        self.logname = logname
+        self.address = address
+        self.station = station
+        self.shared = None
+        self.state_monitor = state_monitor
+        self.monitor_state = monitor_state
+        self._running = False
+        self._threads = []
+
+    def handle(self, request: dict) -> dict:
+        """
+        Execute a single request and build the reply.
+
+        Args:
+            request (dict): One of ``{"command": "ping"}``, ``{"command": "shutdown"}``,
+                ``{"command": "robot_state", "max_age": seconds}`` or
+                ``{"command": "step", "module": path, "step": name, "kwargs": {...}}``.
+
+        Returns:
+            dict: ``{"ok": True, "result": ...}`` or ``{"ok": False, "error": ..., "traceback": ...}``.
+        """
+        import inspect
+
+        from workflow_core.station import load_step_module
+        from workflow_core.tracing import context, sample_of
+
+        command = request.get("command")
+
+        if command == "ping":
+            return {"ok": True, "result": os.getpid()}
+
+        if command == "shutdown":
+            self._running = False
+            self._wake()
+            return {"ok": True, "result": None}
+
+        if command == "robot_state":
+            if self.state_monitor is None:
+                return {"ok": False, "error": "No robot state monitor running", "traceback": ""}
+            # Samples pause while a step holds the arm, so fall back to the last one taken before it
+            sample = self.state_monitor.latest(max_age=request.get("max_age")) or self.state_monitor.latest(timeout=0)
+            if sample is None:
+                return {"ok": False, "error": f"No robot state sample available ({self.state_monitor.last_error!r})", "traceback": ""}
+            return {"ok": True, "result": sample.as_dict()}
+
+        if command != "step":
+            return {"ok": False, "error": f"Unknown command {command!r}", "traceback": ""}
+
+        try:
+            module = load_step_module(request["module"])
+            step = getattr(module, request["step"])
+            kwargs = dict(request.get("kwargs", {}))
+            if "station" in inspect.signature(step).parameters:
+                kwargs["station"] = self.shared
+            self.station._logger.info(f"[session] Running {request['step']} with {request.get('kwargs', {})}")
+            with context(step=request["step"], sample=sample_of(kwargs)):
+                result = step(**kwargs)
+            return {"ok": True, "result": result}
+        except Exception as error:
+            return {"ok": False, "error": repr(error), "traceback": traceback.format_exc()}
+        finally:
+            self.shared.release()
+
+    def _serve_connection(self, connection) -> None:
+        with connection:
+            try:
+                request = connection.recv()
+            except EOFError:
+                return
+            reply = self.handle(request)
+            try:
+                connection.send(reply)
+            except OSError as error:
+                self.station._logger.warning(f"[session] Could not reply to {request.get('command')}: {error!r}")
+
+    def _wake(self) -> None:
+        """Unblock the accept loop, which then sees that the session is shutting down."""
+        from multiprocessing.connection import Client
+
+        try:
+            Client(self.address, family="AF_UNIX", authkey=_authkey()).close()
+        except OSError:
+            pass
+
+    def serve_forever(self) -> None:
+        """Create the station and answer requests until a shutdown command arrives."""
+        from multiprocessing import AuthenticationError
+        from multiprocessing.connection import Listener
+
+        from workflow_core.state_monitor import RobotStateMonitor, station_robot
+        from workflow_core.station import SharedStation, get_station
+
+        if _authkey() is None:
+            raise RuntimeError(f"Set {AUTHKEY_ENV} to the key the clients of the session use")
+
+        self.station = get_station(self.station, self.logname, self.results_directory)
+        self.shared = SharedStation(self.station)
+
+        if self.state_monitor is None and self.monitor_state:
+            self.state_monitor = RobotStateMonitor(robot=station_robot(self.station), gate=self.shared.device_lock("arm"))
+        if self.state_monitor is not None:
+            try:
+                self.state_monitor.start()
+            except Exception as error:
+                self.station._logger.warning(f"[session] Robot state monitor unavailable: {error!r}")
+                self.state_monitor = None
+
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        self._running = True
+        with Listener(self.address, family="AF_UNIX", authkey=_authkey()) as listener:
+            self.station._logger.info(f"[session] Station session listening on {self.address}")
+            while self._running:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as error:
+                    # A wrong key, or a client that hung up during the handshake (e.g. a probe without a key)
+                    self.station._logger.warning(f"[session] Rejected a client: {error!r}")
+                    continue
+                if not self._running:
+                    connection.close()
+                    break
+                thread = threading.Thread(target=self._serve_connection, args=(connection,), name="session-request", daemon=True)
+                thread.start()
+                self._threads = [running for running in self._threads if running.is_alive()] + [thread]
+
+        # Steps still running finish before the station goes away
+        for thread in self._threads:
+            thread.join()
+        if self.state_monitor is not None:
+            self.state_monitor.stop()
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+
+def _request(request: dict, address: str = DEFAULT_ADDRESS):
+    from multiprocessing.connection import Client
+
+    with Client(address, family="AF_UNIX", authkey=_authkey()) as connection:
+        connection.send(request)
+        return connection.recv()
+
+
+def _listening(address: str) -> bool:
+    """Return True if something accepts connections on the socket ``address``."""
+    import socket
+
+    with socket.socket(socket.AF_UNIX) as probe:
+        try:
+            probe.connect(address)
+        except OSError:
+            return False
+    return True
+
+
+def session_available(address: str = DEFAULT_ADDRESS) -> bool:
+    """
+    Return True if a station session answers on ``address``.
+
+    Raises:
+        StepFailed: If a session is listening but the key in ``ROBINHOOD_SESSION_KEY`` is missing
+            or wrong, rather than running the step next to the session with a second station.
+    """
+    if not os.path.exists(address):
+        return False
+    if _authkey() is None:
+        if _listening(address):
+            raise StepFailed(f"A station session is running on {address}, set {AUTHKEY_ENV} to its key")
+        return False
+
+    from multiprocessing import AuthenticationError
+
+    try:
+        return _request({"command": "ping"}, address)["ok"]
+    except AuthenticationError as error:
+        raise StepFailed(f"The station session on {address} rejected the key in {AUTHKEY_ENV}") from error
+    except (ConnectionRefusedError, FileNotFoundError, EOFError, OSError):
+        return False
+
+
+def request_robot_state(address: str = DEFAULT_ADDRESS, max_age: float = None) -> dict:
+    """
+    Ask the station session for the latest cached robot state.
+
+    Args:
+        address (str): The socket path of the session.
+        max_age (float): Wait for a sample no older than this many seconds. The last sample is
+            returned if none arrives, e.g. while a step holds the arm.
+
+    Returns:
+        dict: ``{"timestamp": ..., "pose": ..., "joints": [...]}``.
+    """
+    reply = _request({"command": "robot_state", "max_age": max_age}, address)
+    if not reply["ok"]:
+        raise StepFailed(reply["error"])
+    return reply["result"]
+
+
+def _dispatch(step, address: str, **kwargs):
+    if not session_available(address):
+        from workflow_core.tracing import context, sample_of
+
+        with context(step=step.__name__, sample=sample_of(kwargs)):
+            return step(**kwargs)
+
+    reply = _request({"command": "step", "module": step.__code__.co_filename, "step": step.__name__, "kwargs": kwargs}, address)
+    if not reply["ok"]:
+        print(reply["traceback"], file=sys.stderr)
+        raise StepFailed(f"{step.__name__} failed in the station session: {reply['error']}")
+    return reply["result"]
+
+
+def run_step(step, address: str = DEFAULT_ADDRESS, location: str = None, **kwargs):
+    """
+    Run a workflow step in the station session if one is running, otherwise in-process.
+
+    When ``WORKFLOW_JOURNAL`` is set the call goes through the step journal, so a
+    resumed bash driver skips the steps that already completed and knows where
+    the moved vials are.
+
+    Args:
+        step (callable): A module-level step function from one of the workflow scripts.
+        address (str): The socket path of the session.
+        location (str): Where the step leaves the vial of its sample (e.g. ``"hotplate"``),
+            like the ``"location"`` of a runner definition.
+        **kwargs: Keyword arguments for the step.
+
+    Returns:
+        The value returned by the step.
+    """
+    from workflow_core.journal import active_journal
+
+    journal = active_journal()
+    if journal is None:
+        return _dispatch(step, address, **kwargs)
+
+    call = functools.update_wrapper(functools.partial(_dispatch, step, address), step)
+    return journal.run_once(call, kwargs, sample=kwargs.get("sample_number", kwargs.get("vial_pos")), location=location)
+
+
+def main(argv=None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="RobInHood station session")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="Start a session owning one RobInHood instance")
+    serve.add_argument("results_directory")
+    serve.add_argument("--logname", default=datetime.now().strftime("%d_%m_%Y"))
+    serve.add_argument("--no-state-monitor", action="store_true", help="Do not sample the robot state in the background")
+
+    wait = sub.add_parser("wait", help="Block until a session answers")
+    wait.add_argument("--timeout", type=float, default=300)
+
+    sub.add_parser("stop", help="Shut a running session down")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        StationSession(args.results_directory, logname=args.logname, address=args.address,
+                       monitor_state=not args.no_state_monitor).serve_forever()
+
+    elif args.command == "wait":
+        deadline = time.monotonic() + args.timeout
+        while not session_available(args.address):
+            if time.monotonic() > deadline:
+                sys.exit(f"[ERROR] No station session on {args.address} after {args.timeout} s")
+            time.sleep(0.5)
+
+    elif args.command == "stop":
+        if session_available(args.address):
+            _request({"command": "shutdown"}, args.address)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+"""
+Simulated RobInHood station for offline benchmarking.
+
+``SimulatedStation`` exposes the station methods the workflow scripts call
+(vial transfers, Quantos dosing, pump priming and dispensing, filtration,
+capping, the IKA hotplate and the lightbox) without any hardware. Every
+operation occupies one or more devices for a latency drawn from a configurable
+distribution, so concurrent steps (e.g. ``prepare_samples_pipelined``) contend
+for the arm like they do on the real station, and the busy time of every
+device is recorded for utilisation reports.
+
+Simulated time runs ``speedup`` times faster than the wall clock
+(``SimulatedClock``). ``simulated_time`` points the timers, the hotplate
+controller and the pipeline scheduler at the simulated clock, so an 18 h
+reaction timer takes seconds while the makespan is still reported in
+simulated seconds.
+
+Failures can be injected per operation, either with a probability or on given
+call numbers::
+
+    SimulatedStation(failures={"quantos_dosing": 0.05, "dispense_volume": [3]})
+"""
+
+import glob
+import logging
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+import types
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from workflow_core import dispatcher, hotplate, hotplate_slots, pipeline, timers
+
+AMBIENT_TEMPERATURE = 25.0
+COLORIMETRY_DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Colorimetry_workflow", "dataset")
+
+
+class SimulatedFailure(RuntimeError):
+    """Raised by an operation selected for failure injection."""
+
+
+@dataclass
+class Latency:
+    """
+    Normal latency distribution, truncated at ``minimum``.
+
+    Args:
+        mean (float): Mean duration in seconds.
+        sd (float): Standard deviation in seconds.
+        per_unit (float): Extra seconds per unit of the operation's amount (e.g. per uL dispensed).
+        minimum (float): Lower bound of a sampled duration.
+    """
+
+    mean: float
+    sd: float = 0.0
+    per_unit: float = 0.0
+    minimum: float = 0.0
+
+    def sample(self, rng: random.Random, amount: float = 0.0) -> float:
+        return max(self.minimum, rng.gauss(self.mean, self.sd) + self.per_unit * amount)
+
+
+# (devices occupied, latency) per operation. Durations are rough figures from logged runs.
+OPERATIONS = {
+    "vial_rack_to_quantos": (("arm",), Latency(45, 5)),
+    "vial_quantos_to_rack": (("arm",), Latency(45, 5)),
+    "vial_quantos_to_pump": (("arm",), Latency(40, 5)),
+    "vial_rack_to_pump": (("arm",), Latency(40, 5)),
+    "vial_pump_to_rack": (("arm",), Latency(40, 5)),
+    "vial_pump_to_capper": (("arm",), Latency(30, 4)),
+    "vial_capper_to_pump": (("arm",), Latency(30, 4)),
+    "vial_capper_to_rack": (("arm",), Latency(35, 4)),
+    "vial_rack_to_ika": (("arm",), Latency(40, 5)),
+    "vial_ika_to_rack": (("arm",), Latency(40, 5)),
+    "vial_pump_to_lightbox": (("arm",), Latency(35, 4)),
+    "vial_lightbox_to_pump": (("arm",), Latency(35, 4)),
+    "open_gripper_set_width": (("arm",), Latency(1, 0.2)),
+    "quantos_dosing": (("quantos",), Latency(120, 40, minimum=30)),
+    "quantos_cartridge_handling_logic": (("arm", "quantos"), Latency(150, 20)),
+    "close_front_door": (("quantos",), Latency(5, 1)),
+    "pump_prime_dispense_tubing": (("pump",), Latency(120, 10)),
+    "dispense_volume": (("pump",), Latency(10, 2, per_unit=0.01)),
+    "hold_position": (("pump",), Latency(2, 0.5)),
+    "infuse_position": (("pump",), Latency(2, 0.5)),
+    "cap": (("capper",), Latency(25, 3)),
+    "vial_decap": (("arm", "capper"), Latency(25, 3)),
+    "filtration_prep": (("arm", "pump", "filter"), Latency(90, 10, per_unit=0.005)),
+    "filter_sample_collect_filtrate": (("arm", "pump", "filter"), Latency(300, 30, per_unit=0.01)),
+    "just_filter_sample_disgard_filtrate": (("arm", "filter"), Latency(180, 20, per_unit=0.01)),
+    "filter_cleaning_packdown": (("arm", "pump", "filter"), Latency(120, 15, per_unit=0.005)),
+    "open_lightbox": (("lightbox",), Latency(5, 1)),
+    "close_lightbox": (("lightbox",), Latency(5, 1)),
+    "light_on": (("lightbox",), Latency(1, 0.1)),
+    "light_off": (("lightbox",), Latency(1, 0.1)),
+    "save_picture_from_lightbox": (("lightbox",), Latency(3, 0.5)),
+    "ika_command": (("ika",), Latency(1, 0.1)),
+    "get_temperature": (("ika",), Latency(0.5, 0.1)),
+}
+
+
+class SimulatedClock:
+    """
+    Clock running ``speedup`` times faster than the wall clock.
+
+    Provides the ``time``/``monotonic``/``sleep`` functions of the ``time`` module,
+    so it can stand in for it; other attributes are taken from ``time``.
+    """
+
+    def __init__(self, speedup: float = 1000.0):
+        self.speedup = speedup
+        self._real_origin = time.monotonic()
+        self._origin = time.time()
+
+    def time(self) -> float:
+        return self._origin + (time.monotonic() - self._real_origin) * self.speedup
+
+    def monotonic(self) -> float:
+        return self.time()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(max(0.0, seconds) / self.speedup)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@contextmanager
+def simulated_time(clock: SimulatedClock):
+    """Run the timers, hotplate controller, hotplate slots, pipeline scheduler and job dispatcher on ``clock``."""
+    modules = (timers, hotplate, hotplate_slots, pipeline, dispatcher)
+    for module in modules:
+        module.time = clock
+    try:
+        yield clock
+    finally:
+        for module in modules:
+            module.time = time
+
+
+class _Device:
+    """Attribute holder for a sub-device (``station.ika``, ``station.quantos``, ...)."""
+
+    def __init__(self, station, device_name: str = None):
+        self._station = station
+        self.device_name = device_name
+
+
+class SimulatedIKA(_Device):
+    """IKA hotplate heating and cooling linearly towards its setpoint."""
+
+    def __init__(self, station, heating_rate: float = 5.0, cooling_rate: float = 2.0):
+        super().__init__(station, "ika")
+        self.heating_rate = heating_rate / 60
+        self.cooling_rate = cooling_rate / 60
+        self.setpoint = AMBIENT_TEMPERATURE
+        self.speed = 0
+        self.regulating = False
+        self.stirring = False
+        self._anchor = (station.clock.time(), AMBIENT_TEMPERATURE)
+
+    def _temperature_at(self, now: float) -> float:
+        started, temperature = self._anchor
+        target = self.setpoint if self.regulating else AMBIENT_TEMPERATURE
+        rate = self.heating_rate if target > temperature else self.cooling_rate
+        step = rate * (now - started)
+        return min(target, temperature + step) if target > temperature else max(target, temperature - step)
+
+    def _reanchor(self) -> None:
+        now = self._station.clock.time()
+        self._anchor = (now, self._temperature_at(now))
+
+    def get_temperature(self, sensor: int = 0) -> float:
+        self._station._operate("get_temperature")
+        return round(self._temperature_at(self._station.clock.time()), 1)
+
+    def set_temperature(self, temperature: float) -> None:
+        self._station._operate("ika_command")
+        self._reanchor()
+        self.setpoint = temperature
+
+    def set_speed(self, speed: int) -> None:
+        self._station._operate("ika_command")
+        self.speed = speed
+
+    def start_temperature_regulation(self) -> None:
+        self._station._operate("ika_command")
+        self._reanchor()
+        self.regulating = True
+
+    def stop_temperature_regulation(self) -> None:
+        self._station._operate("ika_command")
+        self._reanchor()
+        self.regulating = False
+
+    def start_stirring(self) -> None:
+        self._station._operate("ika_command")
+        self.stirring = True
+
+    def stop_stirring(self) -> None:
+        self._station._operate("ika_command")
+        self.stirring = False
+
+    def stop_all_tasks(self) -> None:
+        self.stop_stirring()
+        self.stop_temperature_regulation()
+
+
+class SimulatedQuantos(_Device):
+    def close_front_door(self) -> None:
+        self._station._operate("close_front_door")
+
+
+class SimulatedRobot(_Device):
+    def open_gripper_set_width(self, width: float) -> None:
+        self._station._operate("open_gripper_set_width")
+        self._station.gripper_width = width
+
+
+class SimulatedStation:
+    """
+    Drop-in replacement for ``robinhood.RobInHood`` with simulated latencies.
+
+    Args:
+        sample_dict (dict): The samples, like ``RobInHood.sample_dict``.
+        clock (SimulatedClock): The simulated clock. A new one with ``speedup`` if None.
+        speedup (float): Speed-up of a new clock.
+        latencies (dict): Per-operation ``Latency`` overrides of ``OPERATIONS``.
+        failures (dict): Operation name -> failure probability, or list of 1-based call numbers that fail.
+        seed (int): Seed of the latency and failure draws.
+        image_directory (str): Where lightbox pictures are taken from (``*_DYE<n>.*`` files are matched to
+            the dye number). Defaults to the Colorimetry dataset; None takes no pictures.
+        logger (logging.Logger): Logger of the station.
+        inst_logger (str), data_path (str): Accepted for compatibility with ``RobInHood``.
+    """
+
+    def __init__(self, sample_dict: dict = None, clock: SimulatedClock = None, speedup: float = 1000.0,
+                 latencies: dict = None, failures: dict = None, seed: int = None, image_directory: str = COLORIMETRY_DATASET,
+                 logger: logging.Logger = None, inst_logger: str = None, data_path: str = None):
+        self.sample_dict = sample_dict if sample_dict is not None else {}
+        self.clock = clock if clock is not None else SimulatedClock(speedup)
+        self.latencies = {name: latency for name, (_, latency) in OPERATIONS.items()}
+        self.latencies.update(latencies or {})
+        self.failures = failures or {}
+        self.image_directory = image_directory
+        self._logger = logger if logger is not None else logging.getLogger("simulated_station")
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._devices = {device: threading.Lock() for devices, _ in OPERATIONS.values() for device in devices}
+        self._stats_lock = threading.Lock()
+        self.busy = {device: 0.0 for device in self._devices}
+        self.calls = {}
+        self.operations = []
+
+        self.vial_locations = {}
+        self.gripper_width = None
+        self.loaded_solid = None
+        self.primed = []
+        self.lightbox_open = False
+        self.light = False
+        self.robot = SimulatedRobot(self, "robot")
+        self.quantos = SimulatedQuantos(self, "quantos")
+        self.pump = _Device(self, "pump")
+        self.ika = SimulatedIKA(self)
+
+    def _operate(self, name: str, amount: float = 0.0) -> float:
+        """Occupy the devices of ``name`` for a sampled latency and return the simulated start time."""
+        devices, _ = OPERATIONS[name]
+        with self._stats_lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            call = self.calls[name]
+        with self._rng_lock:
+            duration = self.latencies[name].sample(self._rng, amount)
+            failure = self.failures.get(name)
+            if isinstance(failure, (int, float)) and not isinstance(failure, bool):
+                failed = self._rng.random() < failure
+            else:
+                failed = failure is not None and call in failure
+
+        locks = [self._devices[device] for device in sorted(devices)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            started = self.clock.time()
+            self.clock.sleep(duration)
+            finished = self.clock.time()
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+        with self._stats_lock:
+            for device in devices:
+                self.busy[device] += finished - started
+            self.operations.append((name, devices, started, finished))
+        if failed:
+            raise SimulatedFailure(f"Injected failure of {name} (call {call})")
+        return started
+
+    def _move(self, name: str, vial_number, location: str) -> None:
+        self._operate(name)
+        if vial_number is not None:
+            self.vial_locations[vial_number] = location
+
+    # Vial transfers
+    def vial_rack_to_quantos(self, vial_number=None):
+        self._move("vial_rack_to_quantos", vial_number, "quantos")
+
+    def vial_quantos_to_rack(self, vial_number=None):
+        self._move("vial_quantos_to_rack", vial_number, "rack")
+
+    def vial_quantos_to_pump(self):
+        self._operate("vial_quantos_to_pump")
+
+    def vial_rack_to_pump(self, vial_number=None):
+        self._move("vial_rack_to_pump", vial_number, "pump")
+
+    def vial_pump_to_rack(self, vial_number=None):
+        self._move("vial_pump_to_rack", vial_number, "rack")
+
+    def vial_pump_to_capper(self):
+        self._operate("vial_pump_to_capper")
+
+    def vial_capper_to_pump(self):
+        self._operate("vial_capper_to_pump")
+
+    def vial_capper_to_rack(self, vial_number=None):
+        self._move("vial_capper_to_rack", vial_number, "rack")
+
+    def vial_rack_to_ika(self, vial_number=None, ika_slot_number=None):
+        self._move("vial_rack_to_ika", vial_number, f"hotplate:{ika_slot_number}")
+
+    def vial_ika_to_rack(self, vial_number=None, ika_slot_number=None):
+        self._move("vial_ika_to_rack", vial_number, "rack")
+
+    def vial_pump_to_lightbox(self):
+        self._operate("vial_pump_to_lightbox")
+
+    def vial_lightbox_to_pump(self):
+        self._operate("vial_lightbox_to_pump")
+
+    # Quantos
+    def quantos_cartridge_handling_logic(self, solid_name: str):
+        self._operate("quantos_cartridge_handling_logic")
+        self.loaded_solid = solid_name
+
+    def quantos_dosing(self, quantity: float):
+        self._operate("quantos_dosing")
+        with self._rng_lock:
+            return round(quantity * self._rng.gauss(1.0, 0.02), 2)
+
+    def record_weight(self, sample_name, file_name, weight, file_path):
+        """Append to ``results.txt<sample_name>`` like RobInHood does."""
+        path = os.path.join(file_path, f"results.txt{sample_name}")
+        new_file = not os.path.exists(path)
+        with open(path, "a") as weights_file:
+            if new_file:
+                weights_file.write("Sample Name\t Mass (g):\t Time: \n")
+            weights_file.write(f"{file_name}{sample_name} \t {weight}\t {self.clock.strftime('%Y-%m-%d %H:%M:%S', self.clock.localtime(self.clock.time()))} \n")
+
+    # Pump
+    def pump_prime_dispense_tubing(self, chemical: str):
+        self._operate("pump_prime_dispense_tubing")
+        self.primed = ([chemical] + [primed for primed in self.primed if primed != chemical])[:2]
+
+    def dispense_volume(self, vol: float, chemical: str = None):
+        self._operate("dispense_volume", amount=vol)
+
+    def hold_position(self):
+        self._operate("hold_position")
+
+    def infuse_position(self):
+        self._operate("infuse_position")
+
+    # Capper
+    def cap(self):
+        self._operate("cap")
+
+    def vial_decap(self, vial_number=None):
+        # Takes the vial from the rack and leaves it decapped at the pump
+        self._move("vial_decap", vial_number, "pump")
+
+    # Filtration
+    def filtration_prep(self, cleaning_vial_number, cleaning_solvent, cleaning_solvent_volume):
+        self._operate("filtration_prep", amount=cleaning_solvent_volume)
+
+    def filter_sample_collect_filtrate(self, sample_vial_number, sample_vial_volume, filtrate_vial_number, cleaning_vial_number,
+                                       cleaning_solvent, cleaning_solvent_volume, filter_time=None):
+        self._operate("filter_sample_collect_filtrate", amount=sample_vial_volume)
+        self.vial_locations[sample_vial_number] = "rack"
+        self.vial_locations[filtrate_vial_number] = "rack"
+
+    def just_filter_sample_disgard_filtrate(self, sample_vial_number, sample_vial_volume):
+        self._operate("just_filter_sample_disgard_filtrate", amount=sample_vial_volume)
+
+    def filter_cleaning_packdown(self, cleaning_solvent, cleaning_solvent_volume):
+        self._operate("filter_cleaning_packdown", amount=cleaning_solvent_volume)
+
+    # Lightbox
+    def open_lightbox(self):
+        self._operate("open_lightbox")
+        self.lightbox_open = True
+
+    def close_lightbox(self):
+        self._operate("close_lightbox")
+        self.lightbox_open = False
+
+    def light_on(self):
+        self._operate("light_on")
+        self.light = True
+
+    def light_off(self):
+        self._operate("light_off")
+        self.light = False
+
+    def save_picture_from_lightbox(self, solid_name: str, dye_name: str, path: str):
+        """Save a picture of the vial: a Colorimetry dataset image of the same dye number, if there is one."""
+        self._operate("save_picture_from_lightbox")
+        if self.image_directory is None:
+            return
+        dye_number = "".join(character for character in dye_name if character.isdigit())
+        images = sorted(glob.glob(os.path.join(self.image_directory, "*", "imgs", f"*_DYE{dye_number}.*"))) if dye_number else []
+        if not images:
+            self._logger.warning(f"[simulation] No picture available for {dye_name}")
+            return
+        stamp = self.clock.strftime("%Y%m%d_%H%M%S", self.clock.localtime(self.clock.time()))
+        shutil.copyfile(images[0], os.path.join(path, f"{solid_name}_{dye_name}_{stamp}{os.path.splitext(images[0])[1]}"))
+
+    def utilisation(self, makespan: float) -> dict:
+        """Return the busy fraction of every device over ``makespan`` simulated seconds."""
+        return {device: (busy / makespan if makespan > 0 else 0.0) for device, busy in sorted(self.busy.items())}
+
+
+def install_simulated_robinhood() -> bool:
+    """
+    Make ``import robinhood`` resolve to the simulation when the RobInHood package is not installed.
+
+    ``workflow_core.station`` imports it when a step builds its own station. Returns True if the simulation was installed.
+    """
+    try:
+        import robinhood  # noqa: F401
+        return False
+    except ImportError:
+        pass
+
+    package = types.ModuleType("robinhood")
+    package.RobInHood = SimulatedStation
+    sys.modules["robinhood"] = package
+    return True
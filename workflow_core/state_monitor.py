@@ -0,0 +1,196 @@
+"""
+Background robot state monitor.
+
+The arm state is sampled into a ring buffer, so workflow steps (and the bash
+drivers, through the station session) can look at the latest pose or a recent
+history window without spawning ``read_current_state.py`` and re-handshaking
+with the arm every time.
+
+The monitor reads through the station's own robot connection when it has one
+(see ``station_robot``) and only opens a read-only connection of its own
+otherwise. Background samples are only taken while the arm is free (see the
+``gate`` argument), and ``read`` takes a single sample between motions.
+"""
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+ROBOT_HOST = "172.16.0.2"
+
+_active_monitor = None
+
+
+@dataclass
+class RobotStateSample:
+    """A single reading of the arm state."""
+
+    timestamp: float
+    pose: object
+    joints: list
+
+    def as_dict(self) -> dict:
+        """Return a plain, picklable representation of the sample."""
+        return {"timestamp": self.timestamp, "pose": str(self.pose), "joints": list(self.joints)}
+
+
+def station_robot(station):
+    """
+    Return the robot connection of ``station`` if it can be read, otherwise None.
+
+    The untraced robot is returned, so monitor reads do not show up as station calls.
+    """
+    station = getattr(station, "_target", station)
+    robot = getattr(station, "robot", None)
+    robot = getattr(robot, "_target", robot)
+    if hasattr(robot, "read_once") and hasattr(robot, "current_pose"):
+        return robot
+    return None
+
+
+class RobotStateMonitor:
+    """
+    Sample the arm state in a background thread, or on demand with ``read``.
+
+    Args:
+        robot (frankx.Robot): An existing robot connection, e.g. ``station_robot(station)``. A
+            read-only connection to ``host`` is opened on first use if None.
+        host (str): The robot address used when ``robot`` is None.
+        rate_hz (float): Sampling rate.
+        history_size (int): Number of samples kept in the ring buffer.
+        gate: Lock-like object (``acquire(blocking=False)``, ``release()``) held by whoever moves
+            the arm. Background samples are skipped while it is taken. None samples unconditionally.
+    """
+
+    def __init__(self, robot=None, host: str = ROBOT_HOST, rate_hz: float = 10.0, history_size: int = 600, gate=None):
+        self.robot = robot
+        self.host = host
+        self.gate = gate
+        self.period = 1.0 / rate_hz
+        self._buffer = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._new_sample = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+
+    def _connect(self):
+        from frankx import Robot
+
+        # Read-only: the collision and impedance settings belong to the connection that moves the arm
+        return Robot(self.host)
+
+    def _sample(self) -> RobotStateSample:
+        state = self.robot.read_once()
+        return RobotStateSample(timestamp=time.time(), pose=self.robot.current_pose(), joints=list(state.q))
+
+    def _store(self, sample: RobotStateSample) -> RobotStateSample:
+        with self._new_sample:
+            self._buffer.append(sample)
+            self._new_sample.notify_all()
+        return sample
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            if self.gate is None or self.gate.acquire(blocking=False):
+                try:
+                    self._store(self._sample())
+                except Exception as error:
+                    self.last_error = error
+                finally:
+                    if self.gate is not None:
+                        self.gate.release()
+            self._stop.wait(max(0.0, self.period - (time.monotonic() - started)))
+
+    def read(self) -> RobotStateSample:
+        """
+        Take one sample now, connecting first if needed, and add it to the buffer.
+
+        Only call this while the arm is not moving, e.g. between two workflow steps.
+
+        Returns:
+            RobotStateSample: The new sample.
+        """
+        try:
+            if self.robot is None:
+                self.robot = self._connect()
+            return self._store(self._sample())
+        except Exception as error:
+            self.last_error = error
+            raise
+
+    def start(self) -> "RobotStateMonitor":
+        """Connect (if needed) and start sampling. Registers this monitor as the active one."""
+        global _active_monitor
+
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        if self.robot is None:
+            self.robot = self._connect()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="robot-state-monitor", daemon=True)
+        self._thread.start()
+        _active_monitor = self
+        return self
+
+    def stop(self) -> None:
+        """Stop sampling and unregister the monitor."""
+        global _active_monitor
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2 * self.period + 1)
+            self._thread = None
+        if _active_monitor is self:
+            _active_monitor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def latest(self, max_age: float = None, timeout: float = 2.0) -> RobotStateSample:
+        """
+        Return the most recent sample.
+
+        Args:
+            max_age (float): If given, wait for a sample no older than this many seconds.
+            timeout (float): How long to wait for a (fresh enough) sample.
+
+        Returns:
+            RobotStateSample: The latest sample, or None if nothing arrived within ``timeout``.
+        """
+        deadline = time.monotonic() + timeout
+        with self._new_sample:
+            while True:
+                if self._buffer and (max_age is None or time.time() - self._buffer[-1].timestamp <= max_age):
+                    return self._buffer[-1]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._new_sample.wait(remaining)
+
+    def history(self, seconds: float = None) -> list:
+        """
+        Return buffered samples, oldest first.
+
+        Args:
+            seconds (float): Only return samples from the last ``seconds``. All buffered samples if None.
+
+        Returns:
+            list: RobotStateSample objects.
+        """
+        with self._lock:
+            samples = list(self._buffer)
+        if seconds is None:
+            return samples
+        cutoff = time.time() - seconds
+        return [sample for sample in samples if sample.timestamp >= cutoff]
+
+
+def current_monitor() -> RobotStateMonitor:
+    """Return the running monitor of this process, or None."""
+    return _active_monitor
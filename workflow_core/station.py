@@ -0,0 +1,243 @@
+"""
+Station construction helpers shared by the workflow scripts.
+"""
+
+import importlib.util
+import itertools
+import os
+import sys
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from workflow_core.tracing import SUB_DEVICES, devices_of, instrument, trace_from_environment
+
+# Devices of the station, named like the devices of ``workflow_core.tracing``.
+STATION_DEVICES = ("arm", "quantos", "pump", "capper", "filter", "ika", "lightbox")
+
+
+class DeviceNotDeclared(RuntimeError):
+    """Raised when a step uses a device it did not ask ``get_station`` for."""
+
+
+_modules_lock = threading.Lock()
+
+
+def _check_devices(devices: tuple) -> tuple:
+    unknown = set(devices) - set(STATION_DEVICES)
+    if unknown:
+        raise ValueError(f"Unknown devices {sorted(unknown)}, expected {list(STATION_DEVICES)}")
+    return tuple(devices)
+
+
+def _check_declared(name: str, devices: tuple) -> None:
+    used = (SUB_DEVICES[name],) if name in SUB_DEVICES else devices_of(name)
+    for device in used:
+        if device in STATION_DEVICES and device not in devices:
+            raise DeviceNotDeclared(f"{name} uses the {device}, but the step only declared {list(devices)}")
+
+
+def _build_station(logname: str, results_directory: str):
+    # Imported here so that loading a workflow script (e.g. to forward a step to the session) does not load RobInHood
+    from robinhood import RobInHood
+
+    return RobInHood(inst_logger=logname, data_path=results_directory)
+
+
+class StationGuard:
+    """
+    A station restricted to the devices a step declared.
+
+    A call to a device (``station.ika``, ``station.vial_rack_to_pump``, ...)
+    outside ``devices`` raises ``DeviceNotDeclared`` before anything moves; the
+    vial map, the logger and the other station attributes are always available.
+    The guard does not change what RobInHood connects to when it is built.
+
+    Args:
+        station (RobInHood): The station.
+        devices (tuple): Names from ``STATION_DEVICES``.
+        shared (SharedStation): The shared station the devices were claimed from, if any.
+    """
+
+    def __init__(self, station, devices: tuple, shared=None):
+        object.__setattr__(self, "_station", station)
+        object.__setattr__(self, "_devices", _check_devices(devices))
+        object.__setattr__(self, "_shared", shared)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        _check_declared(name, self._devices)
+        return getattr(self._station, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._station, name, value)
+
+
+class _DeviceLock:
+    """Lock-like view of one device of a ``SharedStation``, held by whoever acquires it."""
+
+    def __init__(self, devices, device: str):
+        self._devices = devices
+        self._device = device
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not blocking:
+            return self._devices.try_acquire((self._device,), self)
+        self._devices.acquire((self._device,), self, 0)
+        return True
+
+    def release(self) -> None:
+        self._devices.release((self._device,), self)
+
+
+class SharedStation:
+    """
+    A station shared by steps running in parallel threads, as in the station session.
+
+    A step handed a SharedStation takes the devices it declares to ``get_station``
+    (the whole station if it declares none) in one go and keeps them until
+    ``release``, so steps of different clients run side by side as long as they
+    need different devices, and wait for each other otherwise. A step that was
+    given the station by another step (e.g. ``reaction_timer`` calling
+    ``wait_reaction_timer``) only gets the devices its caller holds. A step
+    that waits (for a timer, between two moves) hands devices it does not need
+    meanwhile back with ``idle``.
+
+    Args:
+        station (RobInHood): The station.
+    """
+
+    def __init__(self, station):
+        from workflow_core.pipeline import ResourcePool
+
+        self.station = station
+        self.devices = ResourcePool(STATION_DEVICES)
+        self._held = threading.local()
+        self._arrival = itertools.count()
+
+    def held(self) -> tuple:
+        """Return the devices the step running in this thread holds, or None."""
+        return getattr(self._held, "devices", None)
+
+    def claim(self, devices: tuple) -> StationGuard:
+        """
+        Take ``devices`` for the step running in this thread, waiting until they are all free.
+
+        Raises:
+            DeviceNotDeclared: If a nested call asks for a device the step does not hold.
+        """
+        devices = _check_devices(devices)
+        held = self.held()
+        if held is None:
+            self.devices.acquire(devices, threading.get_ident(), next(self._arrival))
+            self._held.devices = devices
+        elif not set(devices) <= set(held):
+            raise DeviceNotDeclared(f"The step holds {list(held)}, a nested call asked for {sorted(set(devices) - set(held))}")
+        return StationGuard(self.station, devices, shared=self)
+
+    @contextmanager
+    def released(self, devices: tuple):
+        """Hand ``devices`` held by the step running in this thread to other steps, and take them back on exit."""
+        devices = tuple(device for device in _check_devices(devices) if device in (self.held() or ()))
+        self.devices.release(devices, threading.get_ident())
+        try:
+            yield
+        finally:
+            self.devices.acquire(devices, threading.get_ident(), next(self._arrival))
+
+    def device_lock(self, device: str) -> _DeviceLock:
+        """
+        Return a lock on one device that steps also respect, e.g. so that ``RobotStateMonitor``
+        samples the arm only while no step holds it.
+        """
+        return _DeviceLock(self.devices, _check_devices((device,))[0])
+
+    def release(self) -> None:
+        """Release the devices of the step running in this thread."""
+        self.devices.release(self.held() or (), threading.get_ident())
+        self._held.devices = None
+
+
+def idle(station, devices: tuple):
+    """
+    Return a context manager during which a step does not need ``devices``.
+
+    In the station session the devices are free for other steps meanwhile (see
+    ``SharedStation.released``); a station of its own is not shared, so nothing happens.
+
+    Args:
+        station (StationGuard): The station returned by ``get_station``.
+        devices (tuple): The devices the step does not drive until the block ends.
+    """
+    shared = station._shared if isinstance(station, StationGuard) else None
+    return nullcontext() if shared is None else shared.released(devices)
+
+
+def station_of(station):
+    """Return the station behind a ``StationGuard``, or ``station`` itself."""
+    return station._station if isinstance(station, StationGuard) else station
+
+
+def get_station(station=None, logname: str = datetime.now().strftime("%d_%m_%Y"), results_directory: str = None,
+                devices: tuple = None):
+    """
+    Return the station a workflow step should run against.
+
+    Steps accept an optional ``station`` so that a long-lived session (or a
+    runner) can hand them its own instance. When called standalone a fresh
+    RobInHood is built, which is what every step used to do, with all of its
+    devices connected: RobInHood cannot connect a subset of them. With
+    ``devices`` it comes wrapped in a ``StationGuard`` that only lets the step
+    drive the devices it named. A ``SharedStation`` first waits for the devices (all of them without
+    ``devices``). With ``WORKFLOW_TRACE`` set, the new station records a timing
+    span for every call.
+
+    Args:
+        station (RobInHood): An existing station object, or None.
+        logname (str): The name of the log file. Defaults to current date.
+        results_directory (str): The directory to save the results.
+        devices (tuple): The devices the step uses, from ``STATION_DEVICES``.
+
+    Returns:
+        RobInHood: The station object.
+    """
+    if isinstance(station, SharedStation):
+        return station.claim(STATION_DEVICES if devices is None else devices)
+    if station is not None:
+        return station
+
+    devices = None if devices is None else _check_devices(devices)
+    station = _build_station(logname, results_directory)
+    tracer = trace_from_environment()
+    if tracer is not None:
+        station = instrument(station, tracer)
+    return station if devices is None else StationGuard(station, devices)
+
+
+def load_step_module(module_path: str):
+    """
+    Import a workflow script by file path.
+
+    The scripts live in ``src/`` directories that are not packages, so they are
+    loaded from their path and cached in ``sys.modules`` under a private name.
+
+    Args:
+        module_path (str): Path to the workflow script, e.g. ``src/synthesis.py``.
+
+    Returns:
+        module: The imported script.
+    """
+    module_path = os.path.abspath(module_path)
+    name = "_workflow_" + os.path.splitext(os.path.basename(module_path))[0]
+    # The session loads scripts from several request threads
+    with _modules_lock:
+        module = sys.modules.get(name)
+        if module is not None and getattr(module, "__file__", None) == module_path:
+            return module
+
+        spec = importlib.util.spec_from_file_location(name, module_path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        return module
@@ -0,0 +1,38 @@
+"""
+Deadlock detection of the job dispatcher. Run with ``python -m pytest workflow_core``.
+"""
+
+from types import SimpleNamespace
+
+from workflow_core.dispatcher import Job, deadlock_cycle
+
+
+def job(name: str, *steps) -> Job:
+    """A planned job whose steps are ``(uses, holds)`` pairs."""
+    return Job(definition=f"conf/{name}.json", name=name,
+               steps=[SimpleNamespace(uses=uses, holds=holds) for uses, holds in steps])
+
+
+def test_jobs_holding_what_the_other_uses_deadlock():
+    synthesis = job("synthesis", (("ika",), ("ika",)), (("filter", "ika"), ()))
+    workup = job("workup", (("filter",), ("filter",)), (("ika",), ()))
+    assert sorted(deadlock_cycle([synthesis, workup])) == ["synthesis", "workup"]
+
+
+def test_cycle_through_three_jobs():
+    jobs = [job("a", (("arm", "ika"), ("ika",))),
+            job("b", (("filter", "ika"), ("filter",))),
+            job("c", (("arm", "filter"), ("arm",)))]
+    assert sorted(deadlock_cycle(jobs)) == ["a", "b", "c"]
+
+
+def test_one_holder_cannot_deadlock():
+    synthesis = job("synthesis", (("ika",), ("ika",)), (("arm", "ika"), ()))
+    dosing = job("dosing", (("arm", "quantos"), ()), (("ika",), ()))
+    assert deadlock_cycle([synthesis, dosing]) == []
+
+
+def test_steps_without_uses_take_the_whole_station():
+    holder = job("holder", (("ika",), ("ika",)), (("arm",), ()))
+    legacy = job("legacy", (None, ("arm",)))
+    assert sorted(deadlock_cycle([holder, legacy])) == ["holder", "legacy"]
@@ -0,0 +1,93 @@
+"""
+Slot allocation and rolling batches of ``hotplate_slots`` on the simulated station.
+Run with ``python -m pytest workflow_core``.
+"""
+
+from contextlib import contextmanager
+
+import pytest
+
+from workflow_core.hotplate_slots import HotplateFull, HotplateSlots, ika_slots, run_rolling
+from workflow_core.simulation import SimulatedClock, SimulatedStation, simulated_time
+
+SAMPLES = {sample: {"vial": vial} for sample, vial in ((1, 4), (2, 2), (3, 7), (4, 5))}
+
+
+@pytest.fixture
+def station():
+    clock = SimulatedClock(speedup=100000)
+    with simulated_time(clock):
+        yield SimulatedStation(sample_dict=SAMPLES, clock=clock, seed=0)
+
+
+def test_slots_default_to_the_rack_positions(tmp_path):
+    variables = str(tmp_path / "running_variables.json")
+    assert ika_slots(variables, sample_dict=SAMPLES) == [2, 4, 5, 7]
+    with pytest.raises(ValueError):
+        ika_slots(variables)
+
+
+def test_vial_goes_to_its_own_slot_while_it_is_free(tmp_path):
+    hotplate = HotplateSlots(str(tmp_path), sample_dict=SAMPLES)
+    assert hotplate.allocate(1, 4) == 4
+    assert hotplate.allocate(1, 4) == 4
+    assert hotplate.allocate(5, 4) == 2
+    assert hotplate.free_slots() == [5, 7]
+
+    full = HotplateSlots(str(tmp_path), slots=[2, 4])
+    with pytest.raises(HotplateFull):
+        full.allocate(6, 9)
+    hotplate.release(5)
+    assert full.allocate(6, 9) == 2
+
+
+def test_rolling_batch_keeps_the_plate_full(tmp_path, station):
+    hotplate = HotplateSlots(str(tmp_path), slots=[0, 1])
+    durations = {1: 18 * 3600, 2: 600, 3: 1200, 4: 600}
+    on_plate, most_on_plate, idle_waits = set(), [0], []
+
+    def load(sample, slot):
+        station.vial_rack_to_ika(SAMPLES[sample]["vial"], ika_slot_number=slot)
+        on_plate.add(sample)
+        most_on_plate[0] = max(most_on_plate[0], len(on_plate))
+
+    def unload(sample, slot):
+        station.vial_ika_to_rack(SAMPLES[sample]["vial"], ika_slot_number=slot)
+        on_plate.discard(sample)
+
+    @contextmanager
+    def idle():
+        idle_waits.append(sorted(on_plate))
+        yield
+
+    reacted = run_rolling(hotplate, list(SAMPLES), durations.get, load, unload,
+                          vial_of=lambda sample: SAMPLES[sample]["vial"], idle=idle)
+
+    assert sorted(reacted) == [1, 2, 3, 4]
+    for sample, (seconds, slot) in reacted.items():
+        assert seconds >= durations[sample]
+        assert slot in (0, 1)
+    assert most_on_plate[0] == 2
+    # Samples 2, 3 and 4 take turns on one slot while sample 1 reacts on the other
+    assert idle_waits[0] == [1, 2]
+    assert all(1 in waiting for waiting in idle_waits)
+    assert hotplate.occupants() == {}
+    assert all(station.vial_locations[SAMPLES[sample]["vial"]] == "rack" for sample in SAMPLES)
+
+
+def test_interrupted_batch_resumes_with_the_remaining_time(tmp_path, station):
+    hotplate = HotplateSlots(str(tmp_path), slots=[0, 1])
+    hotplate.allocate(2, 2)
+    hotplate.start_timer(2, 600)
+    hotplate.release(1, batch="reaction")
+    loaded = []
+
+    reacted = run_rolling(hotplate, [1, 2, 3], lambda sample: 600,
+                          lambda sample, slot: loaded.append(sample),
+                          lambda sample, slot: None)
+
+    # Sample 1 came off before the interruption, sample 2 is still on its slot
+    assert loaded == [3]
+    assert sorted(reacted) == [2, 3]
+    assert all(seconds >= 600 for seconds, _ in reacted.values())
+    assert hotplate.completed("reaction") == []
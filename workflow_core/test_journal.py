@@ -0,0 +1,65 @@
+"""
+Resuming a run with ``journal.StepJournal``. Run with ``python -m pytest workflow_core``.
+"""
+
+import pytest
+
+from workflow_core.journal import StepJournal, step_signature
+from workflow_core.results_store import RESULTS_DB_ENV
+from workflow_core.running_variables import RunningVariables
+
+
+class Step:
+    """A step that counts its calls and fails on the calls listed in ``failing``."""
+
+    __name__ = "wait_for_temperature"
+
+    def __init__(self, failing=()):
+        self.calls = 0
+        self.failing = set(failing)
+
+    def __call__(self, temperature):
+        self.calls += 1
+        if self.calls in self.failing:
+            raise RuntimeError(f"call {self.calls} failed")
+        return self.calls
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setenv(RESULTS_DB_ENV, str(tmp_path / "results.sqlite"))
+    journal = StepJournal(str(tmp_path), RunningVariables(str(tmp_path / "running_variables.json")))
+    journal.start_run("test")
+    return journal
+
+
+def test_identical_calls_are_numbered_per_pass(journal):
+    signature = step_signature("heat_stirr", {"temperature": 30})
+    assert [journal.claim("heat_stirr", {"temperature": 30}) for _ in range(2)] == [f"{signature}#0", f"{signature}#1"]
+    assert journal.claim("heat_stirr", {"temperature": 110}) == f"{step_signature('heat_stirr', {'temperature': 110})}#0"
+
+    journal.resume_run()
+    assert journal.claim("heat_stirr", {"temperature": 30}) == f"{signature}#0"
+
+
+def test_resume_skips_completed_calls_and_repeats_the_failed_one(journal):
+    step = Step(failing={3})
+    assert [journal.run_once(step, {"temperature": 30}) for _ in range(2)] == [1, 2]
+    with pytest.raises(RuntimeError):
+        journal.run_once(step, {"temperature": 30})
+
+    journal.resume_run()
+    results = [journal.run_once(step, {"temperature": 30}) for _ in range(3)]
+    # The first two calls return their journaled results, the third runs again
+    assert results == [1, 2, 4]
+    assert step.calls == 4
+
+
+def test_new_run_forgets_completed_steps(journal):
+    step = Step()
+    journal.run_once(step, {"temperature": 30}, sample=1, location="hotplate")
+    assert journal.vial_locations() == {1: "hotplate"}
+
+    journal.start_run("test")
+    assert journal.completed() == {}
+    assert journal.run_once(step, {"temperature": 30}) == 2
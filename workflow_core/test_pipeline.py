@@ -0,0 +1,88 @@
+"""
+Grant order and abort of ``pipeline.ResourcePool``. Run with ``python -m pytest workflow_core``.
+"""
+
+import threading
+import time
+
+import pytest
+
+from workflow_core.pipeline import ResourcePool, _Aborted
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def start_waiter(pool: ResourcePool, names, owner, priority, granted: list) -> threading.Thread:
+    """Acquire ``names`` in a thread, append ``owner`` to ``granted`` and release them again."""
+    def waiter():
+        try:
+            pool.acquire(names, owner, priority)
+        except _Aborted:
+            granted.append((owner, "aborted"))
+            return
+        granted.append(owner)
+        pool.release(names, owner)
+
+    thread = threading.Thread(target=waiter, daemon=True)
+    thread.start()
+    wait_until(lambda: owner in pool._waiting)
+    return thread
+
+
+def test_waiters_are_granted_by_priority():
+    pool = ResourcePool(("arm", "ika"))
+    pool.acquire(("arm",), "holder", 0)
+    granted = []
+    threads = [start_waiter(pool, ("arm",), owner, priority, granted) for owner, priority in (("late", 2), ("early", 1))]
+
+    pool.release(("arm",), "holder")
+    for thread in threads:
+        thread.join(timeout=5)
+    assert granted == ["early", "late"]
+
+
+def test_lower_priority_waiter_on_free_resources_is_not_held_back():
+    pool = ResourcePool(("arm", "ika"))
+    pool.acquire(("arm",), "holder", 0)
+    granted = []
+    blocked = start_waiter(pool, ("arm", "ika"), "blocked", 1, granted)
+
+    # "blocked" cannot be granted right now, so it does not keep the IKA from a later request
+    pool.acquire(("ika",), "other", 2)
+    pool.release(("ika",), "other")
+    pool.release(("arm",), "holder")
+    blocked.join(timeout=5)
+    assert granted == ["blocked"]
+
+
+def test_try_acquire_does_not_jump_the_queue():
+    pool = ResourcePool(("arm", "ika"))
+    pool.acquire(("ika",), "holder", 0)
+    granted = []
+    thread = start_waiter(pool, ("arm", "ika"), "waiter", 1, granted)
+
+    # The arm is free, but a step is waiting for it
+    assert not pool.try_acquire(("arm",), "monitor")
+    pool.release(("ika",), "holder")
+    thread.join(timeout=5)
+    assert granted == ["waiter"]
+    assert pool.try_acquire(("arm",), "monitor")
+
+
+def test_abort_wakes_waiters():
+    pool = ResourcePool(("arm",))
+    pool.acquire(("arm",), "holder", 0)
+    granted = []
+    thread = start_waiter(pool, ("arm",), "waiter", 1, granted)
+
+    pool.abort()
+    thread.join(timeout=5)
+    assert granted == [("waiter", "aborted")]
+    with pytest.raises(_Aborted):
+        pool.acquire(("ika",), "late", 2)
+    assert not pool.try_acquire(("ika",), "late")
@@ -0,0 +1,63 @@
+"""
+Prime decisions of ``pump_lines`` against the simulated station.
+Run with ``python -m pytest workflow_core``.
+"""
+
+import pytest
+
+from workflow_core.pump_lines import PUMP_LINES, PumpLineState, order_by_solvent, prime_if_needed, record_line_use
+from workflow_core.simulation import SimulatedStation
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = PumpLineState(str(tmp_path / "running_variables.json"))
+    state.save({line: None for line in PUMP_LINES})
+    return state
+
+
+@pytest.fixture
+def station():
+    return SimulatedStation(speedup=100000, seed=0)
+
+
+def test_known_line_skips_the_prime(state, station):
+    state.mark_primed("water", "pump_1_primed_solvent")
+    assert not prime_if_needed(station, "water", state)
+    assert station.calls.get("pump_prime_dispense_tubing") is None
+
+
+def test_unknown_line_primes_every_time(state, station):
+    # RobInHood does not say which line it primed, so no line is trusted afterwards
+    assert prime_if_needed(station, "water", state)
+    assert state.primed_solvents() == {line: None for line in PUMP_LINES}
+    assert prime_if_needed(station, "water", state)
+    assert station.calls["pump_prime_dispense_tubing"] == 2
+
+
+def test_line_recorded_by_robinhood_is_kept(state, station):
+    real_prime = station.pump_prime_dispense_tubing
+
+    def prime_and_record(chemical):
+        real_prime(chemical)
+        state.update(pump_2_primed_solvent=chemical)
+
+    station.pump_prime_dispense_tubing = prime_and_record
+    assert prime_if_needed(station, "ethanol", state)
+    assert state.line_for("ethanol") == "pump_2_primed_solvent"
+    assert not prime_if_needed(station, "ethanol", state)
+
+
+def test_routine_using_another_solvent_forgets_the_lines(state):
+    state.mark_primed("water", "pump_1_primed_solvent")
+    record_line_use("water", state)
+    assert state.line_for("water") == "pump_1_primed_solvent"
+
+    record_line_use("ethanol", state)
+    assert state.primed_solvents() == {line: None for line in PUMP_LINES}
+
+
+def test_dispenses_are_grouped_by_solvent_primed_first():
+    dispenses = [("water", 1), ("ethanol", 2), ("water", 3), ("ethanol", 4)]
+    ordered = order_by_solvent(dispenses, lambda dispense: dispense[0], {"pump_1_primed_solvent": "ethanol"})
+    assert ordered == [("ethanol", 2), ("ethanol", 4), ("water", 1), ("water", 3)]
@@ -0,0 +1,46 @@
+"""
+Persisted reaction timers of ``timers.TimerStore`` on the simulated clock.
+Run with ``python -m pytest workflow_core``.
+"""
+
+import pytest
+
+from workflow_core.simulation import SimulatedClock, simulated_time
+from workflow_core.timers import TimerStore, wait_for_timer
+
+
+@pytest.fixture
+def clock():
+    with simulated_time(SimulatedClock(speedup=100000)) as clock:
+        yield clock
+
+
+def test_restarted_timer_keeps_its_deadline(tmp_path, clock):
+    timer = TimerStore(str(tmp_path)).start("reaction", 18 * 3600)
+    clock.sleep(3600)
+
+    # A restarted controller starts the same timer again, with a new store on the same directory
+    resumed = TimerStore(str(tmp_path)).start("reaction", 18 * 3600)
+    assert resumed.deadline == timer.deadline
+    # The simulated clock runs on while the test does, so only an hour has to be gone
+    assert 16 * 3600 < resumed.remaining() <= 17 * 3600
+
+
+def test_finished_timer_is_started_again(tmp_path, clock):
+    store = TimerStore(str(tmp_path))
+    timer = store.start("reaction", 600)
+    wait_for_timer(timer)
+    store.finish("reaction")
+    assert store.pending() == []
+
+    restarted = store.start("reaction", 600)
+    assert restarted.deadline > timer.deadline
+    assert [pending.name for pending in store.pending()] == ["reaction"]
+
+
+def test_reset_forgets_running_timers(tmp_path, clock):
+    store = TimerStore(str(tmp_path))
+    timer = store.start("reaction", 600)
+    store.reset()
+    clock.sleep(60)
+    assert store.start("reaction", 600).deadline > timer.deadline
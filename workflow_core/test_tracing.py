@@ -0,0 +1,35 @@
+"""
+Consistency of the device attribution in ``tracing`` with the simulated station.
+
+Spans, the utilisation report, ``SerializedStation`` and ``StationGuard`` all
+take the devices of a station call from ``tracing.devices_of``. A call that
+moves a vial drives the arm, whatever else it drives. Run with
+``python -m pytest workflow_core``.
+"""
+
+import inspect
+
+import pytest
+
+from workflow_core import tracing
+from workflow_core.simulation import OPERATIONS, SimulatedStation
+
+CALLS = sorted(set(OPERATIONS) | set(tracing.MULTI_DEVICE_CALLS))
+
+
+def moves_vial(name: str) -> bool:
+    """Return True if the station call ``name`` picks a vial up: a transfer, or a routine given a vial."""
+    # Methods of the sub-devices (robot, Quantos, IKA) are not station routines
+    method = getattr(SimulatedStation, name, None)
+    parameters = inspect.signature(method).parameters if method is not None else {}
+    return name.startswith("vial_") or any(argument in parameters for argument in tracing.VIAL_ARGUMENTS)
+
+
+@pytest.mark.parametrize("name", [name for name in CALLS if moves_vial(name)])
+def test_vial_moves_use_the_arm(name):
+    assert "arm" in tracing.devices_of(name)
+
+
+@pytest.mark.parametrize("name", [name for name in OPERATIONS if tracing.device_of(name) != "station"])
+def test_simulated_devices_match_tracing(name):
+    assert set(OPERATIONS[name][0]) == set(tracing.devices_of(name))
@@ -0,0 +1,126 @@
+"""
+Persisted reaction timers.
+
+A reaction timer is stored as an absolute deadline (epoch seconds) in
+``timers.json`` in the results directory instead of a sleeping
+``robinhood.utils.timer.Timer``. Starting a timer returns immediately, so the
+station can run other steps while the reaction runs, and a restarted
+controller that starts or waits on the same timer continues with the time
+that is left instead of restarting the clock.
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+TIMERS_FILE = "timers.json"
+
+_lock = threading.RLock()
+
+
+@dataclass
+class ReactionTimer:
+    """A named timer with an absolute deadline."""
+
+    name: str
+    started: float
+    deadline: float
+    finished: bool = False
+
+    def remaining(self) -> float:
+        """Return the seconds left, 0 once the deadline has passed."""
+        return max(0.0, self.deadline - time.time())
+
+
+class TimerStore:
+    """
+    Read and update the timers of a results directory.
+
+    Args:
+        results_directory (str): The directory holding ``timers.json``.
+    """
+
+    def __init__(self, results_directory: str):
+        self.path = os.path.join(results_directory, TIMERS_FILE)
+
+    def load(self) -> dict:
+        """Return ``{name: ReactionTimer}``, empty if no timer was ever started."""
+        with _lock:
+            if not os.path.exists(self.path):
+                return {}
+            with open(self.path) as timers_file:
+                return {name: ReactionTimer(**timer) for name, timer in json.load(timers_file).items()}
+
+    def save(self, timers: dict) -> None:
+        """Replace the stored timers."""
+        with _lock:
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as timers_file:
+                json.dump({name: asdict(timer) for name, timer in timers.items()}, timers_file, indent=4)
+            os.replace(temporary, self.path)
+
+    def get(self, name: str) -> ReactionTimer:
+        return self.load().get(name)
+
+    def start(self, name: str, seconds: float) -> ReactionTimer:
+        """
+        Start the timer ``name`` unless it is already running.
+
+        A running timer (not yet marked finished) is returned unchanged, so
+        re-running the step after a restart resumes the remaining time. A
+        finished timer of the same name is replaced by a new one.
+
+        Args:
+            name (str): The timer name.
+            seconds (float): The duration of a new timer.
+
+        Returns:
+            ReactionTimer: The running timer.
+        """
+        with _lock:
+            timers = self.load()
+            timer = timers.get(name)
+            if timer is None or timer.finished:
+                now = time.time()
+                timer = ReactionTimer(name=name, started=now, deadline=now + seconds)
+                timers[name] = timer
+                self.save(timers)
+            return timer
+
+    def finish(self, name: str) -> None:
+        """Mark the timer ``name`` as done."""
+        with _lock:
+            timers = self.load()
+            if name in timers:
+                timers[name].finished = True
+                self.save(timers)
+
+    def reset(self) -> None:
+        """Forget every timer, for a new run that must not pick up the deadline of an aborted one."""
+        with _lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def pending(self) -> list:
+        """Return the unfinished timers, earliest deadline first."""
+        return sorted((timer for timer in self.load().values() if not timer.finished), key=lambda timer: timer.deadline)
+
+
+def wait_for_timer(timer: ReactionTimer, logger=None, log_interval: float = 600.0) -> None:
+    """
+    Block until the deadline of ``timer``, logging the remaining time every ``log_interval`` seconds.
+
+    Args:
+        timer (ReactionTimer): The timer to wait for.
+        logger (logging.Logger): Logger for progress messages.
+        log_interval (float): Seconds between progress messages.
+    """
+    while True:
+        remaining = timer.remaining()
+        if remaining <= 0:
+            return
+        if logger is not None:
+            logger.info(f"Timer {timer.name}: {remaining / 60:.1f} min remaining")
+        time.sleep(min(remaining, log_interval))
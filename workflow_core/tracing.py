@@ -0,0 +1,337 @@
+"""
+Timing spans for every station call.
+
+``instrument`` wraps a station so that each call of a station or device method
+(``vial_rack_to_quantos``, ``quantos_dosing``, ``dispense_volume``,
+``ika.get_temperature``, ...) records a span: the operation, the device it
+occupies, its start and end, and the step, sample and vial it was made for.
+The step and sample come from ``context``, which the runner, the session and
+the pipeline scheduler set around each step and stage; the vial is taken from
+the call arguments.
+
+``get_station`` instruments the station it builds when ``WORKFLOW_TRACE`` names
+a directory; spans are then appended to ``trace_spans.jsonl`` there, so the
+spans of the bash step processes and the session end up in one file. Export
+them as a Chrome/Perfetto trace (one track per device) and print the time per
+device, its idle time, the time per operation and the per-sample critical path:
+
+    python -m workflow_core.tracing data --chrome data/trace.json
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+TRACE_FILE = "trace_spans.jsonl"
+TRACE_ENV = "WORKFLOW_TRACE"
+
+# Device of a station method, by name prefix; the first match wins.
+DEVICE_PREFIXES = (
+    ("vial_decap", "capper"),
+    ("vial_", "arm"),
+    ("quantos", "quantos"),
+    ("pump_", "pump"),
+    ("dispense_", "pump"),
+    ("hold_position", "pump"),
+    ("infuse_position", "pump"),
+    ("filter", "filter"),
+    ("filtration", "filter"),
+    ("just_filter", "filter"),
+    ("cap", "capper"),
+    ("open_lightbox", "lightbox"),
+    ("close_lightbox", "lightbox"),
+    ("light_", "lightbox"),
+    ("save_picture", "lightbox"),
+)
+# Station methods that drive more devices than the one they are traced as.
+MULTI_DEVICE_CALLS = {
+    "vial_decap": ("arm", "capper"),
+    "quantos_cartridge_handling_logic": ("arm", "quantos"),
+    "filtration_prep": ("arm", "pump", "filter"),
+    "filter_sample_collect_filtrate": ("arm", "pump", "filter"),
+    "just_filter_sample_disgard_filtrate": ("arm", "filter"),
+    "filter_cleaning_packdown": ("arm", "pump", "filter"),
+}
+# Sub-devices of the station whose methods are traced as that device.
+SUB_DEVICES = {"ika": "ika", "quantos": "quantos", "robot": "arm", "pump": "pump"}
+VIAL_ARGUMENTS = ("vial_number", "vial_pos", "sample_vial_number")
+# Station methods that do not drive hardware.
+UNTRACED = {"record_weight"}
+
+_context = threading.local()
+
+
+@dataclass
+class Span:
+    """A timed station call."""
+
+    name: str
+    device: str
+    start: float
+    end: float
+    thread: str = None
+    step: str = None
+    sample: object = None
+    vial: int = None
+    pid: int = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def current_context() -> dict:
+    """Return the step/sample attributes set by the enclosing ``context`` blocks of this thread."""
+    merged = {}
+    for attributes in getattr(_context, "stack", []):
+        merged.update(attributes)
+    return merged
+
+
+@contextmanager
+def context(**attributes):
+    """Attach attributes (``step``, ``sample``) to the spans recorded by this thread inside the block."""
+    stack = getattr(_context, "stack", None)
+    if stack is None:
+        stack = _context.stack = []
+    stack.append({key: value for key, value in attributes.items() if value is not None})
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def device_of(name: str) -> str:
+    """Return the device a station method occupies, or ``station`` if unknown."""
+    for prefix, device in DEVICE_PREFIXES:
+        if name.startswith(prefix):
+            return device
+    return "station"
+
+
+def devices_of(name: str) -> tuple:
+    """Return every device a station method drives, e.g. the arm and the Quantos for a cartridge swap."""
+    return MULTI_DEVICE_CALLS.get(name, (device_of(name),))
+
+
+def _vial(args: tuple, kwargs: dict):
+    for key in VIAL_ARGUMENTS:
+        if isinstance(kwargs.get(key), int):
+            return kwargs[key]
+    if args and isinstance(args[0], int) and not isinstance(args[0], bool):
+        return args[0]
+    return None
+
+
+class Tracer:
+    """
+    Collect spans in memory and optionally append them to a JSON-lines file.
+
+    Args:
+        path (str): File the spans are appended to, or None to keep them in memory only.
+        clock: Object with a ``time()`` function, e.g. a ``SimulatedClock``. Defaults to ``time``.
+    """
+
+    def __init__(self, path: str = None, clock=time):
+        self.path = path
+        self.clock = clock
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, device: str, vial: int = None):
+        """Record the enclosed block as a span."""
+        start = self.clock.time()
+        try:
+            yield
+        finally:
+            attributes = current_context()
+            span = Span(name=name, device=device, start=start, end=self.clock.time(), thread=threading.current_thread().name,
+                        step=attributes.get("step"), sample=attributes.get("sample"), vial=vial, pid=os.getpid())
+            self.add(span)
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+            if self.path is not None:
+                with open(self.path, "a") as trace_file:
+                    trace_file.write(json.dumps(asdict(span), default=str) + "\n")
+
+
+class _Traced:
+    """Proxy recording a span around every public method call of the wrapped object."""
+
+    def __init__(self, target, tracer: Tracer, device: str = None, prefix: str = ""):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_tracer", tracer)
+        object.__setattr__(self, "_device", device)
+        object.__setattr__(self, "_prefix", prefix)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name.startswith("_"):
+            return value
+        if self._device is None and name in SUB_DEVICES:
+            return _Traced(value, self._tracer, SUB_DEVICES[name], f"{name}.")
+        if not callable(value) or name in UNTRACED:
+            return value
+
+        def traced(*args, **kwargs):
+            with self._tracer.span(self._prefix + name, self._device or device_of(name), vial=_vial(args, kwargs)):
+                return value(*args, **kwargs)
+
+        return traced
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+def sample_of(kwargs: dict, item=None):
+    """Return the sample a step call works on: its ``sample_number``/``vial_pos`` argument or its ``for_each`` item."""
+    for key in ("sample_number", "vial_pos"):
+        if kwargs.get(key) is not None:
+            return kwargs[key]
+    return item if isinstance(item, (int, str)) else None
+
+
+def instrument(station, tracer: Tracer):
+    """Return ``station`` wrapped so every station and device call records a span in ``tracer``."""
+    return _Traced(station, tracer)
+
+
+def trace_from_environment():
+    """Return a tracer appending to ``trace_spans.jsonl`` in ``WORKFLOW_TRACE``, or None if it is not set."""
+    directory = os.environ.get(TRACE_ENV)
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return Tracer(os.path.join(directory, TRACE_FILE))
+
+
+def load_spans(path: str) -> list:
+    """Read the spans of a ``trace_spans.jsonl`` file. A truncated last line is ignored."""
+    spans = []
+    with open(path) as trace_file:
+        for line in trace_file:
+            try:
+                spans.append(Span(**json.loads(line)))
+            except (json.JSONDecodeError, TypeError):
+                continue
+    return spans
+
+
+def chrome_trace(spans: list) -> dict:
+    """Return the spans as a Chrome/Perfetto trace with one track per device."""
+    devices = sorted({span.device for span in spans})
+    origin = min((span.start for span in spans), default=0.0)
+    events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": index, "args": {"name": device}}
+              for index, device in enumerate(devices)]
+    for span in spans:
+        events.append({"name": span.name, "cat": span.device, "ph": "X", "pid": 1, "tid": devices.index(span.device),
+                       "ts": (span.start - origin) * 1e6, "dur": span.duration * 1e6,
+                       "args": {"step": span.step, "sample": span.sample, "vial": span.vial, "thread": span.thread}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _union(intervals: list) -> float:
+    """Return the total length covered by ``(start, end)`` intervals."""
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def summarise(spans: list) -> dict:
+    """
+    Summarise spans.
+
+    Returns:
+        dict: ``makespan``; ``devices`` with busy and idle seconds per device; ``operations`` with
+        count and total seconds per operation; ``samples`` with, per sample, the elapsed time from
+        its first to its last call, the time a device was working on it, the time it waited and
+        its seconds per device (the critical path of that sample).
+    """
+    if not spans:
+        return {"makespan": 0.0, "devices": {}, "operations": {}, "samples": {}}
+    started = min(span.start for span in spans)
+    makespan = max(span.end for span in spans) - started
+
+    by_device = defaultdict(list)
+    by_operation = defaultdict(list)
+    by_sample = defaultdict(list)
+    for span in spans:
+        by_device[span.device].append(span)
+        by_operation[(span.device, span.name)].append(span)
+        if span.sample is not None:
+            by_sample[span.sample].append(span)
+
+    devices = {}
+    for device, device_spans in sorted(by_device.items()):
+        busy = _union([(span.start, span.end) for span in device_spans])
+        devices[device] = {"busy": busy, "idle": makespan - busy, "utilisation": busy / makespan if makespan else 0.0}
+
+    operations = {f"{device}/{name}": {"count": len(operation_spans), "total": sum(span.duration for span in operation_spans)}
+                  for (device, name), operation_spans in by_operation.items()}
+
+    samples = {}
+    for sample, sample_spans in by_sample.items():
+        elapsed = max(span.end for span in sample_spans) - min(span.start for span in sample_spans)
+        active = _union([(span.start, span.end) for span in sample_spans])
+        per_device = defaultdict(float)
+        for span in sample_spans:
+            per_device[span.device] += span.duration
+        samples[sample] = {"elapsed": elapsed, "active": active, "waiting": elapsed - active, "devices": dict(per_device)}
+
+    return {"makespan": makespan, "devices": devices, "operations": operations, "samples": samples}
+
+
+def format_summary(summary: dict, top: int = 15) -> str:
+    """Return a readable report of ``summarise``."""
+    lines = [f"Makespan: {summary['makespan'] / 60:.1f} min", "", f"{'device':<10} {'busy (min)':>11} {'idle (min)':>11} {'used':>7}"]
+    for device, usage in summary["devices"].items():
+        lines.append(f"{device:<10} {usage['busy'] / 60:>11.1f} {usage['idle'] / 60:>11.1f} {100 * usage['utilisation']:>6.1f}%")
+
+    lines += ["", f"{'operation':<45} {'calls':>6} {'total (min)':>12}"]
+    operations = sorted(summary["operations"].items(), key=lambda item: item[1]["total"], reverse=True)
+    for name, operation in operations[:top]:
+        lines.append(f"{name:<45} {operation['count']:>6} {operation['total'] / 60:>12.1f}")
+
+    if summary["samples"]:
+        lines += ["", f"{'sample':<8} {'elapsed (min)':>14} {'active':>8} {'waiting':>8}  busiest device"]
+        for sample, path in sorted(summary["samples"].items(), key=lambda item: str(item[0])):
+            device, seconds = max(path["devices"].items(), key=lambda item: item[1])
+            lines.append(f"{str(sample):<8} {path['elapsed'] / 60:>14.1f} {path['active'] / 60:>8.1f} {path['waiting'] / 60:>8.1f}"
+                         f"  {device} ({seconds / 60:.1f} min)")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarise the station call spans of a results directory")
+    parser.add_argument("results_directory", help=f"Directory holding {TRACE_FILE}")
+    parser.add_argument("--chrome", help="Write a Chrome/Perfetto trace (JSON) to this file")
+    args = parser.parse_args(argv)
+
+    spans = load_spans(os.path.join(args.results_directory, TRACE_FILE))
+    print(format_summary(summarise(spans)))
+    if args.chrome:
+        with open(args.chrome, "w") as chrome_file:
+            json.dump(chrome_trace(spans), chrome_file)
+        print(f"\n[INFO] Chrome trace written to {args.chrome} (open in ui.perfetto.dev or chrome://tracing)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Vial transfers between the stations of the RobInHood.
+
+The steps used to move a vial to the station every operation needs and
+straight back to the rack afterwards, so consecutive operations on the same
+vial paid for a rack round-trip in between (``vial_pump_to_rack`` followed by
+``vial_rack_to_pump``) and chains such as capper -> pump -> rack where the arm
+can go capper -> rack directly. ``run_chain`` takes the operations of one vial
+in order, each with the station it needs the vial at, and moves the vial along
+the shortest route of transfer primitives (``TRANSFERS``) from one operation
+to the next, parking it in the rack only at the end.
+
+Station routines that move the vial themselves say where they leave it:
+``vial_decap`` takes the vial from the rack and leaves it decapped at the pump,
+and the filter routines take it from the rack and put it back there.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+
+RACK = "rack"
+
+# (from, to) -> (station method, takes the rack position of the vial)
+TRANSFERS = {
+    ("rack", "quantos"): ("vial_rack_to_quantos", True),
+    ("quantos", "rack"): ("vial_quantos_to_rack", True),
+    ("quantos", "pump"): ("vial_quantos_to_pump", False),
+    ("rack", "pump"): ("vial_rack_to_pump", True),
+    ("pump", "rack"): ("vial_pump_to_rack", True),
+    ("pump", "capper"): ("vial_pump_to_capper", False),
+    ("capper", "pump"): ("vial_capper_to_pump", False),
+    ("capper", "rack"): ("vial_capper_to_rack", True),
+    ("pump", "lightbox"): ("vial_pump_to_lightbox", False),
+    ("lightbox", "pump"): ("vial_lightbox_to_pump", False),
+}
+
+
+@dataclass
+class Operation:
+    """
+    An operation on a vial.
+
+    Args:
+        location (str): Where the vial has to be for the operation.
+        action (callable): Called without arguments once the vial is there.
+        leaves_at (str): Where the action itself leaves the vial, if it moves it (e.g. ``vial_decap``).
+    """
+
+    location: str
+    action: callable
+    leaves_at: str = None
+
+
+def route(origin: str, destination: str) -> list:
+    """
+    Return the shortest list of ``(from, to)`` transfers from ``origin`` to ``destination``.
+
+    Raises:
+        ValueError: If no chain of transfer primitives connects the two stations.
+    """
+    previous = {origin: None}
+    queue = deque([origin])
+    while queue:
+        location = queue.popleft()
+        if location == destination:
+            break
+        for start, end in TRANSFERS:
+            if start == location and end not in previous:
+                previous[end] = location
+                queue.append(end)
+    if destination not in previous:
+        raise ValueError(f"No transfer from {origin} to {destination}")
+
+    path = []
+    location = destination
+    while previous[location] is not None:
+        path.append((previous[location], location))
+        location = previous[location]
+    return path[::-1]
+
+
+def plan_chain(operations: list, start: str = RACK, final: str = RACK) -> list:
+    """
+    Return the transfers ``run_chain`` makes for ``operations``, without moving anything.
+
+    Args:
+        operations (list): Operation objects, in order.
+        start (str): Where the vial is.
+        final (str): Where the vial is parked at the end.
+
+    Returns:
+        list: ``(from, to)`` transfers, in order.
+    """
+    transfers = []
+    location = start
+    for operation in operations:
+        transfers += route(location, operation.location)
+        location = operation.leaves_at or operation.location
+    return transfers + route(location, final)
+
+
+def parked_transfers(operations: list) -> int:
+    """Return the number of transfers when the vial goes back to the rack after every operation."""
+    return sum(len(plan_chain([operation])) for operation in operations)
+
+
+def move(station, vial: int, origin: str, destination: str) -> int:
+    """Move ``vial`` along the shortest route and return the number of transfers made."""
+    transfers = route(origin, destination)
+    for transfer in transfers:
+        method, takes_vial = TRANSFERS[transfer]
+        if takes_vial:
+            getattr(station, method)(vial)
+        else:
+            getattr(station, method)()
+    return len(transfers)
+
+
+def run_chain(station, vial: int, operations: list, start: str = RACK, final: str = RACK) -> int:
+    """
+    Run the operations of one vial, moving it only where the next operation needs it.
+
+    Args:
+        station (RobInHood): The RobInHood station object.
+        vial (int): Rack position of the vial.
+        operations (list): Operation objects, in order.
+        start (str): Where the vial is.
+        final (str): Where the vial is parked at the end.
+
+    Returns:
+        int: The number of transfers made.
+    """
+    made = 0
+    location = start
+    for operation in operations:
+        made += move(station, vial, location, operation.location)
+        operation.action()
+        location = operation.leaves_at or operation.location
+    made += move(station, vial, location, final)
+
+    parked = parked_transfers(operations)
+    if made < parked:
+        station._logger.info(f"Vial {vial}: {made} transfers ({parked} when parked between operations)")
+    return made